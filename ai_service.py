@@ -1,82 +1,222 @@
+import asyncio
 import os
+import random
+import time
+import httpx
 import openai
-from typing import List, Dict
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Tuple
 
-class AIService:
-    def __init__(self):
-        openai.api_key = os.getenv('OPENAI_API_KEY')
-        
-    def search_documents(self, query: str, documents: List[Dict]) -> str:
-        """Поиск по документам с помощью OpenAI"""
-        try:
-            # Формируем контекст из документов
-            context = self._prepare_context(documents)
-            
-            # Создаем промпт для поиска
-            prompt = f"""
+from context_builder import OPENAI_MODEL, ContextBuilder
+from metrics import Counter, Histogram, stage
+
+ANSWER_MAX_TOKENS = 500
+SUMMARY_MAX_TOKENS = 150
+SUMMARY_CONTEXT_TOKENS = 1000  # сколько токенов документа отдаем на краткое описание
+
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # например, локальный OpenAI-совместимый сервер
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '4'))
+RETRY_BASE_DELAY = 0.5  # секунды, удваивается с каждой попыткой
+RETRY_MAX_DELAY = 20.0
+
+LLM_TOKENS = Counter('bot_llm_tokens_total', 'Токены OpenAI', ['type'])
+LLM_RETRIES = Counter('bot_llm_retries_total', 'Повторы запросов к OpenAI', ['error'])
+LLM_FIRST_TOKEN_SECONDS = Histogram('bot_llm_first_token_seconds', 'Время до первого токена потокового ответа')
+
+SYSTEM_PROMPT = "Ты помощник по работе с корпоративными документами. Отвечай кратко и по существу."
+SEARCH_PROMPT = """
             Контекст из документов:
             {context}
-            
+
             Вопрос пользователя: {query}
-            
-            Ответь на вопрос пользователя, используя информацию из предоставленных документов. 
+
+            Ответь на вопрос пользователя, используя информацию из предоставленных документов.
             Если в документах нет информации для ответа, скажи об этом.
             Отвечай кратко и по существу.
             """
-            
+
+
+def _is_retryable(error: Exception) -> bool:
+    """429, 5xx, таймауты и обрывы соединения имеет смысл повторить"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Экспоненциальная задержка с джиттером; Retry-After от сервера имеет приоритет"""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY) * random.uniform(0.5, 1.0)
+
+
+def _count_tokens(usage: Dict):
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        if usage.get(kind):
+            LLM_TOKENS.inc(kind.split('_')[0], amount=usage[kind])
+
+
+class AnswerStream:
+    """Потоковый ответ LLM: async-итератор по фрагментам текста.
+
+    После завершения итерации доступны answer, sources и usage — как у search_documents.
+    """
+
+    def __init__(self, service: 'AIService', messages: List[Dict], sources: List[Dict], usage: Dict):
+        self._service = service
+        self._messages = messages
+        self.sources = sources
+        self.usage = usage
+        self.answer = ''
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        with stage('llm.stream'):
+            started = time.perf_counter()
+            # Повторяем только установку потока: после первого токена ответ уже виден пользователю
+            stream = await self._service._with_retries(lambda: self._service.client.chat.completions.create(
+                model=self._service.model,
+                messages=self._messages,
+                max_tokens=ANSWER_MAX_TOKENS,
+                temperature=0.7,
+                stream=True
+            ))
+            parts = []
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                    parts.append(delta)
+                    self.answer = ''.join(parts)
+                    yield delta
+        self.answer = self.answer.strip()
+        self.usage['completion_tokens'] = self._service.context_builder.counter.count(self.answer)
+        _count_tokens(self.usage)
+
+
+class AIService:
+    def __init__(self, context_builder: ContextBuilder = None, client: openai.AsyncOpenAI = None):
+        self.model = OPENAI_MODEL
+        self.context_builder = context_builder or ContextBuilder()
+        # Один клиент на процесс: общий пул HTTP-соединений с keep-alive.
+        # Повторы делаем сами, чтобы учитывать Retry-After и не повторять начатый поток.
+        self.client = client or openai.AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=OPENAI_BASE_URL or None,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS)),
+        )
+
+    async def close(self):
+        await self.client.close()
+
+    async def _with_retries(self, request: Callable[[], Awaitable]):
+        """Выполнение запроса к OpenAI с повторами на 429/5xx и сетевых ошибках"""
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            try:
+                return await request()
+            except Exception as e:
+                if attempt == OPENAI_MAX_RETRIES or not _is_retryable(e):
+                    raise
+                LLM_RETRIES.inc(type(e).__name__)
+                await asyncio.sleep(_retry_delay(e, attempt))
+
+    def _build_messages(self, query: str, documents: List[Dict]) -> Tuple[List[Dict], List[Dict], Dict]:
+        # Формируем контекст из документов в пределах бюджета токенов
+        context, sources, usage = self._prepare_context(query, documents)
+
+        # Создаем промпт для поиска
+        prompt = SEARCH_PROMPT.format(context=context, query=query)
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        return messages, sources, usage
+
+    async def search_documents(self, query: str, documents: List[Dict]) -> Dict:
+        """Поиск по документам с помощью OpenAI.
+
+        Возвращает словарь: answer — текст ответа, sources — фрагменты,
+        вошедшие в контекст, usage — расход токенов на запрос.
+        """
+        sources: List[Dict] = []
+        usage: Dict = {}
+        try:
+            messages, sources, usage = self._build_messages(query, documents)
+
             # Отправляем запрос к OpenAI
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Ты помощник по работе с корпоративными документами. Отвечай кратко и по существу."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content.strip()
-            
+            with stage('llm.answer'):
+                response = await self._with_retries(lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=ANSWER_MAX_TOKENS,
+                    temperature=0.7
+                ))
+
+            if response.usage:
+                usage['prompt_tokens'] = response.usage.prompt_tokens
+                usage['completion_tokens'] = response.usage.completion_tokens
+                _count_tokens(usage)
+
+            return {'answer': response.choices[0].message.content.strip(), 'sources': sources, 'usage': usage}
+
         except Exception as e:
-            return f"Ошибка при обработке запроса: {str(e)}"
-    
-    def _prepare_context(self, documents: List[Dict]) -> str:
-        """Подготовка контекста из документов"""
-        context_parts = []
-        
-        for doc in documents:
-            name = doc.get('name', 'Неизвестный документ')
-            content = doc.get('content', '')
-            
-            # Ограничиваем размер контента
-            if len(content) > 1000:
-                content = content[:1000] + "..."
-            
-            context_parts.append(f"Документ: {name}\nСодержание: {content}\n")
-        
-        return "\n".join(context_parts)
-    
-    def get_document_summary(self, document_name: str, content: str) -> str:
+            return {'answer': f"Ошибка при обработке запроса: {str(e)}", 'sources': sources, 'usage': usage,
+                    'error': True}
+
+    def stream_answer(self, query: str, documents: List[Dict]) -> AnswerStream:
+        """Потоковый вариант search_documents: текст ответа приходит по мере генерации"""
+        messages, sources, usage = self._build_messages(query, documents)
+        return AnswerStream(self, messages, sources, usage)
+
+    def _prepare_context(self, query: str, documents: List[Dict]) -> Tuple[str, List[Dict], Dict]:
+        """Подготовка контекста из документов.
+
+        Бюджет на фрагменты — окно модели за вычетом системного промпта,
+        шаблона с вопросом и места под ответ.
+        """
+        with stage('context'):
+            counter = self.context_builder.counter
+            prompt_tokens = counter.count(SYSTEM_PROMPT) + counter.count(SEARCH_PROMPT.format(context='', query=query))
+            budget = self.context_builder.budget(prompt_tokens, ANSWER_MAX_TOKENS)
+            context, used, stats = self.context_builder.build(query, documents, budget)
+            stats['prompt_tokens'] = prompt_tokens + stats['context_tokens']
+        return context, used, stats
+
+    async def get_document_summary(self, document_name: str, content: str) -> str:
         """Получение краткого описания документа"""
         try:
+            content = self.context_builder.counter.truncate(content, SUMMARY_CONTEXT_TOKENS)
             prompt = f"""
             Документ: {document_name}
-            Содержание: {content[:1000]}...
-            
+            Содержание: {content}...
+
             Сделай краткое описание этого документа (2-3 предложения).
             """
-            
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Ты помощник по анализу документов."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=150,
-                temperature=0.5
-            )
-            
+
+            with stage('llm.summary'):
+                response = await self._with_retries(lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": "Ты помощник по анализу документов."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=SUMMARY_MAX_TOKENS,
+                    temperature=0.5
+                ))
+
             return response.choices[0].message.content.strip()
-            
+
         except Exception as e:
-            return f"Ошибка при создании описания: {str(e)}" 
\ No newline at end of file
+            return f"Ошибка при создании описания: {str(e)}"
@@ -0,0 +1,164 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '500'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', str(24 * 3600)))  # секунды
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.92'))  # косинус для «почти того же» вопроса
+
+
+def normalize_query(query: str) -> str:
+    """Ключ точного совпадения: регистр, ё/е, пунктуация и пробелы не важны"""
+    words = re.findall(r'\w+', query.lower().replace('ё', 'е'))
+    return ' '.join(words)
+
+
+class AnswerCache:
+    """Кэш ответов на повторяющиеся вопросы.
+
+    Точное совпадение нормализованного вопроса отдается сразу, похожий вопрос —
+    если косинус эмбеддингов не ниже порога. Запись хранит версии документов,
+    из которых собран ответ, и сбрасывается при изменении любого из них.
+    Вытеснение — LRU по размеру и TTL.
+    """
+
+    def __init__(self, store, embedder=None, max_size: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL, threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.store = store
+        self.embedder = embedder if embedder is not None and np is not None else None
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._by_document: Dict[str, set] = {}
+        self._matrix = None  # эмбеддинги записей для поиска похожих, пересобирается лениво
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self.stats = {'hits_exact': 0, 'hits_semantic': 0, 'misses': 0,
+                      'evictions': 0, 'invalidations': 0}
+
+    def lookup(self, query: str) -> Optional[Tuple[Dict, str]]:
+        """Кэшированный результат и тип попадания ('exact' / 'semantic') либо None"""
+        key = normalize_query(query)
+        result = self._get_valid(key)
+        if result is not None:
+            self._count('hits_exact')
+            return result, 'exact'
+
+        if self.embedder is not None and key:
+            vector = self.embedder.encode([key])[0]
+            similar_key = self._most_similar(vector)
+            if similar_key is not None:
+                result = self._get_valid(similar_key)
+                if result is not None:
+                    self._count('hits_semantic')
+                    return result, 'semantic'
+
+        self._count('misses')
+        return None
+
+    def put(self, query: str, result: Dict, versions: Optional[Dict[str, str]] = None):
+        """Сохранение ответа вместе с версиями документов-источников.
+
+        versions — версии, снятые при поиске фрагментов (до вызова LLM): если документ
+        изменился, пока генерировался ответ, запись сразу окажется устаревшей.
+        Без versions берутся текущие версии из хранилища.
+        """
+        key = normalize_query(query)
+        if not key:
+            return
+        document_ids = {source['id'] for source in result.get('sources', []) if source.get('id')}
+        if versions is None:
+            versions = self._current_versions(document_ids)
+        else:
+            versions = {document_id: versions.get(document_id) for document_id in document_ids}
+        vector = self.embedder.encode([key])[0] if self.embedder is not None else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {'result': result, 'versions': versions, 'created': time.monotonic(),
+                                  'vector': vector}
+            for document_id in document_ids:
+                self._by_document.setdefault(document_id, set()).add(key)
+            self._matrix = None
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate_document(self, file_id: str, document: Optional[Dict] = None):
+        """Обработчик DriveSync: документ изменился или удален — его ответы больше не верны"""
+        with self._lock:
+            keys = self._by_document.pop(file_id, set())
+            for key in keys:
+                self._remove(key)
+            self.stats['invalidations'] += len(keys)
+
+    def report(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits_exact'] + stats['hits_semantic'] + stats['misses']
+        stats['hit_rate'] = (stats['hits_exact'] + stats['hits_semantic']) / lookups if lookups else 0.0
+        return stats
+
+    def _current_versions(self, document_ids) -> Dict[str, Optional[str]]:
+        """Версии документов; None — документа уже нет в хранилище"""
+        versions = self.store.get_versions(document_ids)
+        return {document_id: versions.get(document_id) for document_id in document_ids}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _get_valid(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry['created'] > self.ttl:
+                self._remove(key)
+                self.stats['evictions'] += 1
+                return None
+            self._entries.move_to_end(key)
+        # Страховка на случай изменений, о которых не пришло уведомление (другой процесс)
+        if self._current_versions(entry['versions']) != entry['versions']:
+            self.invalidate_key(key)
+            return None
+        return entry['result']
+
+    def invalidate_key(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.stats['invalidations'] += 1
+
+    def _most_similar(self, vector) -> Optional[str]:
+        with self._lock:
+            if self._matrix is None:
+                self._matrix_keys = [key for key, entry in self._entries.items() if entry['vector'] is not None]
+                self._matrix = (np.stack([self._entries[key]['vector'] for key in self._matrix_keys])
+                                if self._matrix_keys else None)
+            if self._matrix is None:
+                return None
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            return self._matrix_keys[best] if scores[best] >= self.threshold else None
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for document_id in entry['versions']:
+            keys = self._by_document.get(document_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_document[document_id]
+        self._matrix = None
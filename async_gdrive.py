@@ -0,0 +1,114 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from gdrive_service import GOOGLE_DOC_MIME_TYPE, DOCS_BATCH_SIZE, GoogleDriveService
+from metrics import stage
+from pdf_extract import PDF_TIMEOUT
+
+DRIVE_MAX_WORKERS = int(os.getenv('DRIVE_MAX_WORKERS', '8'))
+DRIVE_MAX_CONCURRENCY = int(os.getenv('DRIVE_MAX_CONCURRENCY', '8'))
+DRIVE_TIMEOUT = float(os.getenv('DRIVE_TIMEOUT', '30'))
+DRIVE_LIST_TIMEOUT = float(os.getenv('DRIVE_LIST_TIMEOUT', '300'))  # полный обход дерева папок, сек
+
+
+class AsyncDriveService:
+    """Асинхронный фасад над GoogleDriveService.
+
+    Синхронные вызовы googleapiclient выполняются в ограниченном пуле потоков,
+    поэтому медленный экспорт одного документа не блокирует event loop бота.
+    httplib2 не потокобезопасен, так что у каждого потока пула свой GoogleDriveService.
+    """
+
+    def __init__(self, service_factory: Callable[[], GoogleDriveService] = GoogleDriveService,
+                 max_workers: int = DRIVE_MAX_WORKERS,
+                 max_concurrency: int = DRIVE_MAX_CONCURRENCY,
+                 timeout: Optional[float] = DRIVE_TIMEOUT):
+        self._service_factory = service_factory
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gdrive')
+        self._local = threading.local()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.timeout = timeout
+
+    def _service(self) -> GoogleDriveService:
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._local.service = self._service_factory()
+        return service
+
+    def _invoke(self, method_name: str, args: tuple):
+        return getattr(self._service(), method_name)(*args)
+
+    async def _call(self, method_name: str, *args, timeout: Optional[float] = None):
+        """Вызов метода GoogleDriveService в пуле потоков с лимитом параллельности и таймаутом.
+
+        При таймауте или отмене корутины ожидающая в очереди задача снимается,
+        а уже начавшийся HTTP-запрос дорабатывает в фоне и его результат отбрасывается.
+        """
+        with stage(f'drive.{method_name}'):
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._executor, self._invoke, method_name, args)
+                return await asyncio.wait_for(future, timeout if timeout is not None else self.timeout)
+
+    async def get_documents(self, timeout: Optional[float] = None):
+        return await self._call('get_documents', timeout=timeout or DRIVE_LIST_TIMEOUT)
+
+    async def list_folder_tree(self, folder_id: Optional[str] = None, timeout: Optional[float] = None):
+        return await self._call('list_folder_tree', folder_id, timeout=timeout or DRIVE_LIST_TIMEOUT)
+
+    async def get_document_content(self, file_id, mime_type, timeout: Optional[float] = None):
+        return await self._call('get_document_content', file_id, mime_type, timeout=timeout)
+
+    async def fetch_document_content(self, file_id, mime_type, checksum=None, timeout: Optional[float] = None):
+        return await self._call('fetch_document_content', file_id, mime_type, checksum, timeout=timeout)
+
+    async def get_documents_content(self, files: List[Dict], max_concurrency: Optional[int] = None,
+                                    timeout: Optional[float] = None) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Параллельная загрузка содержимого нескольких файлов.
+
+        Google Docs идут пачками через HTTP batch, остальные файлы — отдельными
+        запросами, не более max_concurrency одновременно (сверх общего лимита фасада).
+        Возвращает кортеж (содержимое по id, ошибки по id).
+        """
+        limit = asyncio.Semaphore(max_concurrency or DRIVE_MAX_CONCURRENCY)
+        contents: Dict[str, str] = {}
+        errors: Dict[str, str] = {}
+
+        doc_ids = [f['id'] for f in files if f.get('mimeType') == GOOGLE_DOC_MIME_TYPE]
+        others = [f for f in files if f.get('mimeType') != GOOGLE_DOC_MIME_TYPE]
+
+        async def fetch_docs_batch(ids):
+            async with limit:
+                try:
+                    batch_contents, batch_errors = await self._call('fetch_google_docs_batch', ids, timeout=timeout)
+                except Exception as e:
+                    batch_contents, batch_errors = {}, {file_id: str(e) or type(e).__name__ for file_id in ids}
+            contents.update(batch_contents)
+            errors.update(batch_errors)
+
+        async def fetch_one(file):
+            async with limit:
+                try:
+                    # Большой PDF скачивается и разбирается дольше обычного вызова API
+                    file_timeout = timeout or (PDF_TIMEOUT if 'pdf' in file['mimeType'] else None)
+                    contents[file['id']] = await self.fetch_document_content(
+                        file['id'], file['mimeType'], file.get('md5Checksum'), timeout=file_timeout)
+                except Exception as e:
+                    errors[file['id']] = str(e) or type(e).__name__
+
+        await asyncio.gather(
+            *(fetch_docs_batch(doc_ids[i:i + DOCS_BATCH_SIZE]) for i in range(0, len(doc_ids), DOCS_BATCH_SIZE)),
+            *(fetch_one(file) for file in others))
+        return contents, errors
+
+    async def get_start_page_token(self, timeout: Optional[float] = None):
+        return await self._call('get_start_page_token', timeout=timeout)
+
+    async def list_changes(self, page_token, timeout: Optional[float] = None):
+        return await self._call('list_changes', page_token, timeout=timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,74 @@
+"""Нагрузочный тест AsyncDriveService на медленной заглушке Google Drive.
+
+Показывает, как растет пропускная способность с ростом лимита параллельности:
+синхронный вызов обслуживает запросы строго по одному, фасад — пачками.
+
+    python benchmarks/bench_async_drive.py --requests 64 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_gdrive import AsyncDriveService  # noqa: E402
+from fakes import FakeDriveService  # noqa: E402
+
+
+def make_drive(latency):
+    documents = [{'id': f'doc{i}', 'name': f'Документ {i}', 'content': 'текст ' * 200} for i in range(32)]
+    return FakeDriveService(documents=documents, latency=latency)
+
+
+async def run(concurrency, requests, latency):
+    fake = make_drive(latency)
+    drive = AsyncDriveService(service_factory=lambda: fake, max_workers=concurrency,
+                              max_concurrency=concurrency, timeout=None)
+    started = time.perf_counter()
+    await asyncio.gather(*(drive.fetch_document_content(f'doc{i % 32}', 'document') for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    drive.close()
+    return elapsed
+
+
+async def event_loop_lag(concurrency, requests, latency):
+    """Максимальная задержка event loop, пока идут запросы к Drive"""
+    fake = make_drive(latency)
+    drive = AsyncDriveService(service_factory=lambda: fake, max_workers=concurrency,
+                              max_concurrency=concurrency, timeout=None)
+    lag = 0.0
+    done = asyncio.Event()
+
+    async def probe():
+        nonlocal lag
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag = max(lag, time.perf_counter() - started - 0.005)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.gather(*(drive.fetch_document_content(f'doc{i % 32}', 'document') for i in range(requests)))
+    done.set()
+    await probe_task
+    drive.close()
+    return lag
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка одного вызова Drive, сек')
+    parser.add_argument('--levels', default='1,2,4,8,16')
+    args = parser.parse_args()
+
+    print(f"{'параллельность':>15} {'время, с':>10} {'запросов/с':>12} {'лаг loop, мс':>14}")
+    for level in (int(x) for x in args.levels.split(',')):
+        elapsed = asyncio.run(run(level, args.requests, args.latency))
+        lag = asyncio.run(event_loop_lag(level, args.requests, args.latency))
+        print(f"{level:>15} {elapsed:>10.2f} {args.requests / elapsed:>12.1f} {lag * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
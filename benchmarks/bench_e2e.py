@@ -0,0 +1,356 @@
+"""Сквозной бенчмарк бота без внешних сервисов: Telegram, Google Drive и OpenAI — заглушки.
+
+Бот из main.py запускается в этом же процессе: Bot API заменяет записывающая
+сессия aiogram, Google Drive — FakeDriveService с задержкой вызовов и корпусом
+заданного размера, OpenAI — локальный FakeOpenAIServer. Сначала выполняется
+полная синхронизация с индексацией и инкрементальная после правки части
+документов, затем обновления Telegram подаются в Dispatcher от --users
+одновременных пользователей, каждый следующий запрос — после ответа на
+предыдущий. Сценарии:
+
+    search — вопросы (handle_search_query), доля --repeat повторяет уже заданные;
+    docs   — /docs и листание страниц кнопками;
+    admin  — /index, /stats и /users от администраторов.
+
+Для каждого сценария — p50/p95/p99 задержки, пропускная способность, память
+процесса и число вызовов Bot API, Drive и LLM на запрос. С --max/--min бенчмарк
+становится проверкой на регрессии: при нарушении порога код выхода 1.
+
+    python benchmarks/bench_e2e.py --users 32 --requests 10 --documents 1000
+    python benchmarks/bench_e2e.py --max search.p95=2000 --max docs.drive_calls=0 --max '*.errors=0'
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from fakes import FakeDriveService  # noqa: E402
+
+TOKEN = '123456:bench'
+FOLDER_ID = 'bench-folder'
+ADMIN_COMMANDS = ('/index', '/stats', '/users')
+# Метрики результата, для которых можно задать порог
+METRICS = ('requests', 'errors', 'throughput', 'p50', 'p95', 'p99',
+           'bot_calls', 'drive_calls', 'llm_calls', 'rss_mb', 'peak_mb')
+
+
+class RecordingSession(BaseSession):
+    """Bot API в памяти: ответы собираются как у настоящего сервера, вызовы считаются по методам"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self.errors = 0  # ответы бота с ❌
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        text = getattr(method, 'text', None) or ''
+        if text.startswith('❌'):
+            self.errors += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name in ('SendMessage', 'EditMessageText'):
+            result = {'message_id': getattr(method, 'message_id', None) or next(self._message_ids),
+                      'date': int(time.time()), 'text': text,
+                      'chat': {'id': getattr(method, 'chat_id', 0), 'type': 'private'}}
+        else:
+            result = True
+        # Разбор ответа — тем же кодом aiogram, что и для ответа api.telegram.org
+        response = self.check_response(bot, method, 200, json.dumps({'ok': True, 'result': result}))
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def make_corpus(documents, doc_size, pdf_share, seed=0):
+    """Разделы demo_documents.md и шумовые документы размером около doc_size символов"""
+    # Не при импорте: bench_retrieval загружает модули бота до того, как configure() задаст пути к файлам
+    from bench_retrieval import load_sections, noise_documents
+
+    rng = random.Random(seed)
+    sections = load_sections()
+    corpus = [{'id': f'section-{number}', 'name': text.split('\n', 1)[0], 'content': text}
+              for number, text in sections.items()]
+    for i, text in enumerate(noise_documents(sections, documents)):
+        size = rng.randint(doc_size // 2, doc_size * 3 // 2)
+        content = ' '.join(itertools.repeat(text, size // (len(text) + 1) + 1))[:size]
+        corpus.append({'id': f'noise-{i}', 'name': f'Документ {i}', 'content': content,
+                       'mimeType': 'application/pdf' if rng.random() < pdf_share else None})
+    return corpus
+
+
+def percentile(values, share):
+    return values[min(int(len(values) * share), len(values) - 1)] if values else 0.0
+
+
+def rss_mb():
+    """Текущая память процесса (RSS), МБ"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Harness:
+    def __init__(self, args, app, session, fake_drive, openai):
+        self.args = args
+        self.app = app
+        self.session = session
+        self.drive = fake_drive
+        self.openai = openai
+        self.bot = app.bot
+        self.update_ids = itertools.count(1)
+
+    def _external_calls(self):
+        return (sum(self.session.calls.values()), sum(self.drive.calls.values()), self.openai.calls['requests'])
+
+    async def feed(self, update):
+        await self.app.dp.feed_update(self.bot, Update.model_validate(update, context={'bot': self.bot}))
+
+    def message(self, user_id, text):
+        update_id = next(self.update_ids)
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}}}
+
+    def callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        sender = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': sender, 'chat_instance': str(user_id), 'data': data,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'text': '📚',
+                        'chat': {'id': user_id, 'type': 'private'}, 'from': sender}}}
+
+    async def sync(self):
+        """Проход синхронизации и индексация всего, что он поставил в очередь планировщика"""
+        drive_calls = sum(self.drive.calls.values())
+        started = time.perf_counter()
+        await self.app.run_sync([])
+        while self.app.scheduler.pending(self.app.JOB_INDEX):
+            await asyncio.sleep(0.02)
+        return time.perf_counter() - started, sum(self.drive.calls.values()) - drive_calls
+
+    async def scenario(self, name, users, requests):
+        """Пользователи шлют запросы по очереди, каждый следующий — после ответа на предыдущий"""
+        latencies = []
+        before = self._external_calls()
+        errors = self.session.errors
+        if self.args.tracemalloc:
+            tracemalloc.start()
+
+        async def user(user_id, updates):
+            for update in updates:
+                started = time.perf_counter()
+                await self.feed(update)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(user_id, requests(user_id)) for user_id in users))
+        elapsed = time.perf_counter() - started
+        peak = 0.0
+        if self.args.tracemalloc:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+        total = len(latencies)
+        bot_calls, drive_calls, llm_calls = (after - was for after, was in zip(self._external_calls(), before))
+        latencies.sort()
+        return {'scenario': name, 'requests': total, 'errors': self.session.errors - errors,
+                'throughput': total / elapsed, 'p50': percentile(latencies, 0.5) * 1000,
+                'p95': percentile(latencies, 0.95) * 1000, 'p99': percentile(latencies, 0.99) * 1000,
+                'bot_calls': bot_calls / total, 'drive_calls': drive_calls / total,
+                'llm_calls': llm_calls / total, 'rss_mb': rss_mb(), 'peak_mb': peak}
+
+    def search_requests(self, seed):
+        from bench_retrieval import QUERIES
+
+        rng = random.Random(seed)
+        asked = []
+
+        def requests(user_id):
+            updates = []
+            for i in range(self.args.requests):
+                if asked and rng.random() < self.args.repeat:
+                    # Повтор уже заданного вопроса — ответ из кэша
+                    text = rng.choice(asked)
+                else:
+                    text = f'{rng.choice(QUERIES)[0]} {user_id}-{i}'
+                    asked.append(text)
+                updates.append(self.message(user_id, text))
+            return updates
+        return requests
+
+    def docs_requests(self, user_id):
+        pages = -(-self.app.doc_store.document_count() // self.app.DOCS_PAGE_SIZE)
+        updates = [self.message(user_id, '/docs')]
+        for i in range(1, self.args.requests):
+            updates.append(self.callback(user_id, f'docs:{i % pages}'))
+        return updates
+
+    def admin_requests(self, user_id):
+        return [self.message(user_id, ADMIN_COMMANDS[i % len(ADMIN_COMMANDS)]) for i in range(self.args.requests)]
+
+
+def check_limits(results, limits, minimum):
+    """Нарушенные пороги вида сценарий.метрика=значение; '*' — все сценарии"""
+    failures = []
+    for limit in limits:
+        target, value = limit.split('=', 1)
+        scenario, metric = target.split('.', 1)
+        if metric not in METRICS:
+            raise SystemExit(f'Неизвестная метрика {metric!r}, есть: {", ".join(METRICS)}')
+        for result in results:
+            if scenario not in ('*', result['scenario']):
+                continue
+            actual = result[metric]
+            if (actual < float(value)) if minimum else (actual > float(value)):
+                failures.append(f"{result['scenario']}.{metric} = {actual:.2f}, "
+                                f"порог {'не меньше' if minimum else 'не больше'} {value}")
+    return failures
+
+
+def configure(args, directory, openai_url):
+    """Окружение main.py: все файлы во временном каталоге, ограничения частоты не мешают замеру"""
+    os.environ.update(
+        TELEGRAM_TOKEN=TOKEN, OPENAI_API_KEY='bench', OPENAI_BASE_URL=openai_url,
+        GOOGLE_DRIVE_FOLDER_ID=FOLDER_ID, METRICS_PORT='0', SYNC_INTERVAL='0', EMBEDDING_MODEL='',
+        SEARCH_MODE='lexical', WORK_QUEUE_WORKERS=str(args.queue_workers),
+        USER_RATE_LIMIT='1000000', USER_BURST='1000000', GLOBAL_RATE_LIMIT='1000000000', GLOBAL_BURST='1000000000',
+        DOCS_STORE_PATH=os.path.join(directory, 'documents.db'), USERS_DB_PATH=os.path.join(directory, 'users.db'),
+        BM25_INDEX_PATH=os.path.join(directory, 'bm25.idx'),
+        VECTOR_INDEX_PATH=os.path.join(directory, 'vectors.faiss'),
+        GOOGLE_TOKEN_PATH=os.path.join(directory, 'token.pickle'))
+
+
+async def bench(args, directory, log):
+    openai = FakeOpenAIServer(first_token_delay=args.llm_latency, token_delay=args.token_delay)
+    openai_url = await openai.start()
+    configure(args, directory, openai_url)
+    import main as app  # после настройки окружения: main.py читает его при импорте
+
+    from aiogram import Bot
+    from async_gdrive import AsyncDriveService
+
+    fake_drive = FakeDriveService(folder_id=FOLDER_ID, latency=args.drive_latency,
+                                  documents=make_corpus(args.documents, args.doc_size, args.pdf_share))
+    app.drive = app.drive_sync.drive = AsyncDriveService(service_factory=lambda: fake_drive)
+    session = RecordingSession(latency=args.telegram_latency)
+    app.bot = Bot(token=TOKEN, session=session)
+    harness = Harness(args, app, session, fake_drive, openai)
+
+    results = []
+    await app.startup()
+    try:
+        for tg_id in range(1, args.users + 1):
+            await app.user_store.add_user(tg_id, f'Пользователь {tg_id}', 'IT')
+            await app.user_store.add_user(100000 + tg_id, f'Администратор {tg_id}', 'IT', 'admin')
+
+        elapsed, drive_calls = await harness.sync()
+        log(f"Полная синхронизация и индексация {len(fake_drive.files)} документов: {elapsed:.1f} с, "
+            f"вызовов Drive {drive_calls}")
+        for file_id in random.Random(1).sample(sorted(fake_drive.files), args.changes):
+            fake_drive.modify(file_id, fake_drive.contents[file_id] + ' дополнение')
+        elapsed, drive_calls = await harness.sync()
+        log(f"Инкрементальная после правки {args.changes} документов: {elapsed:.2f} с, вызовов Drive {drive_calls}\n")
+
+        users = range(1, args.users + 1)
+        admins = range(100001, 100001 + args.users)
+        scenarios = {
+            'search': (users, harness.search_requests(args.seed)),
+            'docs': (users, harness.docs_requests),
+            'admin': (admins, harness.admin_requests),
+        }
+        log(f"{'сценарий':>8} {'запросов':>8} {'ошибок':>6} {'запр/с':>8} {'p50, мс':>8} {'p95, мс':>8} "
+            f"{'p99, мс':>8} {'Bot API':>8} {'Drive':>6} {'LLM':>5} {'RSS, МБ':>8}"
+            + (f" {'пик, МБ':>8}" if args.tracemalloc else ''))
+        for name in args.scenarios:
+            scenario_users, requests = scenarios[name]
+            result = await harness.scenario(name, scenario_users, requests)
+            results.append(result)
+            log(f"{name:>8} {result['requests']:>8} {result['errors']:>6} {result['throughput']:>8.1f} "
+                f"{result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f} {result['bot_calls']:>8.2f} "
+                f"{result['drive_calls']:>6.2f} {result['llm_calls']:>5.2f} {result['rss_mb']:>8.0f}"
+                + (f" {result['peak_mb']:>8.1f}" if args.tracemalloc else ''))
+        log(f"\nВызовы Bot API: {dict(session.calls)}\nВызовы Drive: {dict(fake_drive.calls)}\n"
+            f"Пиковая память процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+    finally:
+        await app.shutdown()
+        await openai.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=32, help='одновременных пользователей')
+    parser.add_argument('--requests', type=int, default=10, help='запросов от каждого пользователя в сценарии')
+    parser.add_argument('--scenarios', default='search,docs,admin', help='сценарии через запятую')
+    parser.add_argument('--documents', type=int, default=1000, help='шумовых документов на Drive')
+    parser.add_argument('--doc-size', type=int, default=2000, help='средний размер документа, символов')
+    parser.add_argument('--pdf-share', type=float, default=0.2, help='доля PDF (загружаются поштучно, не batch)')
+    parser.add_argument('--changes', type=int, default=20, help='документов, измененных перед вторым проходом')
+    parser.add_argument('--drive-latency', type=float, default=0.05, help='задержка вызова Drive, сек')
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='задержка вызова Bot API, сек')
+    parser.add_argument('--llm-latency', type=float, default=0.1, help='до первого токена LLM, сек')
+    parser.add_argument('--token-delay', type=float, default=0.005, help='между токенами LLM, сек')
+    parser.add_argument('--repeat', type=float, default=0.2, help='доля повторных вопросов')
+    parser.add_argument('--queue-workers', type=int, default=4, help='WORK_QUEUE_WORKERS')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true', help='пик памяти Python по сценариям (медленнее)')
+    parser.add_argument('--max', action='append', default=[], metavar='СЦЕНАРИЙ.МЕТРИКА=ЗНАЧЕНИЕ',
+                        help=f'верхний порог, например search.p95=2000; метрики: {", ".join(METRICS)}')
+    parser.add_argument('--min', action='append', default=[], metavar='СЦЕНАРИЙ.МЕТРИКА=ЗНАЧЕНИЕ',
+                        help='нижний порог, например docs.throughput=100')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод бота')
+    args = parser.parse_args()
+    args.scenarios = args.scenarios.split(',')
+
+    def log(text):
+        print(text, file=sys.__stdout__, flush=True)
+
+    log(f"{args.users} пользователей × {args.requests} запросов, документов {args.documents} "
+        f"по ~{args.doc_size} символов; задержки: Drive {args.drive_latency * 1000:.0f} мс, "
+        f"Bot API {args.telegram_latency * 1000:.0f} мс, LLM {args.llm_latency * 1000:.0f} мс; CPU: {os.cpu_count()}\n")
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+        # Бот печатает строку на каждый запрос — в замере она только мешает
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            results = asyncio.run(bench(args, directory, log))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    failures = check_limits(results, args.max, minimum=False) + check_limits(results, args.min, minimum=True)
+    if failures:
+        log('\n❌ Пороги нарушены:\n' + '\n'.join(f'• {failure}' for failure in failures))
+        sys.exit(1)
+    if args.max or args.min:
+        log('\n✅ Все пороги соблюдены')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Накладные расходы на одну загрузку документа: build() на каждый вызов против кэша клиентов.
+
+Сеть не нужна: discovery-документы берутся из googleapiclient, токен — фиктивный.
+Отдельно проверяется, что при одновременных запросах из многих потоков
+истекающий токен обновляется один раз.
+
+    python benchmarks/bench_google_clients.py --fetches 200 --threads 8
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.oauth2.credentials import Credentials  # noqa: E402
+from googleapiclient.discovery import build  # noqa: E402
+
+from credentials import CredentialsManager  # noqa: E402
+from gdrive_service import GoogleDriveService  # noqa: E402
+
+
+class FakeRefreshCredentials(Credentials):
+    """Токен, который «обновляется» без сети"""
+
+    def __init__(self, expires_in):
+        super().__init__(token='token-0', refresh_token='refresh')
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+        self.refresh_calls = 0
+        self._calls_lock = threading.Lock()
+
+    def refresh(self, request):
+        with self._calls_lock:
+            self.refresh_calls += 1
+        time.sleep(0.05)  # запрос к oauth2.googleapis.com
+        self.token = f'token-{self.refresh_calls}'
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+
+class MemoryCredentialsManager(CredentialsManager):
+    """Без записи token.pickle — фиктивный токен не нужно сохранять"""
+
+    def _save(self, creds):
+        pass
+
+
+def manager_with(creds):
+    manager = MemoryCredentialsManager()
+    manager._creds = creds
+    return manager
+
+
+def per_fetch(label, fetches, func):
+    started = time.perf_counter()
+    for _ in range(fetches):
+        func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<38} {elapsed / fetches * 1000:>8.3f} мс на загрузку")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fetches', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    creds = Credentials(token='token', expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+    drive = GoogleDriveService(credentials=manager_with(creds))
+
+    print("Google Docs:")
+    per_fetch('build() на каждый вызов (было)', args.fetches,
+              lambda: build('docs', 'v1', credentials=creds, cache_discovery=False).documents())
+    per_fetch('кэшированный клиент (стало)', args.fetches, lambda: drive._client('docs', 'v1', 'documents'))
+    print("Google Sheets:")
+    per_fetch('build() на каждый вызов (было)', args.fetches,
+              lambda: build('sheets', 'v4', credentials=creds, cache_discovery=False).spreadsheets())
+    per_fetch('кэшированный клиент (стало)', args.fetches, lambda: drive._client('sheets', 'v4', 'spreadsheets'))
+
+    # Токен истекает через минуту — меньше запаса на обновление
+    expiring = FakeRefreshCredentials(expires_in=60)
+    manager = manager_with(expiring)
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        tokens = set(pool.map(lambda _: manager.get().token, range(args.threads * 4)))
+    print(f"\n{args.threads} потоков, {args.threads * 4} запросов с истекающим токеном: "
+          f"обновлений {expiring.refresh_calls}, токены {sorted(tokens)}")
+
+
+if __name__ == '__main__':
+    main()
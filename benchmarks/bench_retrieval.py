@@ -0,0 +1,127 @@
+"""Сравнение режимов поиска: lexical (BM25), vector (FAISS) и hybrid (RRF).
+
+Корпус — разделы demo_documents.md и шумовые документы на другие корпоративные
+темы с примесью лексики корпуса, чтобы нужный раздел не находился тривиально.
+Для каждого вопроса известен документ с ответом; считаются recall@k и задержка.
+
+    python benchmarks/bench_retrieval.py --noise 2000 --k 5
+    python benchmarks/bench_retrieval.py --model   # настоящая модель sentence-transformers
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bm25_index import BM25Index  # noqa: E402
+from doc_store import DocumentStore  # noqa: E402
+from fakes import HashingEmbedder  # noqa: E402
+from indexer import DocumentIndexer  # noqa: E402
+from retrieval import HybridRetriever  # noqa: E402
+from vector_index import SentenceEmbedder, VectorIndex  # noqa: E402
+
+# Вопрос → номер раздела demo_documents.md, где есть ответ
+QUERIES = [
+    ('Как подать заявку на отпуск?', 2),
+    ('За сколько недель нужно подавать заявление на отпуск', 2),
+    ('Какие документы нужны для больничного листа', 2),
+    ('справка о нетрудоспособности', 2),
+    ('До какого числа сдавать ежемесячный отчет', 3),
+    ('структура отчета за месяц', 3),
+    ('Как получить доступ к корпоративному Wi-Fi?', 4),
+    ('Что делать если потерял пропуск', 4),
+    ('Как оформить командировку', 4),
+    ('Где лежат корпоративные шаблоны', 4),
+    ('можно ли пересылать конфиденциальную информацию на личную почту', 5),
+    ('что делать при инциденте безопасности', 5),
+    ('требования к паролям', 5),
+    ('какие команды есть у бота', 1),
+    ('как задать вопрос боту', 1),
+]
+
+NOISE_VOCABULARY = """
+    бюджет закупка поставщик договор склад логистика маркетинг презентация клиент продажи квартал
+    выручка смета счет оплата накладная акт сверка тендер контрагент доставка упаковка офис ремонт
+    мебель переговорная встреча планерка стратегия показатель конверсия реклама сайт рассылка
+    бренд выставка партнер лицензия сервер резервная копия миграция релиз тестирование дизайн макет
+    юрист претензия аудит налог бухгалтерия баланс инвентаризация аренда парковка столовая меню
+""".split()
+
+
+def load_sections():
+    with open(os.path.join(ROOT, 'demo_documents.md'), encoding='utf-8') as f:
+        parts = f.read().split('\n## ')[1:]
+    return {int(part.split('.', 1)[0]): part for part in parts}
+
+
+def noise_documents(sections, count, overlap=0.15, seed=42):
+    """Шумовые документы на посторонние темы; доля overlap слов взята из самого корпуса"""
+    rng = random.Random(seed)
+    corpus_words = ' '.join(sections.values()).split()
+    documents = []
+    for _ in range(count):
+        words = [rng.choice(corpus_words) if rng.random() < overlap else rng.choice(NOISE_VOCABULARY)
+                 for _ in range(rng.randint(80, 300))]
+        documents.append(' '.join(words))
+    return documents
+
+
+def build(store_path, index_dir, sections, noise, embedder):
+    store = DocumentStore(store_path)
+    bm25 = BM25Index(os.path.join(index_dir, 'bm25.idx'))
+    vectors = VectorIndex(os.path.join(index_dir, 'vectors.faiss'), embedder)
+    indexer = DocumentIndexer(store, [bm25, vectors])
+    for number, text in sections.items():
+        document = {'id': f'section-{number}', 'name': text.split('\n', 1)[0], 'content': text,
+                    'link': f'demo#{number}'}
+        store.upsert({'id': document['id'], 'name': document['name'], 'webViewLink': document['link']}, text)
+        indexer.on_document_changed(document['id'], document)
+    for i, text in enumerate(noise):
+        document = {'id': f'noise-{i}', 'name': f'Шум {i}', 'content': text, 'link': f'noise#{i}'}
+        store.upsert({'id': document['id'], 'name': document['name'], 'webViewLink': document['link']}, text)
+        indexer.on_document_changed(document['id'], document)
+    started = time.perf_counter()
+    indexer.process_pending()
+    return store, bm25, vectors, time.perf_counter() - started
+
+
+def evaluate(retriever, mode, k):
+    hits, latencies = 0, []
+    for query, section in QUERIES:
+        started = time.perf_counter()
+        chunks = retriever.search(query, k, mode=mode)
+        latencies.append(time.perf_counter() - started)
+        hits += any(chunk['id'] == f'section-{section}' for chunk in chunks)
+    latencies.sort()
+    return hits / len(QUERIES), statistics.mean(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--noise', type=int, default=500, help='число шумовых документов')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--model', action='store_true', help='использовать sentence-transformers вместо хэширования')
+    args = parser.parse_args()
+
+    sections = load_sections()
+    embedder = SentenceEmbedder() if args.model else HashingEmbedder()
+    with tempfile.TemporaryDirectory() as tmp:
+        store, bm25, vectors, build_time = build(os.path.join(tmp, 'documents.db'), tmp, sections,
+                                                 noise_documents(sections, args.noise), embedder)
+        retriever = HybridRetriever(store, bm25, vectors)
+        print(f"Фрагментов: {store.chunk_count()}, индексация: {build_time:.2f} с, "
+              f"BM25 на диске: {os.path.getsize(bm25.path) / 1024:.0f} КБ")
+        print(f"{'режим':>8} {f'recall@{args.k}':>10} {'среднее, мс':>12} {'p95, мс':>9}")
+        for mode in ('lexical', 'vector', 'hybrid'):
+            recall, mean, p95 = evaluate(retriever, mode, args.k)
+            print(f"{mode:>8} {recall:>10.2f} {mean * 1000:>12.2f} {p95 * 1000:>9.2f}")
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
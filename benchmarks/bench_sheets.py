@@ -0,0 +1,145 @@
+"""Загрузка большой Google-таблицы: прежний A1:Z1000 против точных диапазонов.
+
+Синтетический лист (по умолчанию 100 000 строк × 12 столбцов) отдается
+заглушкой Sheets API. Для каждого способа — время, пик памяти (tracemalloc),
+число запросов batchGet и сколько строк листа попало в текст. Для сравнения —
+прежний способ без обрезки диапазона (весь лист одним ответом).
+
+    python benchmarks/bench_sheets.py --rows 100000 --columns 12
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gdrive_service import GoogleDriveService  # noqa: E402
+from sheets import column_letter, quote_sheet_title  # noqa: E402
+
+DEPARTMENTS = ['HR', 'IT', 'Бухгалтерия', 'Продажи', 'Юристы', 'Склад']
+CITIES = ['Москва', 'Казань', 'Новосибирск', 'Екатеринбург']
+RANGE_PATTERN = re.compile(r"^'(?P<title>.*)'!A(?P<first>\d+):(?P<column>[A-Z]+)(?P<last>\d+)$")
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+
+class FakeSheetsService:
+    """Ровно столько Sheets API, сколько использует GoogleDriveService"""
+
+    def __init__(self, title, rows, columns):
+        self.title = title
+        self.rows = rows
+        self.columns = columns
+        self.batch_requests = 0
+        self._pending = None
+
+    def row(self, number):
+        if number == 1:
+            return [f'Поле {i}' for i in range(1, self.columns + 1)]
+        base = [f'EMP{number:06d}', f'Сотрудник {number}', DEPARTMENTS[number % len(DEPARTMENTS)],
+                CITIES[number % len(CITIES)], str(50000 + number % 997 * 100), f'2023-{number % 12 + 1:02d}-01']
+        return (base * (self.columns // len(base) + 1))[:self.columns]
+
+    # spreadsheets()
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, fields):
+        self._pending = {'sheets': [{'properties': {
+            'title': self.title, 'sheetType': 'GRID',
+            'gridProperties': {'rowCount': self.rows, 'columnCount': self.columns}}}]}
+        return self
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension='ROWS'):
+        self.batch_requests += 1
+        value_ranges = []
+        for sheet_range in ranges:
+            match = RANGE_PATTERN.match(sheet_range)
+            first, last = int(match['first']), min(int(match['last']), self.rows)
+            width = min(column_index(match['column']), self.columns)
+            value_ranges.append({'range': sheet_range,
+                                 'values': [self.row(n)[:width] for n in range(first, last + 1)]})
+        self._pending = {'valueRanges': value_ranges}
+        return self
+
+    def execute(self):
+        response, self._pending = self._pending, None
+        return response
+
+
+def legacy_sheet_content(sheets_service, file_id, cells='A1:Z1000'):
+    """Прежняя реализация: фиксированный диапазон A1:Z1000, строки через ' | '"""
+    sheet = sheets_service.spreadsheets().get(spreadsheetId=file_id, fields='sheets.properties.title').execute()
+    titles = [worksheet['properties']['title'] for worksheet in sheet.get('sheets', [])]
+    result = sheets_service.spreadsheets().values().batchGet(
+        spreadsheetId=file_id, ranges=[f"{quote_sheet_title(title)}!{cells}" for title in titles]).execute()
+    content = []
+    for title, value_range in zip(titles, result.get('valueRanges', [])):
+        content.append(f"Лист: {title}")
+        for row in value_range.get('values', []):
+            content.append(' | '.join(str(cell) for cell in row))
+        content.append('\n')
+    return '\n'.join(content)
+
+
+def measure(name, func, make_fake, count_rows):
+    """Время — отдельным прогоном: tracemalloc заметно замедляет аллокации"""
+    fake = make_fake()
+    started = time.perf_counter()
+    text = func(fake)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    func(make_fake())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<22} {elapsed:>7.2f} с  пик {peak / 2 ** 20:>7.1f} МБ  batchGet {fake.batch_requests:>3}  "
+          f"строк {count_rows(text):>7}  текст {len(text) / 2 ** 20:>6.1f} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=12)
+    args = parser.parse_args()
+    print(f"Лист {args.rows} × {args.columns} (до столбца {column_letter(args.columns)})\n")
+
+    def make_fake():
+        return FakeSheetsService('Сотрудники', args.rows, args.columns)
+
+    def current(fake):
+        drive = GoogleDriveService()
+        drive._spreadsheets = lambda: fake
+        return drive._get_google_sheet_content('sheet')
+
+    measure('A1:Z1000 (прежний)', lambda fake: legacy_sheet_content(fake, 'sheet'), make_fake,
+            lambda text: sum(1 for line in text.splitlines() if line.startswith('EMP')))
+    # Прежний способ без обрезки: весь лист одним ответом и одной склейкой строк
+    full_range = f'A1:{column_letter(args.columns)}{args.rows}'
+    measure('весь лист строками', lambda fake: legacy_sheet_content(fake, 'sheet', full_range), make_fake,
+            lambda text: sum(1 for line in text.splitlines() if line.startswith('EMP')))
+    measure('точные диапазоны', current, make_fake, lambda text: text.count('\nСтрока '))
+
+    drive = GoogleDriveService()
+    fake = make_fake()
+    drive._spreadsheets = lambda: fake
+    tracemalloc.start()
+    tables = drive.fetch_sheet_tables('sheet')
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"\nSheetTable в памяти: {size / 2 ** 20:.1f} МБ на {len(tables[0])} строк")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Пропускная способность webhook.py в зависимости от числа рабочих процессов.
+
+Бенчмарк поднимает заглушки Bot API и OpenAI, готовит во временном каталоге
+documents.db с индексом BM25 и users.db, затем для каждого числа процессов
+запускает `python webhook.py` и воспроизводит поддельные обновления Telegram:
+--users пользователей задают по --questions уникальных вопросов, каждый
+следующий — после ответа на предыдущий. Ответ считается полученным, когда бот
+отправил финальный текст в чат. После замера отправляется еще по вопросу от
+каждого пользователя и сразу SIGTERM — проверка, что принятые обновления
+дообрабатываются при остановке.
+
+    python benchmarks/bench_webhook.py --workers 1,2,4 --users 64 --documents 3000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiohttp import ClientSession, web  # noqa: E402
+
+from bench_retrieval import QUERIES, load_sections, noise_documents  # noqa: E402
+from bm25_index import BM25Index  # noqa: E402
+from doc_store import DocumentStore  # noqa: E402
+from fake_openai import FakeOpenAIServer  # noqa: E402
+from indexer import DocumentIndexer  # noqa: E402
+from user_store import UserStore  # noqa: E402
+
+TOKEN = '123456:bench'
+SECRET = 'bench-secret'
+FINAL_MARKERS = ('📄 Источники', '📭', '❌')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotAPI:
+    """Bot API для aiogram: sendMessage/editMessageText, финальные ответы будят ожидающих"""
+
+    def __init__(self):
+        self.calls = 0
+        self.waiters = {}  # chat_id → Future финального ответа
+        self._message_ids = itertools.count(1)
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    async def handle(self, request):
+        self.calls += 1
+        data = await request.post()
+        text = data.get('text', '')
+        chat_id = int(data.get('chat_id', 0))
+        if text.startswith(FINAL_MARKERS) or any(marker in text for marker in FINAL_MARKERS):
+            waiter = self.waiters.pop(chat_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.perf_counter())
+        if request.match_info['method'] not in ('sendMessage', 'editMessageText'):
+            return web.json_response({'ok': True, 'result': True})
+        message_id = int(data.get('message_id') or next(self._message_ids))
+        return web.json_response({'ok': True, 'result': {
+            'message_id': message_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'}}})
+
+
+def prepare(directory, documents, users):
+    store = DocumentStore(os.path.join(directory, 'documents.db'))
+    bm25 = BM25Index(os.path.join(directory, 'bm25.idx'))
+    indexer = DocumentIndexer(store, [bm25])
+    sections = load_sections()
+    texts = [(f'section-{number}', text.split('\n', 1)[0], text) for number, text in sections.items()]
+    texts += [(f'noise-{i}', f'Шум {i}', text) for i, text in enumerate(noise_documents(sections, documents))]
+    for file_id, name, text in texts:
+        store.upsert({'id': file_id, 'name': name, 'webViewLink': f'doc#{file_id}'}, text)
+        indexer.on_document_changed(file_id, {'id': file_id, 'content': text})
+    indexer.process_pending()
+    store.close()
+
+    async def add_users():
+        user_store = UserStore(os.path.join(directory, 'users.db'))
+        await user_store.open()
+        for tg_id in range(1, users + 1):
+            await user_store.add_user(tg_id, f'Пользователь {tg_id}', 'IT')
+        await user_store.close()
+    asyncio.run(add_users())
+    return len(texts)
+
+
+def update(update_id, user_id, text):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': text,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}}}
+
+
+async def wait_for_port(port, process, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'webhook.py завершился с кодом {process.returncode}')
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError('webhook.py не открыл порт')
+
+
+async def run(workers, args, env, bot_api, directory):
+    port = free_port()
+    env = dict(env, WEBHOOK_WORKERS=str(workers), WEBHOOK_PORT=str(port))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'webhook.py')], cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL if not args.verbose else None)
+    started = time.perf_counter()
+    await wait_for_port(port, process)
+    startup = time.perf_counter() - started
+    url = f'http://127.0.0.1:{port}/webhook'
+    update_ids = itertools.count(1)
+    rng = random.Random(workers)
+    latencies = []
+
+    async with ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as session:
+        async def ask(user_id, text):
+            waiter = bot_api.waiters[user_id] = asyncio.get_running_loop().create_future()
+            sent = time.perf_counter()
+            async with session.post(url, json=update(next(update_ids), user_id, text)) as response:
+                if response.status != 200:
+                    raise RuntimeError(f'webhook ответил {response.status}')
+            return waiter, sent
+
+        async def user(user_id):
+            for i in range(args.questions):
+                # Уникальный текст — мимо кэша ответов
+                waiter, sent = await ask(user_id, f'{rng.choice(QUERIES)[0]} {user_id}-{i}')
+                latencies.append(await asyncio.wait_for(waiter, 120) - sent)
+
+        # Разогрев: по вопросу от каждого пользователя
+        await asyncio.gather(*(ask(user_id, f'разогрев {user_id}') for user_id in range(1, args.users + 1)))
+        await asyncio.gather(*(waiter for waiter in list(bot_api.waiters.values())))
+        latencies.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(user(user_id) for user_id in range(1, args.users + 1)))
+        elapsed = time.perf_counter() - started
+
+        # Плавная остановка: обновления приняты, процесс сразу получает SIGTERM
+        pending = [(await ask(user_id, f'остановка {user_id}'))[0] for user_id in range(1, args.users + 1)]
+    process.send_signal(signal.SIGTERM)
+    await asyncio.to_thread(process.wait, 120)
+    await asyncio.sleep(0.1)
+    drained = sum(1 for waiter in pending if waiter.done())
+    bot_api.waiters.clear()
+
+    latencies.sort()
+    total = len(latencies)
+    return {'workers': workers, 'startup': startup, 'throughput': total / elapsed,
+            'p50': statistics.median(latencies), 'p95': latencies[int(total * 0.95) - 1],
+            'drained': f'{drained}/{len(pending)}'}
+
+
+async def bench(args, directory):
+    bot_api = FakeBotAPI()
+    bot_runner = web.AppRunner(bot_api.app, access_log=None)
+    await bot_runner.setup()
+    bot_port = free_port()
+    await web.TCPSite(bot_runner, '127.0.0.1', bot_port).start()
+    openai = FakeOpenAIServer(first_token_delay=args.llm_latency, token_delay=0)
+    openai_url = await openai.start()
+
+    env = dict(os.environ, TELEGRAM_TOKEN=TOKEN, TELEGRAM_API_URL=f'http://127.0.0.1:{bot_port}',
+               OPENAI_API_KEY='bench', OPENAI_BASE_URL=openai_url, WEBHOOK_HOST='127.0.0.1',
+               WEBHOOK_SECRET=SECRET, METRICS_PORT='0', SYNC_INTERVAL='0', STREAM_ANSWERS='0',
+               EMBEDDING_MODEL='', SEARCH_MODE='lexical', WORK_QUEUE_WORKERS=str(args.queue_workers),
+               USER_RATE_LIMIT='1000000', USER_BURST='1000000', GLOBAL_RATE_LIMIT='1000000000',
+               GLOBAL_BURST='1000000000', DOCS_STORE_PATH=os.path.join(directory, 'documents.db'),
+               BM25_INDEX_PATH=os.path.join(directory, 'bm25.idx'),
+               VECTOR_INDEX_PATH=os.path.join(directory, 'vectors.faiss'),
+               USERS_DB_PATH=os.path.join(directory, 'users.db'))
+    results = []
+    try:
+        for workers in args.workers:
+            result = await run(workers, args, env, bot_api, directory)
+            results.append(result)
+            speedup = result['throughput'] / results[0]['throughput']
+            print(f"{workers:>3} проц.  запуск {result['startup']:>5.1f} с  {result['throughput']:>7.1f} вопр/с "
+                  f"(×{speedup:.2f})  p50 {result['p50'] * 1000:>6.0f} мс  p95 {result['p95'] * 1000:>6.0f} мс  "
+                  f"после SIGTERM отвечено {result['drained']}")
+    finally:
+        await openai.stop()
+        await bot_runner.cleanup()
+    print(f"\nВызовов Bot API: {bot_api.calls}, запросов к LLM: {openai.calls['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help='числа рабочих процессов через запятую')
+    parser.add_argument('--users', type=int, default=64, help='одновременных пользователей')
+    parser.add_argument('--questions', type=int, default=10, help='вопросов от каждого пользователя')
+    parser.add_argument('--documents', type=int, default=3000, help='шумовых документов в индексе')
+    parser.add_argument('--llm-latency', type=float, default=0.1, help='ответ заглушки OpenAI, сек')
+    parser.add_argument('--queue-workers', type=int, default=4, help='WORK_QUEUE_WORKERS каждого процесса')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод webhook.py')
+    args = parser.parse_args()
+    args.workers = [int(value) for value in args.workers.split(',')]
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        documents = prepare(directory, args.documents, args.users)
+        print(f"Индекс: {documents} документов за {time.perf_counter() - started:.1f} с; "
+              f"{args.users} пользователей × {args.questions} вопросов, LLM {args.llm_latency * 1000:.0f} мс, "
+              f"CPU: {os.cpu_count()}\n")
+        asyncio.run(bench(args, directory))
+
+
+if __name__ == '__main__':
+    main()
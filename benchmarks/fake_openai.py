@@ -0,0 +1,117 @@
+"""Локальный OpenAI-совместимый сервер для проверки AIService без сети.
+
+Отвечает на POST /v1/chat/completions (обычный и stream=True режимы),
+умеет задерживать первый токен, «печатать» ответ по словам, отвечать
+429/500 на заданную долю запросов (или на fail_next следующих) и обрывать
+поток после break_after_tokens токенов.
+
+    python benchmarks/fake_openai.py --port 8089 --first-token 0.5 --fail-rate 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=test python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+DEFAULT_ANSWER = ("Чтобы оформить отпуск, подайте заявку за 2 недели до начала, получите одобрение "
+                  "руководителя и оформите приказ в HR-отделе.")
+
+
+class FakeOpenAIServer:
+    def __init__(self, answer: str = DEFAULT_ANSWER, first_token_delay: float = 0.2,
+                 token_delay: float = 0.02, fail_rate: float = 0.0, fail_status: int = 429, seed: int = 0,
+                 retry_after: Optional[str] = '0.05', fail_next: int = 0, break_after_tokens: Optional[int] = None):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after  # заголовок Retry-After в ответах с ошибкой, None — без него
+        self.fail_next = fail_next
+        self.break_after_tokens = break_after_tokens
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post('/v1/chat/completions', self.chat_completions)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск в текущем event loop; возвращает base_url для AsyncOpenAI"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f'http://{host}:{port}/v1'
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _words(self):
+        return [word + ' ' for word in self.answer.split(' ')]
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.calls['requests'] += 1
+        if self.fail_next or (self.fail_rate and self._random.random() < self.fail_rate):
+            self.fail_next = max(0, self.fail_next - 1)
+            self.calls[f'status_{self.fail_status}'] += 1
+            return web.json_response({'error': {'message': 'fake failure', 'type': 'fake'}},
+                                     status=self.fail_status,
+                                     headers={'retry-after': self.retry_after} if self.retry_after else None)
+
+        created = int(time.time())
+        prompt_tokens = sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4
+        await asyncio.sleep(self.first_token_delay)
+
+        if not body.get('stream'):
+            await asyncio.sleep(self.token_delay * len(self._words()))
+            return web.json_response({
+                'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': created, 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': self.answer}}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(self._words()),
+                          'total_tokens': prompt_tokens + len(self._words())},
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for i, word in enumerate(self._words()):
+            if i == self.break_after_tokens:
+                # Обрыв соединения посреди ответа
+                request.transport.close()
+                return response
+            if i:
+                await asyncio.sleep(self.token_delay)
+            chunk = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created,
+                     'model': body['model'],
+                     'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]}
+            await response.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--first-token', type=float, default=0.2, help='задержка первого токена, сек')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='задержка между токенами, сек')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля запросов с ошибкой')
+    parser.add_argument('--fail-status', type=int, default=429)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(first_token_delay=args.first_token, token_delay=args.token_delay,
+                              fail_rate=args.fail_rate, fail_status=args.fail_status)
+    web.run_app(server.app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Офлайн-заглушки внешних сервисов для бенчмарков и локальной проверки"""
+import itertools
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+class FakeDriveService:
+    """Заглушка GoogleDriveService с журналом изменений в стиле Drive Changes API.
+
+    Изменения задаются сценарием: add/modify/delete/trash/move_out.
+    Каждое изменение получает номер, page token — это номер, с которого читать журнал.
+    latency — искусственная задержка каждого вызова API в секундах (блокирующая, как у httplib2).
+    """
+
+    def __init__(self, folder_id: str = 'folder', documents: Optional[List[Dict]] = None,
+                 latency: float = 0.0):
+        self.folder_id = folder_id
+        self.latency = latency
+        self.files: Dict[str, Dict] = {}
+        self.contents: Dict[str, str] = {}
+        self.changes: List[Dict] = []
+        self.calls = Counter()
+        self.failing = set()  # id файлов, загрузка которых завершается ошибкой
+        self._calls_lock = threading.Lock()
+        self._revision = itertools.count(1)
+        for doc in documents or []:
+            self.add(doc['id'], doc['name'], doc.get('content', ''), doc.get('mimeType'))
+        # Начальное наполнение не попадает в журнал — его видит полный обход
+        self.changes.clear()
+
+    # --- Сценарий изменений ---
+
+    def add(self, file_id: str, name: str, content: str,
+            mime_type: Optional[str] = None, parent: Optional[str] = None):
+        self.files[file_id] = {
+            'id': file_id,
+            'name': name,
+            'mimeType': mime_type or 'application/vnd.google-apps.document',
+            'webViewLink': f'https://docs.google.com/document/d/{file_id}',
+            'modifiedTime': f'rev-{next(self._revision)}',
+            'parents': [parent or self.folder_id],
+            'trashed': False,
+        }
+        self.contents[file_id] = content
+        self._record(file_id)
+
+    def add_folder(self, folder_id: str, name: str, parent: Optional[str] = None):
+        self.files[folder_id] = {'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME_TYPE,
+                                 'parents': [parent or self.folder_id], 'trashed': False}
+        self._record(folder_id)
+
+    def modify(self, file_id: str, content: str):
+        self.files[file_id]['modifiedTime'] = f'rev-{next(self._revision)}'
+        self.contents[file_id] = content
+        self._record(file_id)
+
+    def delete(self, file_id: str):
+        self.files.pop(file_id)
+        self.contents.pop(file_id, None)
+        self.changes.append({'fileId': file_id, 'removed': True})
+
+    def trash(self, file_id: str):
+        self.files[file_id]['trashed'] = True
+        self._record(file_id)
+
+    def move_out(self, file_id: str):
+        self.files[file_id]['parents'] = ['other-folder']
+        self._record(file_id)
+
+    def replay(self, script: List[tuple]):
+        """Проиграть сценарий вида [('add', id, name, content), ('delete', id), ...]"""
+        for action, *args in script:
+            getattr(self, action)(*args)
+
+    def _api_call(self, name: str):
+        with self._calls_lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _record(self, file_id: str):
+        self.changes.append({'fileId': file_id, 'removed': False, 'file': dict(self.files[file_id])})
+
+    # --- Интерфейс GoogleDriveService ---
+
+    def get_documents(self):
+        return self.list_folder_tree()[0]
+
+    def list_folder_tree(self, folder_id: Optional[str] = None):
+        """Как у GoogleDriveService: один вызов files.list на уровень дерева"""
+        folders, files, level = [folder_id or self.folder_id], [], [folder_id or self.folder_id]
+        while level:
+            self._api_call('files_list')
+            children = [dict(f) for f in self.files.values()
+                        if not f['trashed'] and not set(level).isdisjoint(f['parents'])]
+            files += [f for f in children if f['mimeType'] != FOLDER_MIME_TYPE]
+            level = [f['id'] for f in children if f['mimeType'] == FOLDER_MIME_TYPE and f['id'] not in folders]
+            folders += level
+        return files, folders
+
+    def get_start_page_token(self):
+        self._api_call('get_start_page_token')
+        return str(len(self.changes))
+
+    def list_changes(self, page_token):
+        self._api_call('list_changes')
+        start = int(page_token)
+        return [dict(c) for c in self.changes[start:]], str(len(self.changes))
+
+    def fetch_document_content(self, file_id, mime_type, checksum=None):
+        self._api_call('fetch_document_content')
+        if file_id in self.failing:
+            raise IOError(f'HTTP 500 при загрузке {file_id}')
+        return self.contents[file_id]
+
+    def fetch_google_docs_batch(self, file_ids):
+        self._api_call('fetch_google_docs_batch')
+        contents = {i: self.contents[i] for i in file_ids if i not in self.failing}
+        errors = {i: f'HTTP 500 при загрузке {i}' for i in file_ids if i in self.failing}
+        return contents, errors
+
+    def get_document_content(self, file_id, mime_type):
+        return self.fetch_document_content(file_id, mime_type)
+
+
+class HashingEmbedder:
+    """Детерминированные эмбеддинги без модели: мешок хэшированных символьных триграмм.
+
+    Подходит для проверки индексов и бенчмарков без загрузки sentence-transformers.
+    """
+
+    def __init__(self, dimension: int = 256):
+        self.dimension = dimension
+
+    def encode(self, texts):
+        import numpy as np
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            text = f' {text.lower()} '
+            for i in range(len(text) - 2):
+                vectors[row, zlib.crc32(text[i:i + 3].encode()) % self.dimension] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
@@ -0,0 +1,219 @@
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+BM25_INDEX_PATH = os.getenv('BM25_INDEX_PATH', 'bm25.idx')
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Snowball-стеммер для русского языка (алгоритм Портера)
+_RVRE = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+                   r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$')
+_NOUN = re.compile(r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$')
+_DERIVATIONAL_REGION = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DERIVATIONAL = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+
+_TOKEN = re.compile(r'\w+')
+_CYRILLIC = re.compile(r'[а-я]')
+
+STOP_WORDS = frozenset("""
+    и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне
+    было вот от меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был него до вас
+    нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их
+    чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+    совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при
+    наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве
+    три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда
+    конечно всю между это какие
+""".split())
+
+
+def stem(word: str) -> str:
+    """Основа русского слова по Snowball; нерусские слова и числа возвращаются как есть"""
+    match = _RVRE.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    if _DERIVATIONAL_REGION.match(rv):
+        rv = _DERIVATIONAL.sub('', rv, 1)
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """Токены для BM25: нижний регистр, ё→е, без стоп-слов, русские слова — основы"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower().replace('ё', 'е')):
+        if token in STOP_WORDS:
+            continue
+        tokens.append(stem(token) if _CYRILLIC.search(token) else token)
+    return tokens
+
+
+class BM25Index:
+    """Лексический индекс фрагментов (BM25) — не требует модели эмбеддингов.
+
+    В памяти — обратный индекс term → {chunk_id: tf}, на диске — сжатые
+    массивы id и частот, так что индекс на десятки тысяч фрагментов весит мегабайты.
+    """
+
+    available = True
+
+    def __init__(self, path: str = BM25_INDEX_PATH):
+        self.path = path
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: Dict[int, int] = {}
+        self._chunk_terms: Dict[int, Tuple[str, ...]] = {}
+        self._total_length = 0
+        self._dirty = False
+        self._file_stamp = None  # (mtime, размер) файла, перечитанного reload_if_changed
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._lengths)
+
+    def ids(self) -> Set[int]:
+        with self._lock:
+            return set(self._lengths)
+
+    def add(self, chunks: List[Dict]):
+        prepared = [(chunk['id'], Counter(tokenize(chunk['text']))) for chunk in chunks]
+        with self._lock:
+            for chunk_id, counts in prepared:
+                self._add_counts(chunk_id, counts)
+            self._dirty = self._dirty or bool(prepared)
+
+    def _add_counts(self, chunk_id: int, counts: Counter):
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[chunk_id] = tf
+        length = sum(counts.values())
+        self._lengths[chunk_id] = length
+        self._chunk_terms[chunk_id] = tuple(counts)
+        self._total_length += length
+
+    def remove(self, chunk_ids: List[int]):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                for term in self._chunk_terms.pop(chunk_id, ()):
+                    postings = self._postings[term]
+                    del postings[chunk_id]
+                    if not postings:
+                        del self._postings[term]
+                self._total_length -= self._lengths.pop(chunk_id, 0)
+                self._dirty = True
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Топ-k фрагментов по BM25: [(chunk_id, score), ...]"""
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._lengths)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+            scores: Dict[int, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[chunk_id] / average_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def rebuild(self, store):
+        with self._lock:
+            self._postings, self._lengths, self._chunk_terms = {}, {}, {}
+            self._total_length = 0
+        for batch in store.iter_chunks():
+            self.add(batch)
+        with self._lock:
+            self._dirty = True
+
+    def save(self):
+        """Атомарная запись индекса на диск, только если он менялся"""
+        with self._lock:
+            if not self._dirty:
+                return
+            postings = {term: (array('q', items.keys()).tobytes(), array('I', items.values()).tobytes())
+                        for term, items in self._postings.items()}
+            payload = zlib.compress(pickle.dumps({
+                'postings': postings,
+                'lengths': (array('q', self._lengths).tobytes(), array('I', self._lengths.values()).tobytes()),
+            }, protocol=pickle.HIGHEST_PROTOCOL))
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать файл, если его заменил другой процесс. True — индекс перечитан"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._file_stamp:
+            return False
+        fresh = BM25Index(self.path)
+        with self._lock:
+            self._postings, self._lengths = fresh._postings, fresh._lengths
+            self._chunk_terms, self._total_length = fresh._chunk_terms, fresh._total_length
+            self._file_stamp = stamp
+            self._dirty = False
+        return True
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = pickle.loads(zlib.decompress(f.read()))
+        chunk_terms: Dict[int, List[str]] = {}
+        for term, (ids_bytes, tfs_bytes) in data['postings'].items():
+            ids, tfs = array('q'), array('I')
+            ids.frombytes(ids_bytes)
+            tfs.frombytes(tfs_bytes)
+            self._postings[term] = dict(zip(ids, tfs))
+            for chunk_id in ids:
+                chunk_terms.setdefault(chunk_id, []).append(term)
+        ids, lengths = array('q'), array('I')
+        ids.frombytes(data['lengths'][0])
+        lengths.frombytes(data['lengths'][1])
+        self._lengths = dict(zip(ids, lengths))
+        self._chunk_terms = {chunk_id: tuple(terms) for chunk_id, terms in chunk_terms.items()}
+        self._total_length = sum(self._lengths.values())
@@ -0,0 +1,55 @@
+import re
+from typing import List
+
+CHUNK_SIZE = 800  # символов в одном фрагменте
+CHUNK_OVERLAP = 150  # перекрытие соседних фрагментов, чтобы не резать мысль на границе
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def _split_long(block: str, size: int) -> List[str]:
+    """Деление слишком длинного абзаца по предложениям, в крайнем случае — по символам"""
+    pieces = []
+    for sentence in _SENTENCE_END.split(block):
+        while len(sentence) > size:
+            pieces.append(sentence[:size])
+            sentence = sentence[size:]
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Разбиение текста документа на фрагменты для поиска.
+
+    Границы фрагментов по возможности совпадают с границами абзацев и строк
+    (для таблиц одна строка — одна запись), соседние фрагменты перекрываются.
+    """
+    blocks = []
+    for block in re.split(r'\n\s*\n|\n', text or ''):
+        block = block.strip()
+        if not block:
+            continue
+        blocks.extend(_split_long(block, size) if len(block) > size else [block])
+
+    chunks = []
+    current: List[str] = []
+    length = 0
+    for block in blocks:
+        if current and length + len(block) + 1 > size:
+            chunks.append('\n'.join(current))
+            # Хвост предыдущего фрагмента переносим в начало следующего
+            tail: List[str] = []
+            tail_length = 0
+            for previous in reversed(current):
+                if tail_length + len(previous) > overlap:
+                    break
+                tail.insert(0, previous)
+                tail_length += len(previous) + 1
+            current, length = tail, tail_length
+        current.append(block)
+        length += len(block) + 1
+
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
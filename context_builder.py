@@ -0,0 +1,146 @@
+import hashlib
+import os
+import re
+from typing import Dict, List, Tuple
+
+from bm25_index import tokenize
+from retrieval import reciprocal_rank_fusion
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken считаем токены приблизительно
+    tiktoken = None
+
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+CONTEXT_WINDOW = int(os.getenv('CONTEXT_WINDOW', '16385'))  # окно модели в токенах
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))  # потолок на фрагменты документов
+MIN_PASSAGE_TOKENS = 64  # хвост бюджета меньше этого не заполняем обрезанным фрагментом
+DUPLICATE_THRESHOLD = 0.8  # доля общих шинглов, начиная с которой фрагменты считаются дублями
+
+
+class TokenCounter:
+    """Подсчет токенов как у OpenAI (tiktoken), без него — оценка по байтам UTF-8"""
+
+    def __init__(self, model: str = OPENAI_MODEL):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                # Словарь кодировки скачивается при первом использовании — без сети считаем приблизительно
+                print(f"⚠️ tiktoken недоступен ({e}), токены считаются приблизительно")
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        # ~4 байта на токен: латиница ~4 символа, кириллица ~2 символа
+        return (len(text.encode('utf-8')) + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезка текста до max_tokens токенов"""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text)
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens])
+        limit = max_tokens * 4
+        encoded = text.encode('utf-8')
+        return text if len(encoded) <= limit else encoded[:limit].decode('utf-8', errors='ignore')
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r'\w+', text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+class ContextBuilder:
+    """Сборка контекста для LLM в пределах бюджета токенов.
+
+    Фрагменты ранжируются (позиция в выдаче поиска + покрытие слов вопроса),
+    дубли и почти-дубли отбрасываются, лучшие укладываются в бюджет,
+    который никогда не превышает окно модели за вычетом промпта и max_tokens ответа.
+    """
+
+    def __init__(self, counter: TokenCounter = None, context_window: int = CONTEXT_WINDOW,
+                 token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.counter = counter or TokenCounter()
+        self.context_window = context_window
+        self.token_budget = token_budget
+
+    def budget(self, prompt_tokens: int, max_tokens: int) -> int:
+        """Сколько токенов остается на фрагменты при данном промпте и длине ответа"""
+        return max(min(self.token_budget, self.context_window - prompt_tokens - max_tokens), 0)
+
+    def rank(self, query: str, passages: List[Dict]) -> List[Dict]:
+        query_terms = set(tokenize(query))
+        by_retrieval = [(i, 0.0) for i in range(len(passages))]
+        if not query_terms:
+            return list(passages)
+        coverage = [(i, len(query_terms & set(tokenize(p.get('content', '')))) / len(query_terms))
+                    for i, p in enumerate(passages)]
+        coverage.sort(key=lambda item: item[1], reverse=True)
+        fused = reciprocal_rank_fusion([by_retrieval, coverage], len(passages))
+        return [passages[i] for i, _ in fused]
+
+    def deduplicate(self, passages: List[Dict]) -> Tuple[List[Dict], int]:
+        unique, seen_hashes, seen_shingles = [], set(), []
+        for passage in passages:
+            content = passage.get('content', '')
+            digest = hashlib.sha1(' '.join(content.lower().split()).encode('utf-8')).digest()
+            if digest in seen_hashes:
+                continue
+            shingles = _shingles(content)
+            if any(len(shingles & other) / max(min(len(shingles), len(other)), 1) >= DUPLICATE_THRESHOLD
+                   for other in seen_shingles):
+                continue
+            seen_hashes.add(digest)
+            seen_shingles.append(shingles)
+            unique.append(passage)
+        return unique, len(passages) - len(unique)
+
+    @staticmethod
+    def format_passage(name: str, content: str) -> str:
+        return f"Документ: {name}\nСодержание: {content}\n"
+
+    def build(self, query: str, passages: List[Dict], budget: int) -> Tuple[str, List[Dict], Dict]:
+        """Контекст, реально вошедшие фрагменты и статистика токенов.
+
+        Сначала целиком берутся все фрагменты, которые помещаются, затем остаток
+        бюджета заполняет обрезанный лучший из не поместившихся.
+        """
+        ranked, duplicates = self.deduplicate(self.rank(query, passages))
+        selected: Dict[int, Tuple[str, int]] = {}
+        skipped = []
+        used_tokens = 0
+        for position, passage in enumerate(ranked):
+            text = self.format_passage(passage.get('name', 'Неизвестный документ'), passage.get('content', ''))
+            tokens = self.counter.count(text) + 1  # +1 на разделитель
+            if used_tokens + tokens <= budget:
+                selected[position] = (text, tokens)
+                used_tokens += tokens
+            else:
+                skipped.append(position)
+
+        if skipped:
+            passage = ranked[skipped[0]]
+            name = passage.get('name', 'Неизвестный документ')
+            # Запас в пару токенов на многоточие и стык обрезки с шаблоном
+            remaining = budget - used_tokens - self.counter.count(self.format_passage(name, '')) - 3
+            if remaining >= MIN_PASSAGE_TOKENS:
+                text = self.format_passage(name, self.counter.truncate(passage.get('content', ''), remaining) + "...")
+                tokens = self.counter.count(text) + 1
+                if used_tokens + tokens <= budget:
+                    selected[skipped[0]] = (text, tokens)
+                    used_tokens += tokens
+
+        order = sorted(selected)
+        stats = {
+            'context_tokens': used_tokens,
+            'budget': budget,
+            'passages_used': len(order),
+            'passages_dropped': len(ranked) - len(order),
+            'duplicates': duplicates,
+        }
+        return "\n".join(selected[i][0] for i in order), [ranked[i] for i in order], stats
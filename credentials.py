@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import errno
+import os
+import pickle
+import threading
+from typing import Optional
+
+from google.auth.transport.requests import Request
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+TOKEN_PATH = os.getenv('GOOGLE_TOKEN_PATH', 'token.pickle')
+CLIENT_SECRETS_PATH = os.getenv('GOOGLE_CREDENTIALS_PATH', 'credentials.json')
+CREDENTIALS_REFRESH_MARGIN = float(os.getenv('CREDENTIALS_REFRESH_MARGIN', '300'))  # обновлять за столько сек до истечения
+CREDENTIALS_CHECK_INTERVAL = float(os.getenv('CREDENTIALS_CHECK_INTERVAL', '60'))  # фоновая проверка срока, сек
+
+
+class CredentialsManager:
+    """Общие на процесс учетные данные Google.
+
+    token.pickle читается один раз. Токен обновляется заранее — за
+    CREDENTIALS_REFRESH_MARGIN секунд до истечения, под блокировкой, поэтому
+    потоки с HTTP-клиентами не видят просроченный токен и не обновляют его наперегонки.
+    """
+
+    def __init__(self, token_path: str = TOKEN_PATH, client_secrets_path: str = CLIENT_SECRETS_PATH,
+                 scopes=None, refresh_margin: float = CREDENTIALS_REFRESH_MARGIN):
+        self.token_path = token_path
+        self.client_secrets_path = client_secrets_path
+        self.scopes = scopes or SCOPES
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._creds = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def _expiring(self, creds) -> bool:
+        if not creds.valid:
+            return True
+        # expiry у google-auth — наивное время в UTC
+        return creds.expiry is not None and creds.expiry - datetime.datetime.utcnow() < self.refresh_margin
+
+    def get(self):
+        """Действующие учетные данные; при необходимости загружаются или обновляются"""
+        creds = self._creds
+        if creds is not None and not self._expiring(creds):
+            return creds
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load()
+            if self._expiring(self._creds):
+                self._refresh()
+            return self._creds
+
+    def refresh_if_needed(self) -> bool:
+        """Фоновое обновление токена, пока он еще действует. True — токен обновлен"""
+        with self._lock:
+            if self._creds is None or not self._expiring(self._creds):
+                return False
+            self._refresh()
+            return True
+
+    async def refresh_loop(self, interval: float = CREDENTIALS_CHECK_INTERVAL):
+        """Фоновое обновление: запросы к API не ждут обновления токена"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await asyncio.to_thread(self.refresh_if_needed):
+                    print("🔑 Токен Google обновлен")
+            except Exception as e:
+                print(f"❌ Ошибка обновления токена Google: {e}")
+
+    def _load(self):
+        creds = None
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'rb') as token:
+                creds = pickle.load(token)
+        if creds and (creds.valid or creds.refresh_token):
+            return creds
+
+        flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets_path, self.scopes)
+        creds = flow.run_local_server(port=0)
+        self._save(creds)
+        return creds
+
+    def _refresh(self):
+        self._creds.refresh(Request())
+        self.refreshes += 1
+        self._save(self._creds)
+
+    def _save(self, creds):
+        """Атомарная запись через временный файл. Файл, смонтированный в контейнер
+        отдельно (bind mount в Docker), заменить нельзя — он перезаписывается на месте"""
+        data = pickle.dumps(creds)
+        tmp_path = self.token_path + '.tmp'
+        with open(tmp_path, 'wb') as token:
+            token.write(data)
+        try:
+            os.replace(tmp_path, self.token_path)
+        except OSError as e:
+            os.remove(tmp_path)
+            if e.errno not in (errno.EBUSY, errno.EXDEV):
+                raise
+            with open(self.token_path, 'wb') as token:
+                token.write(data)
+
+
+_default_manager: Optional[CredentialsManager] = None
+_default_lock = threading.Lock()
+
+
+def default_credentials() -> CredentialsManager:
+    """Менеджер учетных данных, общий для всех GoogleDriveService процесса"""
+    global _default_manager
+    with _default_lock:
+        if _default_manager is None:
+            _default_manager = CredentialsManager()
+        return _default_manager
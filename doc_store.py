@@ -0,0 +1,423 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from gdrive_service import FOLDER_MIME_TYPE, is_supported_mime_type
+
+STORE_PATH = os.getenv('DOCS_STORE_PATH', 'documents.db')
+SYNC_RETRY_DELAY = float(os.getenv('SYNC_RETRY_DELAY', '300'))  # повтор загрузки файла после ошибки, дальше вдвое реже
+SYNC_MAX_RETRY_DELAY = 24 * 3600
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', '100'))  # файлов, скачиваемых и сохраняемых одной транзакцией
+IN_QUERY_BATCH = 500  # параметров в одном IN (...): их число в SQLite ограничено
+
+UPSERT_DOCUMENT = """
+    INSERT OR REPLACE INTO documents (id, name, mime_type, link, modified_time, md5, content, synced_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class DocumentStore:
+    """Локальное хранилище содержимого документов Google Drive (SQLite).
+
+    Документ хранится вместе с версией (modifiedTime + md5Checksum),
+    поэтому повторно скачивается только то, что действительно изменилось.
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                mime_type TEXT,
+                link TEXT,
+                modified_time TEXT,
+                md5 TEXT,
+                content TEXT,
+                synced_at REAL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id TEXT,
+                position INTEGER,
+                text TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id)")
+        # Постраничный список /docs идет по индексу, без сортировки всей таблицы
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_name ON documents (name COLLATE NOCASE, id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS folders (
+                id TEXT PRIMARY KEY
+            )
+        """)
+        # Файлы, которые не удалось загрузить: повторяются отдельно, не задерживая токен изменений
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS failed_files (
+                id TEXT PRIMARY KEY,
+                file TEXT,
+                error TEXT,
+                attempts INTEGER,
+                retry_at REAL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: Optional[str]):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def folder_ids(self) -> List[str]:
+        """Папки синхронизируемого дерева (корень и все подпапки) на момент полного обхода"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM folders").fetchall()]
+
+    def set_folders(self, folder_ids: List[str]):
+        with self._lock:
+            self._conn.execute("DELETE FROM folders")
+            self._conn.executemany("INSERT OR IGNORE INTO folders (id) VALUES (?)", [(f,) for f in folder_ids])
+            self._conn.commit()
+
+    def due_failures(self, now: float) -> List[Dict]:
+        """Метаданные файлов, которым пора повторить загрузку"""
+        with self._lock:
+            rows = self._conn.execute("SELECT file FROM failed_files WHERE retry_at <= ?", (now,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def failed_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM failed_files").fetchall()]
+
+    def stale_files(self, files: List[Dict]) -> List[Dict]:
+        """Файлы, версия которых на Drive отличается от сохраненной, и еще не сохраненные"""
+        saved = {}
+        with self._lock:
+            for start in range(0, len(files), IN_QUERY_BATCH):
+                ids = [file['id'] for file in files[start:start + IN_QUERY_BATCH]]
+                rows = self._conn.execute(
+                    f"SELECT id, modified_time, md5 FROM documents WHERE id IN ({','.join('?' * len(ids))})", ids)
+                saved.update({row['id']: (row['modified_time'], row['md5']) for row in rows})
+        return [file for file in files if saved.get(file['id']) != (file.get('modifiedTime'), file.get('md5Checksum'))]
+
+    @staticmethod
+    def _document_row(file: Dict, content: str, now: float) -> tuple:
+        return (file['id'], file.get('name'), file.get('mimeType'), file.get('webViewLink'),
+                file.get('modifiedTime'), file.get('md5Checksum'), content, now)
+
+    def upsert(self, file: Dict, content: str):
+        with self._lock:
+            self._conn.execute(UPSERT_DOCUMENT, self._document_row(file, content, time.time()))
+            self._conn.commit()
+
+    def save_batch(self, updated: List[Tuple[Dict, str]], failed: List[Tuple[Dict, str]]):
+        """Пачка загрузки одной транзакцией: документы с содержимым и файлы с ошибкой.
+
+        Для файлов с ошибкой пауза до повтора растет с числом попыток.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(UPSERT_DOCUMENT, [self._document_row(file, content, now) for file, content in updated])
+            self._conn.executemany("DELETE FROM failed_files WHERE id = ?", [(file['id'],) for file, _ in updated])
+            for file, error in failed:
+                row = self._conn.execute("SELECT attempts FROM failed_files WHERE id = ?", (file['id'],)).fetchone()
+                attempts = row[0] if row else 0
+                delay = min(SYNC_RETRY_DELAY * 2 ** attempts, SYNC_MAX_RETRY_DELAY)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO failed_files (id, file, error, attempts, retry_at) VALUES (?, ?, ?, ?, ?)",
+                    (file['id'], json.dumps(file), error, attempts + 1, now + delay))
+            self._conn.commit()
+
+    def delete(self, file_id: str) -> bool:
+        return bool(self.delete_many([file_id]))
+
+    def delete_many(self, file_ids: Iterable[str]) -> List[str]:
+        """Удаление документов вместе с записями об ошибках загрузки. Возвращает id удаленных документов"""
+        deleted = []
+        with self._lock:
+            for file_id in file_ids:
+                if self._conn.execute("DELETE FROM documents WHERE id = ?", (file_id,)).rowcount:
+                    deleted.append(file_id)
+                self._conn.execute("DELETE FROM failed_files WHERE id = ?", (file_id,))
+            self._conn.commit()
+        return deleted
+
+    def get_versions(self, file_ids) -> Dict[str, str]:
+        """Текущие версии документов (modifiedTime:md5) — для проверки кэшей"""
+        file_ids = list(file_ids)
+        if not file_ids:
+            return {}
+        placeholders = ','.join('?' * len(file_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, modified_time, md5 FROM documents WHERE id IN ({placeholders})", file_ids).fetchall()
+        return {row['id']: f"{row['modified_time']}:{row['md5']}" for row in rows}
+
+    def get_document(self, file_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, name, link, content FROM documents WHERE id = ?", (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    def replace_chunks(self, document_id: str, texts: List[str]) -> Tuple[List[int], List[Dict]]:
+        """Замена фрагментов документа. Возвращает (id удаленных, новые фрагменты с id)."""
+        with self._lock:
+            old_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM chunks WHERE document_id = ?", (document_id,))]
+            self._conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            new_chunks = []
+            for position, text in enumerate(texts):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (document_id, position, text) VALUES (?, ?, ?)",
+                    (document_id, position, text))
+                new_chunks.append({'id': cursor.lastrowid, 'document_id': document_id, 'text': text})
+            self._conn.commit()
+        return old_ids, new_chunks
+
+    def iter_chunks(self, batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """Все фрагменты пачками — для восстановления индексов без повторной загрузки с Drive"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, document_id, text FROM chunks WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield [dict(row) for row in rows]
+
+    def chunk_ids(self) -> Set[int]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT id FROM chunks")}
+
+    def chunks_by_id(self, chunk_ids: List[int]) -> List[Dict]:
+        """Фрагменты в формате iter_chunks — для дозаполнения индексов"""
+        chunks = []
+        with self._lock:
+            for start in range(0, len(chunk_ids), IN_QUERY_BATCH):
+                ids = chunk_ids[start:start + IN_QUERY_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT id, document_id, text FROM chunks WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id",
+                    ids).fetchall()
+                chunks.extend(dict(row) for row in rows)
+        return chunks
+
+    def document_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def chunk_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def unchunked_document_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT id FROM documents
+                WHERE id NOT IN (SELECT DISTINCT document_id FROM chunks)
+            """).fetchall()
+        return [row[0] for row in rows]
+
+    def get_chunks(self, chunk_ids: List[int]) -> List[Dict]:
+        """Фрагменты с данными документа в порядке chunk_ids (формат AIService)"""
+        if not chunk_ids:
+            return []
+        placeholders = ','.join('?' * len(chunk_ids))
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT c.id, c.document_id, c.text, d.name, d.link
+                FROM chunks c JOIN documents d ON d.id = c.document_id
+                WHERE c.id IN ({placeholders})
+            """, list(chunk_ids)).fetchall()
+        by_id = {row['id']: {'chunk_id': row['id'], 'id': row['document_id'], 'name': row['name'],
+                             'content': row['text'], 'link': row['link']} for row in rows}
+        return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+
+    def checksums(self) -> Set[str]:
+        """md5 сохраненных версий файлов (у файлов Google md5 нет)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT md5 FROM documents WHERE md5 IS NOT NULL").fetchall()
+        return {row[0] for row in rows}
+
+    def document_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM documents").fetchall()
+        return [row[0] for row in rows]
+
+    def list_documents(self, offset: int, limit: int) -> List[Dict]:
+        """Страница списка документов по названию, без содержимого"""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT id, name, mime_type, link FROM documents
+                ORDER BY name COLLATE NOCASE, id LIMIT ? OFFSET ?
+            """, (limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_documents(self, limit: Optional[int] = None) -> List[Dict]:
+        """Документы с содержимым в формате, который ожидает AIService"""
+        query = "SELECT id, name, link, content FROM documents ORDER BY name"
+        params = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [{'id': row['id'], 'name': row['name'], 'content': row['content'], 'link': row['link']}
+                for row in rows]
+
+
+class DriveSync:
+    """Инкрементальная синхронизация DocumentStore с папкой Google Drive.
+
+    Первый запуск делает полный обход папки со всеми подпапками, дальше через
+    Drive Changes API скачиваются только новые и измененные файлы, удаленные
+    убираются из хранилища. Если меняется само дерево папок (подпапку создали,
+    переместили или удалили), выполняется полный обход: список папок и их
+    файлов так проще всего привести в соответствие, а неизменившиеся файлы
+    при этом не перекачиваются.
+    Файл, который не удалось загрузить, не держит токен изменений: он
+    запоминается и загружается повторно в следующих проходах с растущей паузой.
+    Работает поверх AsyncDriveService, изменившиеся файлы скачиваются параллельно.
+    """
+
+    PAGE_TOKEN_KEY = 'changes_page_token'
+
+    def __init__(self, drive, store: DocumentStore, folder_id: Optional[str] = None):
+        self.drive = drive
+        self.store = store
+        self.folder_id = folder_id if folder_id is not None else os.getenv('GOOGLE_DRIVE_FOLDER_ID')
+        self._listeners: List[Callable[[str, Optional[Dict]], None]] = []
+        self._folders = set(store.folder_ids()) or {self.folder_id}
+
+    def add_listener(self, callback: Callable[[str, Optional[Dict]], None]):
+        """Подписка на изменения: callback(file_id, document) — document is None при удалении.
+
+        Вызывается в рабочем потоке, а не в event loop.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, file_id: str, document: Optional[Dict]):
+        for callback in self._listeners:
+            callback(file_id, document)
+
+    async def sync(self) -> Dict[str, int]:
+        """Один проход синхронизации. Возвращает статистику изменений."""
+        page_token = await asyncio.to_thread(self.store.get_meta, self.PAGE_TOKEN_KEY)
+        # Хранилище без списка папок (синхронизировано до обхода подпапок) один раз обходится полностью
+        if page_token and await asyncio.to_thread(self.store.folder_ids):
+            return await self._apply_changes(page_token)
+        return await self._full_sync()
+
+    async def _full_sync(self) -> Dict[str, int]:
+        # Токен берем до обхода, чтобы не потерять изменения, сделанные во время обхода
+        page_token = await self.drive.get_start_page_token()
+        files, folders = await self.drive.list_folder_tree(self.folder_id)
+        await asyncio.to_thread(self.store.set_folders, folders)
+        self._folders = set(folders)
+        stats = await self._update(files)
+        stats['deleted'] += await asyncio.to_thread(self._delete_missing, {file['id'] for file in files})
+        await asyncio.to_thread(self.store.set_meta, self.PAGE_TOKEN_KEY, page_token)
+        return stats
+
+    def _delete_missing(self, remote_ids: set) -> int:
+        """Документы и ошибки загрузки файлов, которых больше нет в дереве папок"""
+        local_ids = self.store.document_ids() + self.store.failed_ids()
+        return self._delete([file_id for file_id in dict.fromkeys(local_ids) if file_id not in remote_ids])
+
+    async def _apply_changes(self, page_token: str) -> Dict[str, int]:
+        changes, new_page_token = await self.drive.list_changes(page_token)
+
+        # Если файл менялся несколько раз, важно только последнее состояние
+        latest = {change['fileId']: change for change in changes}
+        if any(self._changes_tree(change) for change in latest.values()):
+            return await self._full_sync()
+        removed, to_update = [], []
+        for change in latest.values():
+            file = change.get('file')
+            if change.get('removed') or not file or not self._in_scope(file):
+                removed.append(change['fileId'])
+            else:
+                to_update.append(file)
+        deleted = await asyncio.to_thread(self._delete, removed)
+        # Файлы, не загрузившиеся раньше и с тех пор не менявшиеся
+        due = await asyncio.to_thread(self.store.due_failures, time.time())
+        to_update += [file for file in due if file['id'] not in latest]
+
+        stats = await self._update(to_update)
+        stats['deleted'] += deleted
+
+        # Токен сдвигается и при ошибках: неудавшиеся файлы уже в failed_files
+        if new_page_token:
+            await asyncio.to_thread(self.store.set_meta, self.PAGE_TOKEN_KEY, new_page_token)
+        return stats
+
+    def _in_scope(self, file: Dict) -> bool:
+        if file.get('trashed') or not is_supported_mime_type(file.get('mimeType')):
+            return False
+        return not self.folder_id or not self._folders.isdisjoint(file.get('parents', []))
+
+    def _changes_tree(self, change: Dict) -> bool:
+        """Изменение папки внутри дерева или папки, которая в нем была"""
+        if not self.folder_id:
+            return False
+        if change['fileId'] in self._folders:
+            return True
+        file = change.get('file') or {}
+        return (file.get('mimeType') == FOLDER_MIME_TYPE and not file.get('trashed')
+                and not self._folders.isdisjoint(file.get('parents', [])))
+
+    async def _update(self, files: List[Dict]) -> Dict[str, int]:
+        stats = {'updated': 0, 'deleted': 0, 'unchanged': 0, 'errors': 0}
+        # Работа с SQLite и слушатели — в потоке: полный обход тысяч файлов не останавливает обработчики
+        stale = await asyncio.to_thread(self.store.stale_files, files)
+        stats['unchanged'] = len(files) - len(stale)
+        for start in range(0, len(stale), SYNC_BATCH_SIZE):
+            batch = stale[start:start + SYNC_BATCH_SIZE]
+            contents, errors = await self.drive.get_documents_content(batch)
+            updated, failed = await asyncio.to_thread(self._save, batch, contents, errors)
+            stats['updated'] += updated
+            stats['errors'] += failed
+        return stats
+
+    def _save(self, files: List[Dict], contents: Dict[str, str], errors: Dict[str, str]) -> Tuple[int, int]:
+        failed = [(file, errors[file['id']]) for file in files if file['id'] in errors]
+        updated = [(file, contents[file['id']]) for file in files if file['id'] not in errors]
+        self.store.save_batch(updated, failed)
+        for file, error in failed:
+            print(f"❌ Не удалось загрузить {file.get('name')}: {error}")
+        for file, content in updated:
+            self._notify(file['id'], {'id': file['id'], 'name': file.get('name'),
+                                      'content': content, 'link': file.get('webViewLink')})
+        return len(updated), len(failed)
+
+    def _delete(self, file_ids: List[str]) -> int:
+        deleted = self.store.delete_many(file_ids)
+        for file_id in deleted:
+            self._notify(file_id, None)
+        return len(deleted)
@@ -1,122 +1,275 @@
 import os
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import threading
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
-import io
-import pickle
+import google_auth_httplib2
+import httplib2
+import tempfile
+
+from credentials import SCOPES, CredentialsManager, default_credentials  # noqa: F401
+from office_extract import extract_office_text
+from pdf_extract import PDF_DOWNLOAD_CHUNK, extract_pdf_text, read_cached_text
+from sheets import SheetTable, plan_requests
+
+# Поля файла, нужные для синхронизации локального хранилища
+FILE_FIELDS = "id, name, mimeType, webViewLink, modifiedTime, md5Checksum, parents, trashed"
+SUPPORTED_MIME_TYPES = ('document', 'spreadsheet', 'pdf')
+GOOGLE_DOC_MIME_TYPE = 'application/vnd.google-apps.document'
+GOOGLE_SHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+DOCS_BATCH_SIZE = 50  # запросов в одном HTTP batch
+LIST_PAGE_SIZE = 1000  # максимум files.list
+LIST_PARENTS_PER_QUERY = 20  # папок в одном запросе files.list при обходе дерева
+
+
+def is_supported_mime_type(mime_type):
+    """Проверка, умеем ли мы извлекать содержимое файла такого типа"""
+    return any(kind in (mime_type or '') for kind in SUPPORTED_MIME_TYPES)
 
-SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 
 class GoogleDriveService:
-    def __init__(self):
-        self.creds = None
-        self.service = None
+    """Клиент Google Drive, Docs и Sheets.
+    
+    Клиенты API строятся один раз и переиспользуются. httplib2 не потокобезопасен,
+    поэтому у каждого потока свои клиенты и HTTP-соединение, а учетные данные —
+    общие, из CredentialsManager.
+    """
+    
+    def __init__(self, credentials: CredentialsManager = None):
+        self.credentials = credentials or default_credentials()
         self.folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
+        self._local = threading.local()
         
+    @property
+    def creds(self):
+        return self.credentials.get()
+    
+    @property
+    def service(self):
+        return self._client('drive', 'v3')
+    
     def authenticate(self):
         """Аутентификация в Google Drive API"""
-        if os.path.exists('token.pickle'):
-            with open('token.pickle', 'rb') as token:
-                self.creds = pickle.load(token)
+        self.credentials.get()
+        return self.service
+    
+    def _client(self, name, version, *path):
+        """Клиент API или вложенный ресурс (например, documents) для текущего потока.
         
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
+        И build(), и каждый вызов вложенного ресурса заново разбирают
+        discovery-описание, поэтому кэшируются оба.
+        """
+        clients = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = self._local.clients = {}
+        key = (name, version) + path
+        client = clients.get(key)
+        if client is None:
+            if path:
+                client = getattr(self._client(name, version, *path[:-1]), path[-1])()
             else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', SCOPES)
-                self.creds = flow.run_local_server(port=0)
-            
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(self.creds, token)
-        
-        self.service = build('drive', 'v3', credentials=self.creds)
+                http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+                client = build(name, version, http=http, cache_discovery=False)
+            clients[key] = client
+        return client
     
     def get_documents(self):
-        """Получение списка документов из папки"""
-        if not self.service:
-            self.authenticate()
+        """Получение списка документов из папки и всех ее подпапок"""
+        return self.list_folder_tree()[0]
+    
+    def list_folder_tree(self, folder_id=None):
+        """Поддерживаемые документы папки и всех подпапок: (файлы, id папок дерева).
         
-        results = self.service.files().list(
-            q=f"'{self.folder_id}' in parents and (mimeType contains 'document' or mimeType contains 'spreadsheet' or mimeType contains 'pdf')",
-            pageSize=100,
-            fields="files(id, name, mimeType, webViewLink)"
-        ).execute()
+        Обход по уровням: подпапки одного уровня запрашиваются вместе
+        ('a' in parents or 'b' in parents ...), каждая выдача — до конца по nextPageToken.
+        """
+        root = folder_id or self.folder_id
+        folders = [root]
+        files = {}
+        level = [root]
+        while level:
+            next_level = []
+            for start in range(0, len(level), LIST_PARENTS_PER_QUERY):
+                parents = ' or '.join(f"'{parent}' in parents" for parent in level[start:start + LIST_PARENTS_PER_QUERY])
+                kinds = ' or '.join(f"mimeType contains '{kind}'" for kind in SUPPORTED_MIME_TYPES)
+                query = f"({parents}) and trashed = false and (mimeType = '{FOLDER_MIME_TYPE}' or {kinds})"
+                for file in self._list_files(query):
+                    if file['mimeType'] != FOLDER_MIME_TYPE:
+                        files[file['id']] = file  # файл может лежать в нескольких папках
+                    elif file['id'] not in folders:
+                        folders.append(file['id'])
+                        next_level.append(file['id'])
+            level = next_level
+        return list(files.values()), folders
+    
+    def _list_files(self, query):
+        page_token = None
+        while True:
+            response = self._client('drive', 'v3', 'files').list(
+                q=query,
+                pageSize=LIST_PAGE_SIZE,
+                pageToken=page_token,
+                fields=f"nextPageToken, files({FILE_FIELDS})"
+            ).execute()
+            yield from response.get('files', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+    
+    def get_start_page_token(self):
+        """Получение стартового токена для Drive Changes API"""
+        response = self._client('drive', 'v3', 'changes').getStartPageToken().execute()
+        return response['startPageToken']
+    
+    def list_changes(self, page_token):
+        """Получение всех изменений начиная с page_token.
         
-        return results.get('files', [])
+        Возвращает кортеж (изменения, новый стартовый токен).
+        """
+        changes = []
+        new_start_page_token = None
+        while page_token:
+            response = self._client('drive', 'v3', 'changes').list(
+                pageToken=page_token,
+                spaces='drive',
+                includeRemoved=True,
+                pageSize=1000,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+            ).execute()
+            changes.extend(response.get('changes', []))
+            new_start_page_token = response.get('newStartPageToken', new_start_page_token)
+            page_token = response.get('nextPageToken')
+        
+        return changes, new_start_page_token
     
     def get_document_content(self, file_id, mime_type):
         """Получение содержимого документа"""
-        if not self.service:
-            self.authenticate()
-        
         try:
-            if 'document' in mime_type:
-                return self._get_google_doc_content(file_id)
-            elif 'spreadsheet' in mime_type:
-                return self._get_google_sheet_content(file_id)
-            elif 'pdf' in mime_type:
-                return self._get_pdf_content(file_id)
-            else:
-                return f"Неподдерживаемый тип файла: {mime_type}"
+            return self.fetch_document_content(file_id, mime_type)
         except Exception as e:
             return f"Ошибка при получении содержимого: {str(e)}"
     
+    def fetch_document_content(self, file_id, mime_type, checksum=None):
+        """Получение содержимого документа с пробросом ошибок (для синхронизации).
+        
+        checksum (md5Checksum файла) позволяет не скачивать PDF, текст которого уже извлечен.
+        """
+        # Docs и Sheets API читают только файлы Google; .docx, .xlsx и OpenDocument скачиваются
+        if mime_type == GOOGLE_DOC_MIME_TYPE:
+            return self._get_google_doc_content(file_id)
+        elif mime_type == GOOGLE_SHEET_MIME_TYPE:
+            return self._get_google_sheet_content(file_id)
+        elif 'pdf' in mime_type:
+            return self._get_pdf_content(file_id, checksum)
+        elif is_supported_mime_type(mime_type):
+            return self._get_office_content(file_id)
+        else:
+            return f"Неподдерживаемый тип файла: {mime_type}"
+    
     def _get_google_doc_content(self, file_id):
         """Получение содержимого Google Doc"""
-        try:
-            from googleapiclient.discovery import build
-            docs_service = build('docs', 'v1', credentials=self.creds)
-            document = docs_service.documents().get(documentId=file_id).execute()
-            
-            content = []
-            for element in document.get('body', {}).get('content', []):
-                if 'paragraph' in element:
-                    for para_element in element['paragraph']['elements']:
-                        if 'textRun' in para_element:
-                            content.append(para_element['textRun']['content'])
-            
-            return ''.join(content)
-        except Exception as e:
-            return f"Ошибка при чтении Google Doc: {str(e)}"
+        document = self._client('docs', 'v1', 'documents').get(documentId=file_id).execute()
+        return self._parse_google_doc(document)
+    
+    @staticmethod
+    def _parse_google_doc(document):
+        """Извлечение текста из ответа documents().get"""
+        content = []
+        for element in document.get('body', {}).get('content', []):
+            if 'paragraph' in element:
+                for para_element in element['paragraph']['elements']:
+                    if 'textRun' in para_element:
+                        content.append(para_element['textRun']['content'])
+        
+        return ''.join(content)
+    
+    def fetch_google_docs_batch(self, file_ids):
+        """Получение нескольких Google Docs одним HTTP batch-запросом.
+        
+        Возвращает кортеж (содержимое по id, ошибки по id) — сбой одного
+        документа не влияет на остальные.
+        """
+        docs_service = self._client('docs', 'v1')
+        documents = self._client('docs', 'v1', 'documents')
+        contents, errors = {}, {}
+        
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = str(exception)
+            else:
+                contents[request_id] = self._parse_google_doc(response)
+        
+        for start in range(0, len(file_ids), DOCS_BATCH_SIZE):
+            batch = docs_service.new_batch_http_request(callback=callback)
+            for file_id in file_ids[start:start + DOCS_BATCH_SIZE]:
+                batch.add(documents.get(documentId=file_id), request_id=file_id)
+            batch.execute()
+        
+        return contents, errors
     
     def _get_google_sheet_content(self, file_id):
-        """Получение содержимого Google Sheet"""
-        try:
-            sheets_service = build('sheets', 'v4', credentials=self.creds)
-            sheet = sheets_service.spreadsheets().get(spreadsheetId=file_id).execute()
-            
-            content = []
-            for worksheet in sheet.get('sheets', []):
-                title = worksheet['properties']['title']
-                content.append(f"Лист: {title}")
-                
-                range_name = f"{title}!A1:Z1000"
-                result = sheets_service.spreadsheets().values().get(
-                    spreadsheetId=file_id, range=range_name).execute()
-                
-                values = result.get('values', [])
-                for row in values:
-                    content.append(' | '.join(str(cell) for cell in row))
-                content.append('\n')
-            
-            return '\n'.join(content)
-        except Exception as e:
-            return f"Ошибка при чтении Google Sheet: {str(e)}"
+        """Получение содержимого Google Sheet: строка листа — строка текста с названиями столбцов.
+        
+        Колоночные таблицы живут только во время чтения: DriveSync хранит документ одним
+        текстом в documents.content, и индексация режет на фрагменты уже его.
+        """
+        return '\n'.join(line for table in self.fetch_sheet_tables(file_id) for line in table.render())
     
-    def _get_pdf_content(self, file_id):
-        """Получение содержимого PDF (базовая реализация)"""
-        try:
-            request = self.service.files().get_media(fileId=file_id)
-            file = io.BytesIO()
-            downloader = MediaIoBaseDownload(file, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            
-            # Простое извлечение текста (в реальном проекте нужен pdfplumber или pytesseract)
-            return f"PDF файл загружен (размер: {len(file.getvalue())} байт). Для полного извлечения текста нужны дополнительные библиотеки."
-        except Exception as e:
-            return f"Ошибка при чтении PDF: {str(e)}" 
\ No newline at end of file
+    def _spreadsheets(self):
+        return self._client('sheets', 'v4', 'spreadsheets')
+    
+    def fetch_sheet_tables(self, file_id):
+        """Все листы таблицы в колоночном виде (буфер чтения до сборки текста).
+        
+        Размеры листов берутся из gridProperties, поэтому диапазоны точные и ничего
+        не обрезается; обычно это один values.batchGet, очень большие листы
+        читаются страницами в нескольких запросах.
+        """
+        spreadsheets = self._spreadsheets()
+        spreadsheet = spreadsheets.get(
+            spreadsheetId=file_id,
+            fields='sheets.properties(title,sheetType,gridProperties(rowCount,columnCount))').execute()
+        
+        grids = []
+        for worksheet in spreadsheet.get('sheets', []):
+            properties = worksheet['properties']
+            grid = properties.get('gridProperties', {})
+            # Листы-диаграммы ячеек не содержат
+            if properties.get('sheetType', 'GRID') == 'GRID' and grid.get('rowCount') and grid.get('columnCount'):
+                grids.append((properties['title'], grid['rowCount'], grid['columnCount']))
+        tables = [SheetTable(title, column_count) for title, _, column_count in grids]
+        
+        for batch in plan_requests(grids):
+            result = spreadsheets.values().batchGet(
+                spreadsheetId=file_id, ranges=[sheet_range for _, _, sheet_range in batch],
+                majorDimension='ROWS').execute()
+            for (sheet_index, first_row, _), value_range in zip(batch, result.get('valueRanges', [])):
+                tables[sheet_index].add_rows(value_range.get('values', []), first_row)
+        
+        return tables
+    
+    def download_file(self, file_id, destination):
+        """Потоковое скачивание файла в открытый бинарный файл частями по PDF_DOWNLOAD_CHUNK"""
+        request = self._client('drive', 'v3', 'files').get_media(fileId=file_id)
+        downloader = MediaIoBaseDownload(destination, request, chunksize=PDF_DOWNLOAD_CHUNK)
+        done = False
+        while done is False:
+            status, done = downloader.next_chunk()
+        destination.flush()
+    
+    def _get_office_content(self, file_id):
+        """Текст файла Word, Excel или OpenDocument: скачивается во временный файл"""
+        with tempfile.NamedTemporaryFile() as file:
+            self.download_file(file_id, file)
+            return extract_office_text(file.name)
+    
+    def _get_pdf_content(self, file_id, checksum=None):
+        """Текст PDF: файл скачивается во временный файл, а не в память,
+        и разбирается постранично в пуле процессов"""
+        cached = read_cached_text(checksum)
+        if cached is not None:
+            return cached
+        
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as file:
+            self.download_file(file_id, file)
+            return extract_pdf_text(file.name, checksum)
@@ -0,0 +1,82 @@
+import threading
+from typing import Callable, Dict, List, Optional
+
+from chunking import chunk_text
+
+REPAIR_BATCH_SIZE = 1000  # фрагментов за один вызов index.add при дозаполнении индекса
+
+
+class DocumentIndexer:
+    """Разбиение документов на фрагменты и обновление поисковых индексов.
+
+    В боте документы индексирует планировщик (scheduler.py) через index_document
+    в отдельном потоке, чтобы расчет эмбеддингов не блокировал event loop.
+    Для разовой загрузки (бенчмарки) изменения можно копить через
+    on_document_changed и обработать одним process_pending.
+    """
+
+    def __init__(self, store, indexes: List, chunker=None):
+        self.store = store
+        self.indexes = indexes
+        self.chunker = chunker or chunk_text
+        self._pending: Dict[str, Optional[Dict]] = {}
+        self._listeners: List[Callable[[str, Optional[Dict]], None]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback: Callable[[str, Optional[Dict]], None]):
+        """Подписка на документы, чьи фрагменты уже обновлены в индексах"""
+        self._listeners.append(callback)
+
+    def on_document_changed(self, file_id: str, document: Optional[Dict]):
+        """Обработчик DriveSync: document is None означает удаление"""
+        with self._lock:
+            self._pending[file_id] = document
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def index_document(self, file_id: str, document: Optional[Dict]):
+        texts = self.chunker(document['content']) if document else []
+        old_ids, new_chunks = self.store.replace_chunks(file_id, texts)
+        for index in self.indexes:
+            index.remove(old_ids)
+            index.add(new_chunks)
+        for callback in self._listeners:
+            callback(file_id, document)
+
+    def process_pending(self) -> int:
+        """Индексация накопленных изменений. Возвращает число обработанных документов."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for file_id, document in pending.items():
+            self.index_document(file_id, document)
+        for index in self.indexes:
+            index.save()
+        return len(pending)
+
+    def ensure_consistent(self) -> List[str]:
+        """Проверка после запуска: привести индексы к фрагментам хранилища.
+
+        replace_chunks фиксирует новые id сразу, а индексы сохраняются в конце пачки:
+        после сбоя между ними в файле индекса остаются id удаленных фрагментов, а новых нет.
+        Сравниваются множества id (число фрагментов при правке документа часто не меняется);
+        лишние удаляются, недостающие добавляются; потерянный индекс строится заново.
+
+        Возвращает id документов, которые еще не разбиты на фрагменты, — их нужно проиндексировать.
+        """
+        chunk_ids = self.store.chunk_ids()
+        for index in self.indexes:
+            indexed = index.ids()
+            orphans, missing = indexed - chunk_ids, sorted(chunk_ids - indexed)
+            if not orphans and not missing:
+                continue
+            if not indexed:
+                index.rebuild(self.store)
+            else:
+                index.remove(sorted(orphans))
+                for start in range(0, len(missing), REPAIR_BATCH_SIZE):
+                    index.add(self.store.chunks_by_id(missing[start:start + REPAIR_BATCH_SIZE]))
+            index.save()
+        return self.store.unchunked_document_ids()
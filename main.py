@@ -1,61 +1,209 @@
 import os
 import asyncio
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import Message
+import time
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from dotenv import load_dotenv
-import aiosqlite
-from gdrive_service import GoogleDriveService
+from async_gdrive import AsyncDriveService
+from credentials import default_credentials
 from ai_service import AIService
+from answer_cache import AnswerCache, normalize_query
+from doc_store import DocumentStore, DriveSync
+import pdf_extract
+from bm25_index import BM25Index
+from indexer import DocumentIndexer
+from metrics import METRICS_PORT, CallbackMetric, Counter, stage, start_metrics_server, trace
+from retrieval import HybridRetriever
+from scheduler import JOB_INDEX, JOB_SYNC, PRIORITY_SYNC, SCHEDULER_BATCH_SIZE, JobScheduler
+from streaming import MessageStreamer
+from rate_limit import RateLimitMiddleware
+from user_store import AuthMiddleware, UserStore
+from work_queue import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, WorkQueue
+from vector_index import VectorIndex
 
 load_dotenv("config.env")
 TOKEN = os.getenv("TELEGRAM_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # свой Bot API сервер вместо api.telegram.org
 
-ALLOWED_USERS = set()  # Будет наполняться из БД
-DB_PATH = "users.db"
+SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL", "60"))  # секунды между синхронизациями с Drive (0 — не синхронизировать)
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "10"))  # проверка индексов от другого процесса, сек
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "8"))  # фрагментов документов в контексте LLM
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"  # показывать ответ по мере генерации
+DOCS_PAGE_SIZE = int(os.getenv("DOCS_PAGE_SIZE", "10"))  # документов на странице /docs
+MIME_LABELS = {'document': 'Документ', 'spreadsheet': 'Таблица', 'pdf': 'PDF'}
 
 # Инициализация сервисов
-gdrive_service = GoogleDriveService()
+drive = AsyncDriveService()  # вызовы Google Drive выполняются вне event loop
 ai_service = AIService()
+doc_store = DocumentStore()
+scheduler = JobScheduler()  # синхронизация и индексация в фоне, очередь заданий в SQLite
+user_store = UserStore()  # пользователи и роли кэшируются в памяти
+work_queue = WorkQueue()  # запросы к LLM и Drive с приоритетами и ограничением параллельности
+rate_limiter = RateLimitMiddleware()
+drive_sync = DriveSync(drive, doc_store)
+bm25_index = BM25Index()
+vector_index = VectorIndex()
+indexer = DocumentIndexer(doc_store, [bm25_index, vector_index] if vector_index.available else [bm25_index])
+retriever = HybridRetriever(doc_store, bm25_index, vector_index)
+answer_cache = AnswerCache(doc_store, vector_index.embedder if vector_index.available else None)
+drive_sync.add_listener(scheduler.on_document_changed)
+# Ответы сбрасываются, когда фрагменты документа уже переиндексированы
+indexer.add_listener(answer_cache.invalidate_document)
+
+# Метрики для /metrics: счетчики запросов и состояние кэша, очереди и индекса на момент выгрузки
+REQUESTS = Counter('bot_requests_total', 'Запросы пользователей', ['handler', 'outcome'])
+CallbackMetric('bot_answer_cache_lookups_total', 'Обращения к кэшу ответов',
+               lambda: {(kind,): answer_cache.report()[key] for kind, key in
+                        (('exact', 'hits_exact'), ('semantic', 'hits_semantic'), ('miss', 'misses'))},
+               kind='counter', labelnames=['result'])
+CallbackMetric('bot_answer_cache_entries', 'Ответов в кэше', lambda: answer_cache.report()['size'])
+CallbackMetric('bot_work_queue_depth', 'Задач в очереди LLM/Drive', lambda: work_queue.report()['depth'])
+CallbackMetric('bot_work_queue_running', 'Выполняемых задач LLM/Drive', lambda: work_queue.running)
+CallbackMetric('bot_work_queue_coalesced_total', 'Запросов, объединенных с уже выполняемыми',
+               lambda: work_queue.stats['coalesced'], kind='counter')
+CallbackMetric('bot_rate_limited_total', 'Запросов, отклоненных ограничением частоты',
+               lambda: {('user',): rate_limiter.stats['rejected_user'],
+                        ('global',): rate_limiter.stats['rejected_global']},
+               kind='counter', labelnames=['scope'])
+CallbackMetric('bot_index_pending_documents', 'Документов в очереди на индексацию', lambda: scheduler.pending(JOB_INDEX))
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                tg_id INTEGER UNIQUE,
-                name TEXT,
-                department TEXT,
-                role TEXT
-            )
-        """)
-        await db.commit()
-        # Пример: добавим админа (замени на свой Telegram ID)
-        await db.execute("INSERT OR IGNORE INTO users (tg_id, name, department, role) VALUES (?, ?, ?, ?)",
-                         (123456789, "Admin", "IT", "admin"))
-        await db.commit()
-        async with db.execute("SELECT tg_id FROM users") as cursor:
-            async for row in cursor:
-                ALLOWED_USERS.add(row[0])
-
-async def is_authorized(user_id: int) -> bool:
-    return user_id in ALLOWED_USERS
-
-async def get_user_department(user_id: int) -> str | None:
-    """Получить отдел пользователя"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT department FROM users WHERE tg_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else None
-
-bot = Bot(token=TOKEN)
+    await user_store.open()
+    # Пример: добавим админа (замени на свой Telegram ID)
+    await user_store.add_user(123456789, "Admin", "IT", "admin", replace=False)
+
+def is_admin(user: dict) -> bool:
+    return user['role'] == "admin"
+
+async def sync_documents() -> dict:
+    """Проход синхронизации и очистка кэша текста PDF от обновленных и удаленных версий"""
+    stats = await drive_sync.sync()
+    if stats['updated'] or stats['deleted']:
+        # Внутри той же задачи очереди: параллельно с очисткой PDF не разбираются
+        await asyncio.to_thread(lambda: pdf_extract.prune_cache(doc_store.checksums()))
+    return stats
+
+async def run_sync(keys: list[str]) -> dict:
+    """Задание планировщика: проход синхронизации хранилища документов с Google Drive.
+    
+    Незагруженные файлы — ошибка задания: она видна в /index, повтор идет с паузой планировщика.
+    """
+    # Пользовательские запросы в очереди идут раньше синхронизации
+    # Ключи очереди с пространством имен: вопрос «sync» не должен получить статистику синхронизации
+    stats = await work_queue.submit(sync_documents, priority=PRIORITY_BACKGROUND, key=('sync',))
+    if stats['updated'] or stats['deleted'] or stats['errors']:
+        print(f"📥 Синхронизация документов: обновлено {stats['updated']}, "
+              f"удалено {stats['deleted']}, ошибок {stats['errors']}")
+    if stats['errors']:
+        return {key: f"Не удалось загрузить файлов: {stats['errors']}" for key in keys}
+    return {}
+
+def restore_indexes():
+    """Сверка индексов с хранилищем при запуске; неразбитые документы — в очередь индексации"""
+    for file_id in indexer.ensure_consistent():
+        scheduler.on_document_changed(file_id)
+
+def index_documents(file_ids: list[str]) -> dict:
+    """Переиндексация документов по текущему содержимому хранилища; {id: ошибка} для неудавшихся"""
+    failures = {}
+    for file_id in file_ids:
+        try:
+            indexer.index_document(file_id, doc_store.get_document(file_id))
+        except Exception as e:
+            failures[file_id] = repr(e)
+    for index in indexer.indexes:
+        index.save()
+    return failures
+
+async def run_index(keys: list[str]) -> dict:
+    """Задание планировщика: эмбеддинги считаются в отдельном потоке, только для изменившихся документов"""
+    return await asyncio.to_thread(index_documents, keys)
+
+def reload_indexes():
+    """Перечитать индексы, записанные процессом, который ведет синхронизацию"""
+    for index in indexer.indexes:
+        if index.reload_if_changed():
+            print(f"🔄 Индекс {index.path} перечитан")
+
+async def index_reload_loop(interval: float = INDEX_RELOAD_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(reload_indexes)
+        except Exception as e:
+            print(f"❌ Ошибка чтения индексов: {e}")
+
+def search_passages(query: str) -> tuple[list[dict], dict]:
+    """Фрагменты и версии их документов на момент поиска"""
+    passages = retriever.search(query, SEARCH_TOP_K)
+    return passages, doc_store.get_versions({passage['id'] for passage in passages})
+
+async def retrieve_passages(query: str) -> tuple[list[dict], dict]:
+    """Поиск фрагментов документов, релевантных вопросу, и версий этих документов.
+    
+    Версии снимаются до вызова LLM: ответ, собранный из документа, который
+    обновился во время генерации, не попадет в кэш как актуальный.
+    """
+    # Эмбеддинг вопроса считается на CPU, поэтому поиск выполняется вне event loop
+    with stage('retrieval'):
+        return await asyncio.to_thread(search_passages, query)
+
+async def answer_query(query: str, on_progress=None) -> dict | None:
+    """Поиск фрагментов и ответ LLM; None — подходящих фрагментов нет.
+    
+    on_progress(text) получает накопленный текст ответа по мере генерации.
+    """
+    # Фрагменты ищем в локальном индексе, его наполняет фоновая синхронизация
+    passages, versions = await retrieve_passages(query)
+    if not passages:
+        return None
+    
+    # Ищем ответ с помощью AI
+    if on_progress:
+        # Заглушка обновляется по мере генерации — пользователь видит первые слова сразу
+        stream = ai_service.stream_answer(query, passages)
+        async for _ in stream:
+            await on_progress(stream.answer)
+        result = {'answer': stream.answer, 'sources': stream.sources, 'usage': stream.usage}
+    else:
+        result = await ai_service.search_documents(query, passages)
+    
+    usage = result['usage']
+    if usage:
+        print(f"🧮 Токены: контекст {usage.get('context_tokens')} из {usage.get('budget')}, "
+              f"промпт {usage.get('prompt_tokens')}, ответ {usage.get('completion_tokens')}")
+    if not result.get('error'):
+        await asyncio.to_thread(answer_cache.put, query, result, versions)
+        # Часто цитируемые документы планировщик переиндексирует первыми
+        await asyncio.to_thread(scheduler.record_citations, {source['id'] for source in result['sources'] if source.get('id')})
+    return result
+
+def format_answer(result: dict) -> str:
+    """Текст ответа с источниками: только фрагменты, вошедшие в контекст,
+    несколько фрагментов одного документа — один источник"""
+    sources = {doc['link']: doc['name'] for doc in result['sources']}
+    answer = f"🤖 Ответ на ваш вопрос:\n\n{result['answer']}\n\n"
+    answer += "📄 Источники:\n"
+    for link, name in sources.items():
+        answer += f"• {name}: {link}\n"
+    return answer
+
+bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+          if TELEGRAM_API_URL else None)
 dp = Dispatcher()
+# Доступ проверяется до обработчиков по кэшу пользователей, без запросов к БД
+auth = AuthMiddleware(user_store)
+dp.message.outer_middleware(auth)
+dp.callback_query.outer_middleware(auth)
+# Частота дорогих запросов (флаг expensive) — после фильтров, когда известен обработчик
+dp.message.middleware(rate_limiter)
 
 @dp.message(Command("start"))
-async def cmd_start(message: Message):
-    if not await is_authorized(message.from_user.id):
-        await message.answer("⛔️ Нет доступа. Обратитесь к администратору.")
-        return
+async def cmd_start(message: Message, user: dict):
     await message.answer("✅ Привет! Я бот для работы с корпоративными документами.\n\n"
                         "📋 Доступные команды:\n"
                         "/help — список команд\n"
@@ -64,9 +212,7 @@ async def cmd_start(message: Message):
                         "/myid — узнать свой Telegram ID")
 
 @dp.message(Command("help"))
-async def cmd_help(message: Message):
-    if not await is_authorized(message.from_user.id):
-        return
+async def cmd_help(message: Message, user: dict):
     await message.answer("📋 Команды бота:\n\n"
                         "/start — начать работу\n"
                         "/help — эта справка\n"
@@ -81,150 +227,341 @@ async def cmd_myid(message: Message):
     await message.answer(f"Твой Telegram ID: {message.from_user.id}")
 
 @dp.message(Command("admin"))
-async def cmd_admin(message: Message):
+async def cmd_admin(message: Message, user: dict):
     """Админ-панель"""
-    if not await is_authorized(message.from_user.id):
-        return
-    
-    user_department = await get_user_department(message.from_user.id)
-    if user_department != "admin":
+    if not is_admin(user):
         await message.answer("⛔️ Доступ только для администраторов.")
         return
     
     await message.answer("🔧 Админ-панель\n\n"
                         "Доступные команды:\n"
                         "/users - список пользователей\n"
+                        "/stats - статистика кэша, очереди и лимитов\n"
+                        "/index - свежесть индекса и очередь индексации\n"
                         "/adduser - добавить пользователя\n"
                         "/deluser - удалить пользователя")
 
 @dp.message(Command("users"))
-async def cmd_users(message: Message):
+async def cmd_users(message: Message, user: dict):
     """Список пользователей"""
-    if not await is_authorized(message.from_user.id):
+    if not is_admin(user):
+        await message.answer("⛔️ Доступ только для администраторов.")
         return
     
-    user_department = await get_user_department(message.from_user.id)
-    if user_department != "admin":
+    users = user_store.list_users()
+    if not users:
+        await message.answer("📭 Пользователи не найдены.")
+        return
+    
+    users_list = "👥 Список пользователей:\n\n"
+    for profile in users:
+        users_list += f"ID: {profile['tg_id']}\n"
+        users_list += f"Имя: {profile['name']}\n"
+        users_list += f"Отдел: {profile['department']}\n"
+        users_list += f"Роль: {profile['role']}\n\n"
+    
+    await message.answer(users_list)
+
+@dp.message(Command("adduser"))
+async def cmd_adduser(message: Message, user: dict, command: CommandObject):
+    """Добавление пользователя: /adduser <tg_id> <имя> <отдел> [роль]"""
+    if not is_admin(user):
         await message.answer("⛔️ Доступ только для администраторов.")
         return
     
+    args = (command.args or "").split()
+    if len(args) < 3 or not args[0].isdigit():
+        await message.answer("Использование: /adduser <tg_id> <имя> <отдел> [роль]\n"
+                             "Например: /adduser 123456789 Иван HR user")
+        return
+    
+    tg_id, name, department = int(args[0]), args[1], args[2]
+    role = args[3] if len(args) > 3 else "user"
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute("SELECT tg_id, name, department, role FROM users") as cursor:
-                users = await cursor.fetchall()
-        
-        if not users:
-            await message.answer("📭 Пользователи не найдены.")
-            return
-        
-        users_list = "👥 Список пользователей:\n\n"
-        for user in users:
-            users_list += f"ID: {user[0]}\n"
-            users_list += f"Имя: {user[1]}\n"
-            users_list += f"Отдел: {user[2]}\n"
-            users_list += f"Роль: {user[3]}\n\n"
-        
-        await message.answer(users_list)
-        
+        await user_store.add_user(tg_id, name, department, role)
+        await message.answer(f"✅ Пользователь {name} ({tg_id}) добавлен: отдел {department}, роль {role}")
     except Exception as e:
-        await message.answer(f"❌ Ошибка при получении списка пользователей: {str(e)}")
+        await message.answer(f"❌ Ошибка при добавлении пользователя: {str(e)}")
 
-@dp.message(Command("docs"))
-async def cmd_docs(message: Message):
-    if not await is_authorized(message.from_user.id):
+@dp.message(Command("deluser"))
+async def cmd_deluser(message: Message, user: dict, command: CommandObject):
+    """Удаление пользователя: /deluser <tg_id>"""
+    if not is_admin(user):
+        await message.answer("⛔️ Доступ только для администраторов.")
+        return
+    
+    tg_id = (command.args or "").strip()
+    if not tg_id.isdigit():
+        await message.answer("Использование: /deluser <tg_id>")
+        return
+    if int(tg_id) == message.from_user.id:
+        await message.answer("⛔️ Нельзя удалить самого себя.")
         return
     
     try:
-        await message.answer("📚 Загружаю список документов...")
-        
-        documents = gdrive_service.get_documents()
-        
-        if not documents:
-            await message.answer("📭 Документы не найдены. Проверьте настройки Google Drive.")
-            return
-        
-        docs_list = "📚 Доступные документы:\n\n"
-        for i, doc in enumerate(documents[:10], 1):  # Показываем первые 10
-            docs_list += f"{i}. {doc['name']}\n"
-            docs_list += f"   Тип: {doc['mimeType']}\n"
-            docs_list += f"   Ссылка: {doc['webViewLink']}\n\n"
-        
-        if len(documents) > 10:
-            docs_list += f"... и еще {len(documents) - 10} документов"
-        
-        await message.answer(docs_list)
-        
+        if await user_store.delete_user(int(tg_id)):
+            await message.answer(f"🗑 Пользователь {tg_id} удален.")
+        else:
+            await message.answer(f"📭 Пользователь {tg_id} не найден.")
     except Exception as e:
-        await message.answer(f"❌ Ошибка при загрузке документов: {str(e)}")
+        await message.answer(f"❌ Ошибка при удалении пользователя: {str(e)}")
 
-@dp.message(Command("search"))
-async def cmd_search(message: Message):
-    if not await is_authorized(message.from_user.id):
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message, user: dict):
+    """Статистика кэша ответов, очереди и ограничения частоты"""
+    if not is_admin(user):
+        await message.answer("⛔️ Доступ только для администраторов.")
         return
     
+    stats = answer_cache.report()
+    await message.answer("📊 Кэш ответов:\n\n"
+                         f"Записей: {stats['size']}\n"
+                         f"Попаданий: {stats['hits_exact']} точных, {stats['hits_semantic']} похожих\n"
+                         f"Промахов: {stats['misses']}\n"
+                         f"Доля попаданий: {stats['hit_rate']:.0%}\n"
+                         f"Вытеснено: {stats['evictions']}, сброшено: {stats['invalidations']}")
+    
+    queue = work_queue.report()
+    limits = rate_limiter.report()
+    await message.answer("📊 Очередь LLM/Drive:\n\n"
+                         f"В очереди: {queue['depth']}, выполняется: {queue['running']} из {queue['workers']}\n"
+                         f"Задач: {queue['submitted']}, объединено одинаковых: {queue['coalesced']}, "
+                         f"ошибок: {queue['failed']}\n"
+                         f"Ожидание: среднее {queue['wait_avg']:.2f} с, p95 {queue['wait_p95']:.2f} с, "
+                         f"макс {queue['wait_max']:.2f} с\n\n"
+                         f"Ограничение частоты: пропущено {limits['allowed']}, "
+                         f"отклонено {limits['rejected_user']} (пользователь) / {limits['rejected_global']} (общий лимит)")
+
+def format_age(timestamp: float | None) -> str:
+    if not timestamp:
+        return "никогда"
+    seconds = time.time() - timestamp
+    if seconds < 0:
+        return f"через {-seconds:.0f} с"
+    if seconds < 120:
+        return f"{seconds:.0f} с назад"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f} мин назад"
+    return f"{seconds / 3600:.1f} ч назад"
+
+@dp.message(Command("index"))
+async def cmd_index(message: Message, user: dict):
+    """Свежесть индекса и очередь фоновых заданий"""
+    if not is_admin(user):
+        await message.answer("⛔️ Доступ только для администраторов.")
+        return
+    
+    report = await asyncio.to_thread(scheduler.report)
+    sync = report.get(JOB_SYNC, {})
+    index = report.get(JOB_INDEX, {})
+    text = ("📇 Индекс документов:\n\n"
+            f"Документов: {await asyncio.to_thread(doc_store.document_count)}, "
+            f"фрагментов: {await asyncio.to_thread(doc_store.chunk_count)}\n\n"
+            f"Синхронизация с Drive: успешная {format_age(sync.get('last_success'))}"
+            f"{', выполняется' if sync.get('running') else ''}\n")
+    if sync.get('next_run'):
+        text += f"Следующая: {format_age(sync['next_run'])}\n"
+    if sync.get('last_error'):
+        text += f"Последняя ошибка: {sync['last_error'][:200]}\n"
+    failed = len(await asyncio.to_thread(doc_store.failed_ids))
+    if failed:
+        text += f"Файлов, которые не удается загрузить: {failed}\n"
+    text += (f"\nОчередь индексации: {index.get('pending', 0)} док."
+             f"{', выполняется' if index.get('running') else ''}\n")
+    if index.get('pending'):
+        text += (f"Самый давний поставлен {format_age(index['oldest'])}, "
+                 f"повторяются после ошибок: {index.get('retrying') or 0}\n")
+    text += f"Последняя индексация: {format_age(index.get('last_success'))}\n"
+    if index.get('last_error'):
+        text += f"Последняя ошибка: {index['last_error'][:200]}\n"
+    await message.answer(text)
+
+def docs_page(page: int) -> tuple[str, InlineKeyboardMarkup | None, int]:
+    """Страница списка документов из локального хранилища: (текст, кнопки, всего документов)"""
+    total = doc_store.document_count()
+    if not total:
+        return ("📭 Документы не найдены. Если бот только запущен, синхронизация с Google Drive "
+                "еще идет — попробуйте через минуту."), None, 0
+    pages = (total + DOCS_PAGE_SIZE - 1) // DOCS_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    documents = doc_store.list_documents(page * DOCS_PAGE_SIZE, DOCS_PAGE_SIZE)
+    
+    text = f"📚 Доступные документы ({total}):\n\n"
+    for number, doc in enumerate(documents, page * DOCS_PAGE_SIZE + 1):
+        label = next((label for kind, label in MIME_LABELS.items() if kind in (doc['mime_type'] or '')), 'Файл')
+        text += f"{number}. {doc['name']} ({label})\n   {doc['link']}\n\n"
+    if pages == 1:
+        return text, None, total
+    
+    # Номер страницы в callback_data: листание читает только локальное хранилище
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"docs:{page - 1}"))
+    buttons.append(InlineKeyboardButton(text=f"{page + 1} / {pages}", callback_data=f"docs:{page}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"docs:{page + 1}"))
+    return text, InlineKeyboardMarkup(inline_keyboard=[buttons]), total
+
+@dp.message(Command("docs"))
+async def cmd_docs(message: Message, user: dict):
+    """Список документов — из локальной копии, без запросов к Google Drive"""
+    outcome = 'answered'
+    try:
+        text, keyboard, total = await asyncio.to_thread(docs_page, 0)
+        if not total:
+            outcome = 'not_found'
+        await message.answer(text, reply_markup=keyboard, disable_web_page_preview=True)
+    except Exception as e:
+        outcome = 'error'
+        print(f"❌ Ошибка при загрузке документов: {e!r}")
+        await message.answer(f"❌ Ошибка при загрузке документов: {str(e)}")
+    finally:
+        REQUESTS.inc('docs', outcome)
+
+@dp.callback_query(F.data.startswith("docs:"))
+async def docs_page_callback(callback: CallbackQuery, user: dict):
+    """Листание /docs: сообщение со списком заменяется нужной страницей"""
+    outcome = 'answered'
+    try:
+        if not isinstance(callback.message, Message):
+            # Сообщение слишком старое, Telegram его уже не отдает
+            outcome = 'not_found'
+            await callback.answer("Список устарел, отправьте /docs ещё раз", show_alert=True)
+            return
+        text, keyboard, _ = await asyncio.to_thread(docs_page, int(callback.data.split(":", 1)[1]))
+        try:
+            await callback.message.edit_text(text, reply_markup=keyboard, disable_web_page_preview=True)
+        except TelegramBadRequest as e:
+            # Нажата кнопка текущей страницы
+            if 'message is not modified' not in str(e):
+                raise
+        await callback.answer()
+    except Exception as e:
+        outcome = 'error'
+        print(f"❌ Ошибка при листании документов: {e!r}")
+        await callback.answer("❌ Не удалось показать страницу", show_alert=True)
+    finally:
+        REQUESTS.inc('docs_page', outcome)
+
+@dp.message(Command("search"))
+async def cmd_search(message: Message, user: dict):
     await message.answer("🔍 Напиши свой вопрос, и я найду ответ в документах!\n\n"
                         "Примеры вопросов:\n"
                         "• Как подать заявку на отпуск?\n"
                         "• Какие документы нужны для оформления?\n"
                         "• Где найти шаблон отчета?")
 
-@dp.message()
-async def handle_search_query(message: Message):
+@dp.message(flags={"expensive": True})
+async def handle_search_query(message: Message, user: dict):
     """Обработка поисковых запросов"""
-    if not await is_authorized(message.from_user.id):
-        return
-    
     # Игнорируем команды
     if message.text.startswith('/'):
         return
     
-    try:
-        await message.answer("🔍 Ищу ответ в документах...")
+    with trace('search', user_id=message.from_user.id) as current:
+        outcome = 'answered'
+        try:
+            placeholder = await message.answer("🔍 Ищу ответ в документах...")
+            streamer = MessageStreamer(placeholder)
         
-        # Получаем документы
-        documents = gdrive_service.get_documents()
+            # Повторный или почти такой же вопрос по неизменившимся документам — без LLM
+            with stage('answer_cache'):
+                cached = await asyncio.to_thread(answer_cache.lookup, message.text)
+            if cached:
+                outcome = 'cached'
+                result, hit = cached
+                print(f"💾 Ответ из кэша ({'точное' if hit == 'exact' else 'похожее'} совпадение)")
+                await streamer.finish(format_answer(result))
+                return
         
-        if not documents:
-            await message.answer("📭 Документы не найдены.")
-            return
+            # Отдел пользователя — из профиля, который подставил AuthMiddleware
+            user_department = user['department']
         
-        # Получаем отдел пользователя
-        user_department = await get_user_department(message.from_user.id)
-        
-        # Загружаем содержимое документов
-        docs_with_content = []
-        for doc in documents[:5]:  # Ограничиваем количество для производительности
             # Фильтрация по отделам (если настроена)
-            if user_department and user_department != "admin":
+            if user_department and not is_admin(user):
                 # В реальном проекте здесь была бы проверка по метаданным документа
                 # Пока пропускаем все документы
                 pass
-            
-            content = gdrive_service.get_document_content(doc['id'], doc['mimeType'])
-            docs_with_content.append({
-                'name': doc['name'],
-                'content': content,
-                'link': doc['webViewLink']
-            })
         
-        # Ищем ответ с помощью AI
-        response = ai_service.search_documents(message.text, docs_with_content)
+            # Одинаковые вопросы, заданные одновременно, считаются один раз:
+            # остальные ждут результат первого, не занимая место в очереди
+            async def progress(text: str):
+                await streamer.update(f"🤖 Ответ на ваш вопрос:\n\n{text}")
         
-        # Формируем ответ
-        answer = f"🤖 Ответ на ваш вопрос:\n\n{response}\n\n"
-        answer += "📄 Источники:\n"
-        for doc in docs_with_content:
-            answer += f"• {doc['name']}: {doc['link']}\n"
+            result = await work_queue.submit(lambda: answer_query(message.text, progress if STREAM_ANSWERS else None),
+                                             priority=PRIORITY_INTERACTIVE, key=('search', normalize_query(message.text)))
         
-        await message.answer(answer)
+            if result is None:
+                outcome = 'not_found'
+                await streamer.finish("📭 Документы не найдены.")
+                return
         
-    except Exception as e:
-        await message.answer(f"❌ Ошибка при поиске: {str(e)}")
+            await streamer.finish(format_answer(result))
+        
+        except Exception as e:
+            outcome = 'error'
+            # Этап сбоя виден в bot_stage_errors_total и в трассировке запроса
+            print(f"❌ Ошибка при поиске: {e!r}")
+            if current:
+                current.attributes['error'] = repr(e)
+            await message.answer(f"❌ Ошибка при поиске: {str(e)}")
+        finally:
+            REQUESTS.inc('search', outcome)
 
-async def main():
+_background_tasks: list[asyncio.Task] = []
+_metrics_runner = None
+
+async def startup(leader: bool = True, metrics_port: int = METRICS_PORT):
+    """Запуск сервисов процесса.
+    
+    leader — процесс синхронизирует документы и пишет индексы. Остальные процессы
+    (рабочие процессы webhook.py) индексы только читают и перечитывают после обновления.
+    """
+    global _metrics_runner
+    if leader:
+        # Процессы разбора PDF запускаются до появления рабочих потоков
+        pdf_extract.start_pool()
     await init_db()
+    if leader:
+        scheduler.register(JOB_INDEX, run_index, batch_size=SCHEDULER_BATCH_SIZE)
+        if SYNC_INTERVAL:
+            scheduler.register(JOB_SYNC, run_sync, priority=PRIORITY_SYNC, interval=SYNC_INTERVAL)
+        await asyncio.to_thread(restore_indexes)
+    else:
+        await asyncio.to_thread(reload_indexes)
+    work_queue.start()
+    _metrics_runner = await start_metrics_server(port=metrics_port)
+    _background_tasks.append(asyncio.create_task(user_store.refresh_loop()))
+    _background_tasks.append(asyncio.create_task(default_credentials().refresh_loop()))
+    if leader:
+        _background_tasks.append(asyncio.create_task(scheduler.run()))
+    else:
+        _background_tasks.append(asyncio.create_task(index_reload_loop()))
+
+async def shutdown():
+    global _metrics_runner
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await work_queue.stop()
+    drive.close()
+    pdf_extract.shutdown_pool()
+    await ai_service.close()
+    await user_store.close()
+    scheduler.close()
+    await bot.session.close()
+    if _metrics_runner:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+
+async def main():
+    await startup()
     print("🤖 Бот запущен!")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,252 @@
+import bisect
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # 0 — не поднимать /metrics
+TRACE_REQUESTS = os.getenv('TRACE_REQUESTS', '0') == '1'  # JSON-трассировка запросов в лог
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List['Metric'] = []
+_current_trace: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Метрика в формате Prometheus: значения по наборам меток.
+
+    Обновление — словарь и блокировка без I/O, поэтому годится для горячего пути.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, list] = {}  # [счетчики по корзинам..., сумма, количество]
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"'), cumulative)
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), state[-2]
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), state[-1]
+
+
+class CallbackMetric(Metric):
+    """Значение читается при выгрузке: глубина очереди, статистика кэша.
+
+    callback возвращает число или словарь {кортеж значений меток: число}.
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable, kind: str = 'gauge',
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    parts = []
+    for metric in list(_registry):
+        try:
+            parts.append(metric.render())
+        except Exception as e:
+            parts.append(f'# {metric.name}: {e}')
+    return '\n'.join(parts) + '\n'
+
+
+STAGE_SECONDS = Histogram('bot_stage_seconds', 'Время этапов обработки запроса', ['stage'])
+STAGE_ERRORS = Counter('bot_stage_errors_total', 'Ошибки на этапах обработки запроса', ['stage'])
+
+
+class Trace:
+    """Трассировка одного запроса: этапы с началом и длительностью"""
+
+    def __init__(self, name: str, attributes: Dict):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, started: float, duration: float, error: Optional[str]):
+        span = {'name': name, 'start_ms': round((started - self.started) * 1000, 2),
+                'duration_ms': round(duration * 1000, 2)}
+        if error:
+            span['error'] = error
+        with self._lock:
+            self.spans.append(span)
+
+    def to_json(self, error: Optional[str]) -> str:
+        record = {'trace': self.name, 'trace_id': self.trace_id,
+                  'duration_ms': round((time.perf_counter() - self.started) * 1000, 2),
+                  **self.attributes, 'spans': self.spans}
+        if error:
+            record['error'] = error
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Трассировка запроса: при TRACE_REQUESTS=1 этапы внутри попадают в лог одной JSON-строкой.
+
+    Контекст передается в asyncio.to_thread и задачи, созданные внутри.
+    """
+    if not TRACE_REQUESTS:
+        yield None
+        return
+    current = Trace(name, attributes)
+    token = _current_trace.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        print(current.to_json(error))
+
+
+@contextmanager
+def stage(name: str):
+    """Этап обработки: время в bot_stage_seconds и span текущей трассировки"""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        STAGE_ERRORS.inc(name)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, name)
+        current = _current_trace.get()
+        if current is not None:
+            current.add_span(name, started, duration, error)
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """HTTP-эндпоинт /metrics; возвращает AppRunner для остановки или None, если выключен"""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
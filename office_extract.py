@@ -0,0 +1,40 @@
+import re
+import zipfile
+from typing import List
+from xml.etree import ElementTree
+
+# Части архива Office Open XML (.docx, .pptx, .xlsx) и OpenDocument (.odt, .odp, .ods) с текстом
+TEXT_PARTS = [re.compile(pattern) for pattern in (
+    r'word/document\.xml', r'ppt/slides/slide\d+\.xml', r'xl/sharedStrings\.xml', r'content\.xml')]
+# Абзацы Word, PowerPoint и OpenDocument, строки общей таблицы строк Excel
+PARAGRAPH_TAGS = {'p', 'h', 'si'}
+
+
+def _natural_key(name: str) -> List:
+    # slide10.xml — после slide9.xml
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def extract_office_text(path: str) -> str:
+    """Текст файла Office или OpenDocument, скачанного с Drive (форматы не Google).
+
+    XML читается потоково, разобранные абзацы сразу освобождаются.
+    """
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ValueError("Файл не в формате Office Open XML или OpenDocument")
+    paragraphs = []
+    with archive:
+        names = sorted((name for name in archive.namelist() if any(p.fullmatch(name) for p in TEXT_PARTS)),
+                       key=_natural_key)
+        for name in names:
+            with archive.open(name) as part:
+                for _, element in ElementTree.iterparse(part):
+                    if element.tag.rsplit('}', 1)[-1] in PARAGRAPH_TAGS:
+                        text = ''.join(element.itertext()).strip()
+                        if text:
+                            paragraphs.append(text)
+                        # Вложенный абзац (надпись внутри абзаца Word) не попадет в текст внешнего дважды
+                        element.clear()
+    return '\n'.join(paragraphs)
@@ -0,0 +1,166 @@
+import mmap
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Collection, Iterator, Optional
+
+from pypdf import PdfReader
+
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', 'pdf_cache')  # извлеченный текст по md5 файла
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '2'))  # процессов для разбора PDF, 0 — в текущем потоке
+PDF_TIMEOUT = float(os.getenv('PDF_TIMEOUT', '300'))  # загрузка и разбор одного PDF, сек
+PDF_DOWNLOAD_CHUNK = 4 * 1024 * 1024  # байт за один запрос при скачивании
+PAGE_SEPARATOR = '\n\n'
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    """Текст PDF постранично; файл отображается в память, а не читается целиком"""
+    with open(path, 'rb') as file:
+        try:
+            source = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # пустой файл или ФС без mmap
+            source = file
+        try:
+            for page in PdfReader(source).pages:
+                yield page.extract_text() or ''
+        finally:
+            if source is not file:
+                source.close()
+
+
+def extract_to_file(pdf_path: str, text_path: str) -> int:
+    """Запись текста PDF в text_path по мере разбора страниц. Возвращает число страниц.
+
+    Выполняется в процессе пула; файл появляется атомарно, только целиком.
+    """
+    tmp_path = text_path + '.tmp'
+    pages = 0
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            for text in iter_pdf_pages(pdf_path):
+                if pages:
+                    out.write(PAGE_SEPARATOR)
+                out.write(text)
+                pages += 1
+        os.replace(tmp_path, text_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return pages
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if PDF_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """Сломанный пул (процесс упал — нехватка памяти, сбой в разборе) заменяется новым при следующем вызове"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def _extract_in_pool(pdf_path: str, text_path: str) -> int:
+    # Если пул сломался, вместе с виновником падают и соседние задачи — повторяем один раз в новом пуле
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            return pool.submit(extract_to_file, pdf_path, text_path).result()
+        except BrokenProcessPool:
+            _reset_pool(pool)
+            if attempt:
+                raise
+
+
+def start_pool():
+    """Запуск процессов заранее — до того, как в программе появятся рабочие потоки
+    (fork из многопоточного процесса может унаследовать занятые блокировки)"""
+    pool = _get_pool()
+    if pool is not None:
+        pool.submit(os.getpid).result()
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def cached_text_path(checksum: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f'{checksum}.txt')
+
+
+def read_cached_text(checksum: Optional[str]) -> Optional[str]:
+    """Ранее извлеченный текст этой версии файла или None"""
+    if not checksum:
+        return None
+    try:
+        with open(cached_text_path(checksum), encoding='utf-8') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def extract_pdf_text(pdf_path: str, checksum: Optional[str] = None) -> str:
+    """Текст PDF; с checksum результат кэшируется и файл больше не разбирается.
+
+    Постранично ограничена память на сам PDF: файл скачан на диск, разбирается через mmap
+    в процессе пула, и страницы сразу пишутся в текстовый файл (через файл, а не через
+    канал между процессами). Текст целиком возвращается, потому что DriveSync хранит
+    документ одной строкой в documents.content, а фрагменты индексация строит позже из нее.
+    Текст обычно в разы меньше самого PDF.
+    """
+    cached = read_cached_text(checksum)
+    if cached is not None:
+        return cached
+
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    text_path = cached_text_path(checksum) if checksum else pdf_path + '.txt'
+    if _get_pool() is None:
+        extract_to_file(pdf_path, text_path)
+    else:
+        _extract_in_pool(pdf_path, text_path)
+    try:
+        with open(text_path, encoding='utf-8') as file:
+            return file.read()
+    finally:
+        if not checksum:
+            os.remove(text_path)
+
+
+def prune_cache(checksums: Collection[str]) -> int:
+    """Удаление текста версий PDF, которых нет среди checksums (файл обновлен или удален).
+
+    Возвращает число удаленных файлов.
+    """
+    try:
+        names = os.listdir(PDF_CACHE_DIR)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for name in names:
+        checksum, extension = os.path.splitext(name)
+        # .tmp — текст, который сейчас пишет процесс пула
+        if extension != '.txt' or checksum in checksums:
+            continue
+        try:
+            os.remove(os.path.join(PDF_CACHE_DIR, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
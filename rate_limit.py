@@ -0,0 +1,125 @@
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+
+USER_RATE_LIMIT = float(os.getenv('USER_RATE_LIMIT', '6'))  # дорогих запросов в минуту на пользователя
+USER_BURST = int(os.getenv('USER_BURST', '3'))  # столько можно отправить подряд
+GLOBAL_RATE_LIMIT = float(os.getenv('GLOBAL_RATE_LIMIT', '60'))  # дорогих запросов в минуту на всех
+GLOBAL_BURST = int(os.getenv('GLOBAL_BURST', '20'))
+MAX_TRACKED_USERS = 10000  # сверх этого забываются корзины, успевшие наполниться
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Забрать токен. Возвращает 0, если получилось, иначе — сколько секунд ждать"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Ограничение частоты дорогих запросов (поиск, обращения к Drive).
+
+    Ограничиваются только обработчики с флагом expensive:
+    @dp.message(..., flags={"expensive": True}). Регистрировать как inner-middleware,
+    чтобы флаги обработчика были уже известны. Сначала проверяется корзина
+    пользователя, затем общая; о превышении пользователь узнает один раз
+    за период ожидания, чтобы флуд не превращался в поток ответов бота.
+    """
+
+    def __init__(self, user_rate: float = USER_RATE_LIMIT, user_burst: int = USER_BURST,
+                 global_rate: float = GLOBAL_RATE_LIMIT, global_burst: int = GLOBAL_BURST):
+        self.user_rate = user_rate / 60
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate / 60, global_burst)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._notified_until: Dict[int, float] = {}
+        self.stats = {'allowed': 0, 'rejected_user': 0, 'rejected_global': 0}
+
+    def split_global(self, parts: int):
+        """Оставить этому процессу 1/parts общего лимита — когда бота обслуживают parts процессов.
+
+        Лимит пользователя не делится: все его сообщения попадают в один процесс.
+        """
+        bucket = self.global_bucket
+        self.global_bucket = TokenBucket(bucket.rate / parts, max(1, bucket.capacity // parts))
+
+    def _user_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._forget_idle()
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _forget_idle(self):
+        # Полная корзина ничем не отличается от новой
+        for user_id in [user_id for user_id, bucket in self._buckets.items() if bucket.is_full()]:
+            del self._buckets[user_id]
+            self._notified_until.pop(user_id, None)
+
+    def check(self, user_id: int) -> Optional[str]:
+        """None — запрос разрешен, иначе текст отказа (или '' — уже предупреждали)"""
+        bucket = self._user_bucket(user_id)
+        wait = bucket.try_acquire()
+        if wait:
+            self.stats['rejected_user'] += 1
+            return self._reject(user_id, wait, f"⏳ Слишком много запросов. Повторите через {wait:.0f} сек.")
+        wait = self.global_bucket.try_acquire()
+        if wait:
+            # Пользователь не виноват в общей перегрузке — возвращаем его токен
+            bucket.refund()
+            self.stats['rejected_global'] += 1
+            return self._reject(user_id, wait, f"⏳ Бот сейчас перегружен. Повторите через {wait:.0f} сек.")
+        self.stats['allowed'] += 1
+        return None
+
+    def _reject(self, user_id: int, wait: float, text: str) -> str:
+        now = time.monotonic()
+        if self._notified_until.get(user_id, 0) > now:
+            return ''
+        self._notified_until[user_id] = now + wait
+        return text
+
+    def report(self) -> Dict:
+        stats = dict(self.stats)
+        stats['global_tokens'] = self.global_bucket.tokens
+        stats['tracked_users'] = len(self._buckets)
+        return stats
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not get_flag(data, 'expensive') or not isinstance(event, Message):
+            return await handler(event, data)
+        rejection = self.check(event.from_user.id)
+        if rejection is None:
+            return await handler(event, data)
+        if rejection:
+            await event.answer(rejection)
+        return None
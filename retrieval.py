@@ -0,0 +1,48 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+SEARCH_MODE = os.getenv('SEARCH_MODE', 'hybrid')  # hybrid | lexical | vector
+RRF_K = 60  # сглаживание reciprocal rank fusion, стандартное значение из литературы
+CANDIDATES_FACTOR = 4  # сколько кандидатов берем из каждого индекса относительно k
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], k: int) -> List[Tuple[int, float]]:
+    """Слияние нескольких ранжирований: score = Σ 1 / (RRF_K + позиция).
+
+    Шкалы BM25 и косинуса несравнимы, поэтому учитываются только позиции.
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class HybridRetriever:
+    """Поиск фрагментов документов: BM25, векторный или гибридный (RRF)"""
+
+    def __init__(self, store, lexical_index, vector_index=None, mode: str = SEARCH_MODE):
+        self.store = store
+        self.lexical_index = lexical_index
+        self.vector_index = vector_index if vector_index is not None and vector_index.available else None
+        # Без модели эмбеддингов остается только лексический поиск
+        self.mode = mode if self.vector_index else 'lexical'
+
+    def search_ids(self, query: str, k: int, mode: Optional[str] = None) -> List[Tuple[int, float]]:
+        mode = mode or self.mode
+        if mode == 'lexical':
+            return self.lexical_index.search(query, k)
+        if mode == 'vector':
+            return self.vector_index.search(query, k)
+        depth = k * CANDIDATES_FACTOR
+        return reciprocal_rank_fusion(
+            [self.lexical_index.search(query, depth), self.vector_index.search(query, depth)], k)
+
+    def search(self, query: str, k: int, mode: Optional[str] = None) -> List[Dict]:
+        """Топ-k фрагментов с названием и ссылкой документа (формат AIService)"""
+        hits = self.search_ids(query, k, mode)
+        chunks = self.store.get_chunks([chunk_id for chunk_id, _ in hits])
+        scores = dict(hits)
+        for chunk in chunks:
+            chunk['score'] = scores[chunk['chunk_id']]
+        return chunks
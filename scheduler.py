@@ -0,0 +1,271 @@
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from doc_store import STORE_PATH
+from metrics import Counter
+
+SCHEDULER_DB_PATH = os.getenv('SCHEDULER_DB_PATH', STORE_PATH)  # очередь заданий — рядом с документами
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '32'))  # документов за один проход индексации
+SCHEDULER_RETRY_DELAY = float(os.getenv('SCHEDULER_RETRY_DELAY', '30'))  # пауза после ошибки, дальше вдвое больше
+SCHEDULER_MAX_RETRY_DELAY = 3600
+SCHEDULER_IDLE_INTERVAL = 60  # проверка очереди без явного пробуждения, сек
+
+JOB_SYNC = 'sync'  # проход синхронизации с Drive
+JOB_INDEX = 'index'  # переиндексация одного документа, key — id файла
+PRIORITY_SYNC = 0.0
+PRIORITY_INDEX = 10.0
+
+JOBS = Counter('bot_scheduler_jobs_total', 'Выполненные задания планировщика', ['kind', 'outcome'])
+
+JobFunc = Callable[[List[str]], Awaitable[Optional[Dict[str, str]]]]
+
+
+class JobScheduler:
+    """Фоновые задания с очередью в SQLite: синхронизация с Drive и индексация документов.
+
+    Задание определяется видом и ключом: повторная постановка того же задания
+    не создает дубль, а только повышает приоритет и приближает срок. Очередь
+    переживает перезапуск — недоделанные задания выполнятся после старта.
+    Меньший priority — раньше, при равном — недавно измененные документы.
+    Часто цитируемые в ответах документы получают приоритет выше.
+    """
+
+    def __init__(self, path: str = SCHEDULER_DB_PATH):
+        self.path = path
+        self._handlers: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                kind TEXT,
+                key TEXT,
+                priority REAL,
+                changed_at REAL,
+                run_at REAL,
+                created_at REAL,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                generation INTEGER DEFAULT 0,
+                PRIMARY KEY (kind, key)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_runs (
+                kind TEXT PRIMARY KEY,
+                last_started REAL,
+                last_finished REAL,
+                last_success REAL,
+                last_error TEXT,
+                runs INTEGER DEFAULT 0,
+                failures INTEGER DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS citations (
+                document_id TEXT PRIMARY KEY,
+                count INTEGER,
+                last_cited REAL
+            )
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def register(self, kind: str, func: JobFunc, priority: float = PRIORITY_INDEX,
+                 interval: Optional[float] = None, batch_size: int = 1):
+        """Обработчик заданий вида kind: await func(keys) -> {key: ошибка} для неудавшихся.
+
+        interval — периодическое задание: ставится сразу и повторяется через interval
+        секунд после каждого завершения.
+        """
+        self._handlers[kind] = {'func': func, 'priority': priority, 'interval': interval, 'batch_size': batch_size}
+        if interval:
+            self.enqueue(kind, priority=priority)
+
+    def enqueue(self, kind: str, key: str = '', priority: float = PRIORITY_INDEX, delay: float = 0.0):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO jobs (kind, key, priority, changed_at, run_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET
+                    priority = MIN(priority, excluded.priority),
+                    changed_at = excluded.changed_at,
+                    run_at = MIN(run_at, excluded.run_at),
+                    generation = generation + 1
+            """, (kind, key, priority, now, now + delay, now))
+            self._conn.commit()
+        self._wake()
+
+    def on_document_changed(self, file_id: str, document: Optional[Dict] = None):
+        """Обработчик DriveSync: документ изменился или удален — поставить его индексацию"""
+        self.enqueue(JOB_INDEX, file_id, priority=self.index_priority(file_id))
+
+    def index_priority(self, document_id: str) -> float:
+        with self._lock:
+            row = self._conn.execute("SELECT count FROM citations WHERE document_id = ?", (document_id,)).fetchone()
+        # Каждое удвоение числа цитирований — на шаг раньше, но не раньше синхронизации
+        return max(PRIORITY_SYNC + 1, PRIORITY_INDEX - math.log2(1 + (row[0] if row else 0)))
+
+    def record_citations(self, document_ids: Iterable[str]):
+        """Документы, на которые сослался ответ LLM"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("""
+                INSERT INTO citations (document_id, count, last_cited) VALUES (?, 1, ?)
+                ON CONFLICT (document_id) DO UPDATE SET count = count + 1, last_cited = excluded.last_cited
+            """, [(document_id, now) for document_id in document_ids])
+            self._conn.commit()
+
+    def _wake(self):
+        if self._loop is None:
+            return
+        try:
+            if asyncio.get_running_loop() is self._loop:
+                self._wakeup.set()
+                return
+        except RuntimeError:
+            pass
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:  # цикл уже остановлен
+            pass
+
+    def _kinds_clause(self):
+        return ','.join('?' * len(self._handlers)), list(self._handlers)
+
+    def _due_jobs(self, now: float) -> List[sqlite3.Row]:
+        """Очередная пачка: задания одного вида, самые приоритетные из наступивших"""
+        placeholders, kinds = self._kinds_clause()
+        with self._lock:
+            first = self._conn.execute(f"""
+                SELECT kind FROM jobs WHERE run_at <= ? AND kind IN ({placeholders})
+                ORDER BY priority, changed_at DESC LIMIT 1
+            """, [now] + kinds).fetchone()
+            if first is None:
+                return []
+            return self._conn.execute("""
+                SELECT kind, key, generation, attempts FROM jobs WHERE kind = ? AND run_at <= ?
+                ORDER BY priority, changed_at DESC LIMIT ?
+            """, (first['kind'], now, self._handlers[first['kind']]['batch_size'])).fetchall()
+
+    def _next_run_at(self) -> Optional[float]:
+        placeholders, kinds = self._kinds_clause()
+        with self._lock:
+            row = self._conn.execute(f"SELECT MIN(run_at) FROM jobs WHERE kind IN ({placeholders})", kinds).fetchone()
+        return row[0]
+
+    async def run(self):
+        """Цикл выполнения заданий. Запускать в одном процессе — том, что пишет индексы"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            # Запросы и коммиты SQLite — в потоке, чтобы не задерживать обработчики сообщений
+            jobs = await asyncio.to_thread(self._due_jobs, time.time()) if self._handlers else []
+            if jobs:
+                await self._execute(jobs)
+                continue
+            next_run_at = await asyncio.to_thread(self._next_run_at) if self._handlers else None
+            timeout = SCHEDULER_IDLE_INTERVAL
+            if next_run_at is not None:
+                timeout = min(timeout, max(0.0, next_run_at - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, jobs: List[sqlite3.Row]):
+        kind = jobs[0]['kind']
+        handler = self._handlers[kind]
+        keys = [job['key'] for job in jobs]
+        await asyncio.to_thread(self._record_run, kind, True)
+        try:
+            failures = await handler['func'](keys) or {}
+        except Exception as e:
+            print(f"❌ Задание {kind} завершилось ошибкой: {e}")
+            failures = {key: repr(e) for key in keys}
+        await asyncio.to_thread(self._complete, jobs, failures)
+        JOBS.inc(kind, 'ok', amount=len(keys) - len(failures))
+        if failures:
+            JOBS.inc(kind, 'error', amount=len(failures))
+
+    def _complete(self, jobs: List[sqlite3.Row], failures: Dict[str, str]):
+        """Итог пачки: очередь, журнал запусков и следующий запуск периодического задания"""
+        kind = jobs[0]['kind']
+        handler = self._handlers[kind]
+        self._finish(jobs, failures)
+        self._record_run(kind, error=next(iter(failures.values()), None))
+        if handler['interval']:
+            for job in jobs:
+                self.enqueue(kind, job['key'], priority=handler['priority'], delay=handler['interval'])
+
+    def _finish(self, jobs: List[sqlite3.Row], failures: Dict[str, str]):
+        now = time.time()
+        with self._lock:
+            for job in jobs:
+                error = failures.get(job['key'])
+                if error is None:
+                    # Если задание поставили заново, пока оно выполнялось, оно остается в очереди
+                    self._conn.execute("DELETE FROM jobs WHERE kind = ? AND key = ? AND generation = ?",
+                                       (job['kind'], job['key'], job['generation']))
+                else:
+                    delay = min(SCHEDULER_RETRY_DELAY * 2 ** job['attempts'], SCHEDULER_MAX_RETRY_DELAY)
+                    self._conn.execute("""
+                        UPDATE jobs SET attempts = attempts + 1, last_error = ?, run_at = MAX(run_at, ?)
+                        WHERE kind = ? AND key = ? AND generation = ?
+                    """, (error, now + delay, job['kind'], job['key'], job['generation']))
+            self._conn.commit()
+
+    def _record_run(self, kind: str, started: bool = False, error: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            if started:
+                self._conn.execute("""
+                    INSERT INTO job_runs (kind, last_started) VALUES (?, ?)
+                    ON CONFLICT (kind) DO UPDATE SET last_started = excluded.last_started
+                """, (kind, now))
+            else:
+                self._conn.execute("""
+                    UPDATE job_runs SET last_finished = ?, runs = runs + 1,
+                        last_success = CASE WHEN ? IS NULL THEN ? ELSE last_success END,
+                        last_error = ?, failures = failures + (? IS NOT NULL)
+                    WHERE kind = ?
+                """, (now, error, now, error, error, kind))
+            self._conn.commit()
+
+    def pending(self, kind: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def report(self) -> Dict[str, Dict]:
+        """Очередь и последние запуски по видам заданий (времена — unix time).
+
+        Читает только базу, поэтому работает в любом процессе бота.
+        """
+        now = time.time()
+        with self._lock:
+            queue = self._conn.execute("""
+                SELECT kind, COUNT(*) AS pending, SUM(run_at <= ?) AS due, SUM(attempts > 0) AS retrying,
+                       MIN(created_at) AS oldest, MIN(run_at) AS next_run
+                FROM jobs GROUP BY kind
+            """, (now,)).fetchall()
+            runs = self._conn.execute("SELECT * FROM job_runs").fetchall()
+        report = {row['kind']: dict(row) for row in runs}
+        for row in queue:
+            report.setdefault(row['kind'], {'kind': row['kind']}).update(dict(row))
+        for entry in report.values():
+            started, finished = entry.get('last_started'), entry.get('last_finished')
+            entry['running'] = bool(started and (finished is None or started > finished))
+        return report
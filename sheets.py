@@ -0,0 +1,106 @@
+import os
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+SHEETS_PAGE_ROWS = int(os.getenv('SHEETS_PAGE_ROWS', '20000'))  # строк в одном диапазоне batchGet
+SHEETS_BATCH_CELLS = int(os.getenv('SHEETS_BATCH_CELLS', '500000'))  # ячеек сетки на один batchGet
+INTERN_MIN_ROWS = 1000  # после стольких строк видно, повторяются ли значения столбца
+INTERN_MAX_RATIO = 0.5  # больше такой доли уникальных значений — не храним их словарь
+
+
+def column_letter(index: int) -> str:
+    """Буквенное имя столбца в A1-нотации: 1 -> A, 27 -> AA"""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def quote_sheet_title(title: str) -> str:
+    """Имя листа в A1-нотации: кавычки обязательны для пробелов и кириллицы"""
+    return "'" + title.replace("'", "''") + "'"
+
+
+def plan_requests(grids: List[Tuple[str, int, int]], page_rows: int = SHEETS_PAGE_ROWS,
+                  batch_cells: int = SHEETS_BATCH_CELLS) -> List[List[Tuple[int, int, str]]]:
+    """Точные диапазоны листов, разбитые на запросы batchGet.
+
+    grids — (название, rowCount, columnCount) из gridProperties. Длинный лист
+    делится на страницы по page_rows строк, страницы собираются в запросы
+    не больше batch_cells ячеек. Элемент запроса — (номер листа, первая строка, диапазон).
+    """
+    batches, batch, cells = [], [], 0
+    for sheet_index, (title, row_count, column_count) in enumerate(grids):
+        last_column = column_letter(column_count)
+        for first_row in range(1, row_count + 1, page_rows):
+            last_row = min(first_row + page_rows - 1, row_count)
+            page_cells = (last_row - first_row + 1) * column_count
+            if batch and cells + page_cells > batch_cells:
+                batches.append(batch)
+                batch, cells = [], 0
+            batch.append((sheet_index, first_row,
+                          f"{quote_sheet_title(title)}!A{first_row}:{last_column}{last_row}"))
+            cells += page_cells
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class SheetTable:
+    """Лист таблицы в колоночном виде — буфер, пока лист читается страницами.
+
+    Каждый столбец — список значений, номера непустых строк — в array.
+    Повторяющиеся значения (отделы, статусы) хранятся одним объектом.
+    Первая непустая строка считается заголовком.
+    """
+
+    def __init__(self, title: str, column_count: int):
+        self.title = title
+        self.columns: List[List[str]] = [[] for _ in range(column_count)]
+        self.row_numbers = array('l')
+        # Словари для общих значений по столбцам; для столбца почти из уникальных
+        # значений (идентификаторы) словарь только тратит память и отключается
+        self._values: List[Optional[Dict[str, str]]] = [{} for _ in range(column_count)]
+
+    def __len__(self) -> int:
+        return len(self.row_numbers)
+
+    def add_rows(self, rows: List[List], first_row: int):
+        """Строки ответа values.batchGet, начиная с листовой строки first_row"""
+        for offset, row in enumerate(rows):
+            if not any(row):
+                continue
+            self.row_numbers.append(first_row + offset)
+            for i, column in enumerate(self.columns):
+                value = str(row[i]).strip() if i < len(row) and row[i] != '' else ''
+                values = self._values[i]
+                if values is not None:
+                    value = values.setdefault(value, value)
+                column.append(value)
+        self._drop_unique_dictionaries()
+
+    def _drop_unique_dictionaries(self):
+        rows = len(self.row_numbers)
+        if rows < INTERN_MIN_ROWS:
+            return
+        for i, values in enumerate(self._values):
+            if values is not None and len(values) > rows * INTERN_MAX_RATIO:
+                self._values[i] = None
+
+    def header(self) -> List[str]:
+        if not self.row_numbers:
+            return []
+        return [column[0] or column_letter(i + 1) for i, column in enumerate(self.columns)]
+
+    def render(self) -> Iterator[str]:
+        """Текст листа построчно: каждая строка несет названия столбцов,
+        поэтому любой фрагмент после разбиения понятен без заголовка"""
+        yield f"Лист: {self.title}"
+        header = self.header()
+        if len(self.row_numbers) == 1:
+            yield "Столбцы: " + ", ".join(name for name in header)
+            return
+        for j in range(1, len(self.row_numbers)):
+            cells = [f"{name}: {column[j]}" for name, column in zip(header, self.columns) if column[j]]
+            yield f"Строка {self.row_numbers[j]}: " + "; ".join(cells)
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+from typing import List
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))  # секунд между правками сообщения
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Деление длинного текста на сообщения Telegram, по возможности по переводам строк"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    parts.append(text)
+    return parts
+
+
+class MessageStreamer:
+    """Обновление сообщения-заглушки по мере генерации ответа.
+
+    Telegram ограничивает частоту правок (порядка одной в секунду на чат),
+    поэтому промежуточный текст отправляется не чаще STREAM_EDIT_INTERVAL,
+    а при TelegramRetryAfter правки откладываются на указанное время.
+    """
+
+    def __init__(self, message: Message, interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._last_text = message.text or ''
+        self._next_edit_at = 0.0
+        self._blocked_until = 0.0  # после TelegramRetryAfter
+
+    async def _edit(self, text: str):
+        if text == self._last_text:
+            return
+        try:
+            await self.message.edit_text(text)
+            self._last_text = text
+        except TelegramRetryAfter as e:
+            self._blocked_until = time.monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            # Текст не изменился с точки зрения Telegram — не ошибка
+            if 'message is not modified' not in str(e):
+                raise
+
+    async def update(self, text: str):
+        """Промежуточный текст: отправляется, только если подошло время следующей правки"""
+        now = time.monotonic()
+        if now < max(self._next_edit_at, self._blocked_until):
+            return
+        self._next_edit_at = now + self.interval
+        await self._edit(text[:TELEGRAM_MESSAGE_LIMIT - 1] + '…' if len(text) >= TELEGRAM_MESSAGE_LIMIT else text)
+
+    async def finish(self, text: str):
+        """Финальный текст: отправляется всегда, длинный — несколькими сообщениями"""
+        first, *rest = split_message(text)
+        delay = self._blocked_until - time.monotonic()
+        while True:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.message.edit_text(first)
+                break
+            except TelegramRetryAfter as e:
+                delay = e.retry_after
+            except TelegramBadRequest as e:
+                if 'message is not modified' not in str(e):
+                    raise
+                break
+        self._last_text = first
+        for part in rest:
+            await self.message.answer(part)
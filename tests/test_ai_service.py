@@ -0,0 +1,103 @@
+"""Повторы запросов AIService к локальному OpenAI-совместимому серверу (benchmarks/fake_openai.py)"""
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import ai_service
+from ai_service import AIService
+from fake_openai import DEFAULT_ANSWER, FakeOpenAIServer
+
+DOCUMENTS = [{'id': 'doc', 'name': 'Отпуск', 'content': 'Заявление на отпуск подается за две недели.',
+              'link': 'https://docs/doc'}]
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Паузы перед повторами, которые выбрал AIService"""
+    delays = []
+    retry_delay = ai_service._retry_delay
+
+    def record(error, attempt):
+        delays.append(retry_delay(error, attempt))
+        return delays[-1]
+    monkeypatch.setattr(ai_service, '_retry_delay', record)
+    return delays
+
+
+def run(server, scenario):
+    async def main():
+        url = await server.start()
+        service = AIService(client=openai.AsyncOpenAI(api_key='test', base_url=url, max_retries=0))
+        try:
+            return await scenario(service)
+        finally:
+            await service.close()
+            await server.stop()
+    return asyncio.run(main())
+
+
+async def stream(service):
+    answer = service.stream_answer('Как оформить отпуск?', DOCUMENTS)
+    async for _ in answer:
+        pass
+    return answer.answer
+
+
+def test_rate_limit_is_retried_after_retry_after(delays):
+    server = FakeOpenAIServer(first_token_delay=0, token_delay=0, fail_next=2, retry_after='0.05')
+
+    result = run(server, lambda service: service.search_documents('Как оформить отпуск?', DOCUMENTS))
+
+    assert result['answer'] == DEFAULT_ANSWER
+    assert not result.get('error')
+    assert server.calls['requests'] == 3
+    assert delays == [0.05, 0.05]
+
+
+def test_server_error_is_retried_with_backoff(delays):
+    server = FakeOpenAIServer(first_token_delay=0, token_delay=0, fail_next=1, fail_status=500, retry_after=None)
+
+    result = run(server, lambda service: service.search_documents('Как оформить отпуск?', DOCUMENTS))
+
+    assert not result.get('error')
+    assert server.calls['status_500'] == 1
+    # Без Retry-After — экспоненциальная пауза с джиттером
+    assert ai_service.RETRY_BASE_DELAY * 0.5 <= delays[0] <= ai_service.RETRY_BASE_DELAY
+
+
+def test_client_error_is_not_retried(delays):
+    server = FakeOpenAIServer(first_token_delay=0, token_delay=0, fail_next=1, fail_status=400)
+
+    result = run(server, lambda service: service.search_documents('Как оформить отпуск?', DOCUMENTS))
+
+    assert result['error']
+    assert server.calls['requests'] == 1
+    assert delays == []
+
+
+def test_retries_stop_after_limit(delays):
+    server = FakeOpenAIServer(first_token_delay=0, token_delay=0, fail_next=100, retry_after='0.01')
+
+    result = run(server, lambda service: service.search_documents('Как оформить отпуск?', DOCUMENTS))
+
+    assert result['error']
+    assert server.calls['requests'] == ai_service.OPENAI_MAX_RETRIES + 1
+
+
+def test_stream_is_retried_before_first_token(delays):
+    server = FakeOpenAIServer(first_token_delay=0, token_delay=0, fail_next=1, retry_after='0.01')
+
+    assert run(server, stream).strip() == DEFAULT_ANSWER
+    assert server.calls['requests'] == 2
+
+
+def test_stream_is_not_retried_after_first_token(delays):
+    server = FakeOpenAIServer(first_token_delay=0, token_delay=0, break_after_tokens=3)
+
+    with pytest.raises((httpx.TransportError, openai.APIConnectionError)):
+        run(server, stream)
+    # Пользователь уже видел начало ответа — повтор дал бы другой текст
+    assert server.calls['requests'] == 1
+    assert delays == []
@@ -0,0 +1,31 @@
+"""AnswerCache: запись сбрасывается, если документ-источник изменился"""
+from answer_cache import AnswerCache
+
+RESULT = {'answer': 'За две недели.', 'sources': [{'id': 'doc', 'name': 'Отпуск', 'link': 'https://docs/doc'}]}
+
+
+class Store:
+    def __init__(self):
+        self.versions = {'doc': 'v1'}
+
+    def get_versions(self, file_ids):
+        return {file_id: self.versions[file_id] for file_id in file_ids if file_id in self.versions}
+
+
+def test_answer_is_returned_while_sources_are_unchanged():
+    cache = AnswerCache(Store())
+    cache.put('Как оформить отпуск?', RESULT, {'doc': 'v1'})
+
+    assert cache.lookup('как оформить   отпуск') == (RESULT, 'exact')
+
+
+def test_document_changed_during_generation_invalidates_answer():
+    store = Store()
+    cache = AnswerCache(store)
+    # Фрагменты найдены в версии v1, пока LLM отвечал, синхронизация записала v2
+    versions = store.get_versions(['doc'])
+    store.versions['doc'] = 'v2'
+    cache.put('Как оформить отпуск?', RESULT, versions)
+
+    assert cache.lookup('Как оформить отпуск?') is None
+    assert cache.report()['invalidations'] == 1
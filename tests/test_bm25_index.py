@@ -0,0 +1,57 @@
+"""BM25Index: русский стеммер, сохранение на диск и удаление фрагментов"""
+import pytest
+
+from bm25_index import BM25Index, stem, tokenize
+
+CHUNKS = [
+    {'id': 1, 'text': 'Заявка на отпуск подается за две недели'},
+    {'id': 2, 'text': 'Заявки на командировку согласует руководитель'},
+    {'id': 3, 'text': 'График отпусков утверждается в декабре'},
+]
+
+
+@pytest.mark.parametrize('forms', [
+    ('заявка', 'заявку', 'заявки', 'заявкой'),
+    ('отпуск', 'отпуска', 'отпуском'),
+    ('сотрудники', 'сотрудников'),
+    ('документ', 'документы', 'документами'),
+])
+def test_word_forms_share_stem(forms):
+    assert len({stem(word) for word in forms}) == 1
+
+
+def test_tokenize_drops_stop_words_and_keeps_latin():
+    assert tokenize('Как оформить заявку на отпуск? Ёлка HR-2024') == ['оформ', 'заявк', 'отпуск', 'елк', 'hr', '2024']
+
+
+def test_search_matches_other_word_forms(tmp_path):
+    index = BM25Index(str(tmp_path / 'bm25.idx'))
+    index.add(CHUNKS)
+
+    assert {chunk_id for chunk_id, _ in index.search('заявку', 5)} == {1, 2}
+
+
+def test_save_and_load_give_same_scores(tmp_path):
+    path = str(tmp_path / 'bm25.idx')
+    index = BM25Index(path)
+    index.add(CHUNKS)
+    index.save()
+
+    loaded = BM25Index(path)
+
+    assert len(loaded) == len(index)
+    for query in ('заявка на отпуск', 'командировка', 'декабрь'):
+        assert loaded.search(query, 5) == index.search(query, 5)
+
+
+def test_remove_deletes_empty_postings(tmp_path):
+    index = BM25Index(str(tmp_path / 'bm25.idx'))
+    index.add(CHUNKS)
+
+    index.remove([2, 42])
+
+    assert index.ids() == {1, 3}
+    assert stem('командировку') not in index._postings
+    assert 2 not in index._postings[stem('заявки')]
+    assert index._total_length == sum(index._lengths.values())
+    assert index.search('командировка', 5) == []
@@ -0,0 +1,79 @@
+"""ContextBuilder: укладка фрагментов в бюджет токенов (приблизительный подсчет без tiktoken)"""
+import pytest
+
+import context_builder
+from context_builder import MIN_PASSAGE_TOKENS, ContextBuilder, TokenCounter
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    # tiktoken скачивает словарь кодировки при первом использовании — в тестах считаем офлайн
+    monkeypatch.setattr(context_builder, 'tiktoken', None)
+    return TokenCounter()
+
+
+def passage(name, words, word='alpha'):
+    return {'id': name, 'name': name, 'content': ' '.join(f'{word}{i}' for i in range(words))}
+
+
+def cost(counter, item):
+    """Токены фрагмента в контексте вместе с разделителем"""
+    return counter.count(ContextBuilder.format_passage(item['name'], item['content'])) + 1
+
+
+def test_budget_never_exceeds_model_window(counter):
+    builder = ContextBuilder(counter, context_window=4000, token_budget=3000)
+
+    assert builder.budget(prompt_tokens=200, max_tokens=500) == 3000
+    assert builder.budget(prompt_tokens=2000, max_tokens=500) == 1500
+    assert builder.budget(prompt_tokens=5000, max_tokens=500) == 0
+
+
+def test_passages_fit_into_budget(counter):
+    builder = ContextBuilder(counter)
+    passages = [passage('a', 50, 'a'), passage('b', 50, 'b'), passage('c', 50, 'c')]
+    budget = cost(counter, passages[0]) + cost(counter, passages[1])
+
+    context, used, stats = builder.build('вопрос', passages, budget)
+
+    assert [item['id'] for item in used] == ['a', 'b']
+    assert stats['context_tokens'] <= budget
+    assert (stats['passages_used'], stats['passages_dropped']) == (2, 1)
+    assert 'Документ: c' not in context
+
+
+def test_duplicates_are_dropped(counter):
+    builder = ContextBuilder(counter)
+    original = passage('a', 40)
+    same_text = dict(original, id='b', name='b', content=original['content'].upper().replace(' ', '  '))
+    near_copy = dict(original, id='c', name='c', content=original['content'] + ' хвост')
+    other = passage('d', 40, 'delta')
+
+    _, used, stats = builder.build('вопрос', [original, same_text, near_copy, other], 10000)
+
+    assert [item['id'] for item in used] == ['a', 'd']
+    assert stats['duplicates'] == 2
+
+
+def test_remaining_budget_is_filled_with_truncated_passage(counter):
+    builder = ContextBuilder(counter)
+    first, long = passage('a', 30, 'a'), passage('b', 400, 'b')
+    budget = cost(counter, first) + MIN_PASSAGE_TOKENS * 3
+
+    context, used, stats = builder.build('вопрос', [first, long], budget)
+
+    assert [item['id'] for item in used] == ['a', 'b']
+    assert stats['context_tokens'] <= budget
+    assert context.rstrip().endswith('...')
+    assert long['content'] not in context
+
+
+def test_tail_smaller_than_min_passage_is_left_empty(counter):
+    builder = ContextBuilder(counter)
+    first, long = passage('a', 30, 'a'), passage('b', 400, 'b')
+    budget = cost(counter, first) + MIN_PASSAGE_TOKENS // 2
+
+    _, used, stats = builder.build('вопрос', [first, long], budget)
+
+    assert [item['id'] for item in used] == ['a']
+    assert stats['passages_dropped'] == 1
@@ -0,0 +1,44 @@
+"""CredentialsManager: сохранение обновленного токена"""
+import errno
+import os
+import pickle
+
+import pytest
+
+import credentials
+from credentials import CredentialsManager
+
+
+def test_token_is_replaced_atomically(tmp_path):
+    path = tmp_path / 'token.pickle'
+    path.write_bytes(pickle.dumps({'token': 'old'}))
+
+    CredentialsManager(token_path=str(path))._save({'token': 'new'})
+
+    assert pickle.loads(path.read_bytes()) == {'token': 'new'}
+    assert os.listdir(tmp_path) == ['token.pickle']
+
+
+def test_bind_mounted_token_is_written_in_place(tmp_path, monkeypatch):
+    path = tmp_path / 'token.pickle'
+    path.write_bytes(pickle.dumps({'token': 'old'}))
+
+    def busy(src, dst):
+        # Так ведет себя файл, смонтированный в контейнер через docker-compose
+        raise OSError(errno.EBUSY, 'Device or resource busy')
+    monkeypatch.setattr(credentials.os, 'replace', busy)
+
+    CredentialsManager(token_path=str(path))._save({'token': 'new'})
+
+    assert pickle.loads(path.read_bytes()) == {'token': 'new'}
+    assert os.listdir(tmp_path) == ['token.pickle']
+
+
+def test_other_replace_errors_are_raised(tmp_path, monkeypatch):
+    def denied(src, dst):
+        raise PermissionError(errno.EACCES, 'Permission denied')
+    monkeypatch.setattr(credentials.os, 'replace', denied)
+
+    with pytest.raises(PermissionError):
+        CredentialsManager(token_path=str(tmp_path / 'token.pickle'))._save({'token': 'new'})
+    assert os.listdir(tmp_path) == []
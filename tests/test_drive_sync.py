@@ -0,0 +1,203 @@
+"""DriveSync против FakeDriveService: сценарии изменений проигрываются через replay()"""
+import asyncio
+import threading
+
+import pytest
+
+from async_gdrive import AsyncDriveService
+from doc_store import DocumentStore, DriveSync
+from fakes import FakeDriveService
+
+
+class Harness:
+    def __init__(self, path, documents=None):
+        self.fake = FakeDriveService(documents=documents)
+        self.drive = AsyncDriveService(service_factory=lambda: self.fake)
+        self.store = DocumentStore(str(path))
+        self.sync = DriveSync(self.drive, self.store, folder_id=self.fake.folder_id)
+        self.events = []
+        self.sync.add_listener(lambda file_id, document: self.events.append(
+            (file_id, document['content'] if document else None)))
+
+    def run(self):
+        self.events.clear()
+        return asyncio.run(self.sync.sync())
+
+    def contents(self):
+        return {file_id: self.store.get_document(file_id)['content'] for file_id in self.store.document_ids()}
+
+    def page_token(self):
+        return self.store.get_meta(DriveSync.PAGE_TOKEN_KEY)
+
+    def close(self):
+        self.drive.close()
+        self.store.close()
+
+
+@pytest.fixture
+def harness(tmp_path):
+    harness = Harness(tmp_path / 'documents.db', documents=[
+        {'id': 'a', 'name': 'A', 'content': 'текст a'},
+        {'id': 'b', 'name': 'B', 'content': 'текст b'},
+    ])
+    yield harness
+    harness.close()
+
+
+def test_first_pass_is_full_sync(harness):
+    stats = harness.run()
+
+    assert stats['updated'] == 2
+    assert harness.contents() == {'a': 'текст a', 'b': 'текст b'}
+    assert dict(harness.events) == {'a': 'текст a', 'b': 'текст b'}
+    assert harness.page_token() == '0'
+    assert harness.fake.calls['files_list'] == 1
+
+
+def test_changes_script_is_applied_incrementally(harness):
+    harness.run()
+    harness.fake.replay([
+        ('add', 'c', 'C', 'текст c'),
+        ('modify', 'a', 'новый текст a'),
+        ('delete', 'b'),
+    ])
+
+    stats = harness.run()
+
+    assert (stats['updated'], stats['deleted']) == (2, 1)
+    assert harness.contents() == {'a': 'новый текст a', 'c': 'текст c'}
+    assert dict(harness.events) == {'a': 'новый текст a', 'b': None, 'c': 'текст c'}
+    assert harness.page_token() == '3'
+    # Второй проход идет через Changes API, без обхода папки
+    assert harness.fake.calls['files_list'] == 1
+    assert harness.fake.calls['list_changes'] == 1
+
+
+def test_trashed_and_moved_out_documents_are_removed(harness):
+    harness.run()
+    harness.fake.replay([('trash', 'a'), ('move_out', 'b')])
+
+    stats = harness.run()
+
+    assert stats['deleted'] == 2
+    assert harness.contents() == {}
+    assert harness.events == [('a', None), ('b', None)]
+
+
+def test_only_last_change_of_a_file_is_downloaded(harness):
+    harness.run()
+    fetched = sum(harness.fake.calls.values())
+    harness.fake.replay([('modify', 'a', 'v2'), ('modify', 'a', 'v3')])
+
+    harness.run()
+
+    assert harness.contents()['a'] == 'v3'
+    assert harness.events == [('a', 'v3')]
+    # list_changes и одна пачка Google Docs
+    assert sum(harness.fake.calls.values()) - fetched == 2
+
+
+def test_pass_without_changes_downloads_nothing(harness):
+    harness.run()
+    harness.run()
+
+    assert harness.events == []
+    assert harness.fake.calls['fetch_google_docs_batch'] == 1
+
+
+def test_documents_in_subfolders_are_synced(harness):
+    harness.fake.add_folder('sub', 'Подпапка')
+    harness.fake.add_folder('deep', 'Вложенная', parent='sub')
+    harness.fake.add('d', 'D', 'текст d', parent='deep')
+    harness.run()
+    assert set(harness.contents()) == {'a', 'b', 'd'}
+
+    # Новый документ в известной подпапке — без полного обхода
+    harness.fake.add('e', 'E', 'текст e', parent='sub')
+    harness.run()
+    assert set(harness.contents()) == {'a', 'b', 'd', 'e'}
+    assert harness.fake.calls['files_list'] == 3  # один вызов на уровень при первом обходе
+
+
+def test_new_subfolder_triggers_full_pass(harness):
+    harness.run()
+    harness.fake.add_folder('sub', 'Подпапка')
+    harness.fake.add('d', 'D', 'текст d', parent='sub')
+
+    harness.run()
+
+    assert set(harness.contents()) == {'a', 'b', 'd'}
+    # Неизменившиеся документы при полном обходе не скачиваются заново
+    assert harness.events == [('d', 'текст d')]
+
+
+def test_trashed_subfolder_removes_its_documents(harness):
+    harness.fake.add_folder('sub', 'Подпапка')
+    harness.fake.add('d', 'D', 'текст d', parent='sub')
+    harness.run()
+
+    harness.fake.replay([('trash', 'sub')])
+    harness.run()
+
+    assert set(harness.contents()) == {'a', 'b'}
+    assert harness.events == [('d', None)]
+
+
+def test_failing_file_does_not_hold_page_token(harness):
+    harness.fake.failing.add('b')
+
+    stats = harness.run()
+
+    assert stats['errors'] == 1
+    assert set(harness.contents()) == {'a'}
+    assert harness.page_token() == '0'
+    harness.fake.add('c', 'C', 'текст c')
+    harness.run()
+    # Следующий проход — по журналу изменений, а не новый полный обход
+    assert set(harness.contents()) == {'a', 'c'}
+    assert harness.fake.calls['files_list'] == 1
+    assert harness.fake.calls['get_start_page_token'] == 1
+
+
+def test_failed_file_is_retried_after_delay(harness, monkeypatch):
+    harness.fake.failing.add('b')
+    harness.run()
+    batches = harness.fake.calls['fetch_google_docs_batch']
+
+    # Пауза до повтора еще не прошла
+    harness.run()
+    assert harness.fake.calls['fetch_google_docs_batch'] == batches
+
+    monkeypatch.setattr('time.time', lambda: 10 ** 10)
+    harness.fake.failing.clear()
+    harness.run()
+    assert harness.contents()['b'] == 'текст b'
+    assert harness.events == [('b', 'текст b')]
+    assert harness.store.failed_ids() == []
+
+
+def test_deleted_failed_file_is_forgotten(harness):
+    harness.fake.failing.add('b')
+    harness.run()
+
+    harness.fake.replay([('delete', 'b')])
+    harness.run()
+
+    assert harness.store.failed_ids() == []
+
+
+def test_store_work_runs_off_event_loop_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr('doc_store.SYNC_BATCH_SIZE', 2)
+    harness = Harness(tmp_path / 'documents.db', documents=[
+        {'id': f'doc{i}', 'name': f'Документ {i}', 'content': f'текст {i}'} for i in range(5)])
+    threads = set()
+    harness.sync.add_listener(lambda file_id, document: threads.add(threading.current_thread()))
+
+    stats = harness.run()
+
+    assert stats['updated'] == 5
+    assert len(harness.contents()) == 5
+    assert harness.fake.calls['fetch_google_docs_batch'] == 3
+    # Слушатели (и запись в SQLite) — не в потоке event loop
+    assert threading.main_thread() not in threads
+    harness.close()
@@ -0,0 +1,48 @@
+"""Выбор способа загрузки по типу файла: API Google только для файлов Google"""
+import zipfile
+
+import pytest
+
+from gdrive_service import GoogleDriveService
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+WORD_XML = ('<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+            '<w:p><w:r><w:t>Порядок</w:t></w:r><w:r><w:t> отпуска</w:t></w:r></w:p>'
+            '<w:p><w:r><w:t>Заявление за две недели</w:t></w:r></w:p></w:body></w:document>')
+SHARED_STRINGS_XML = ('<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                      '<si><t>Отдел</t></si><si><t>Бухгалтерия</t></si></sst>')
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = GoogleDriveService(credentials=object())
+    monkeypatch.setattr(service, '_get_google_doc_content', lambda file_id: 'google doc')
+    monkeypatch.setattr(service, '_get_google_sheet_content', lambda file_id: 'google sheet')
+    return service
+
+
+def serve_archive(monkeypatch, service, parts):
+    def download_file(file_id, destination):
+        with zipfile.ZipFile(destination, 'w') as archive:
+            for name, xml in parts.items():
+                archive.writestr(name, xml)
+        destination.flush()
+    monkeypatch.setattr(service, 'download_file', download_file)
+
+
+def test_google_files_use_docs_and_sheets_api(service):
+    assert service.fetch_document_content('a', 'application/vnd.google-apps.document') == 'google doc'
+    assert service.fetch_document_content('a', 'application/vnd.google-apps.spreadsheet') == 'google sheet'
+
+
+def test_docx_is_downloaded_not_read_through_docs_api(service, monkeypatch):
+    serve_archive(monkeypatch, service, {'word/document.xml': WORD_XML})
+
+    assert service.fetch_document_content('a', DOCX_MIME_TYPE) == 'Порядок отпуска\nЗаявление за две недели'
+
+
+def test_xlsx_is_downloaded_not_read_through_sheets_api(service, monkeypatch):
+    serve_archive(monkeypatch, service, {'xl/sharedStrings.xml': SHARED_STRINGS_XML})
+
+    assert service.fetch_document_content('a', XLSX_MIME_TYPE) == 'Отдел\nБухгалтерия'
@@ -0,0 +1,64 @@
+"""DocumentIndexer.ensure_consistent: индексы после сбоя между replace_chunks и save"""
+import pytest
+
+from bm25_index import BM25Index
+from doc_store import DocumentStore
+from fakes import HashingEmbedder
+from indexer import DocumentIndexer
+from vector_index import VectorIndex, faiss
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DocumentStore(str(tmp_path / 'documents.db'))
+    for file_id, content in (('a', 'заявка на отпуск'), ('b', 'график дежурств')):
+        store.upsert({'id': file_id, 'name': file_id.upper()}, content)
+    yield store
+    store.close()
+
+
+def make_indexes(tmp_path):
+    indexes = [BM25Index(str(tmp_path / 'bm25.idx'))]
+    if faiss is not None:
+        indexes.append(VectorIndex(str(tmp_path / 'vectors.faiss'), embedder=HashingEmbedder(32)))
+    return indexes
+
+
+def index_all(store, indexes):
+    indexer = DocumentIndexer(store, indexes, chunker=lambda text: [text])
+    for file_id in store.document_ids():
+        indexer.index_document(file_id, store.get_document(file_id))
+    for index in indexes:
+        index.save()
+
+
+def test_lost_index_is_rebuilt(tmp_path, store):
+    index_all(store, make_indexes(tmp_path))
+    (tmp_path / 'bm25.idx').unlink()
+
+    indexes = make_indexes(tmp_path)
+    DocumentIndexer(store, indexes).ensure_consistent()
+
+    assert all(index.ids() == store.chunk_ids() for index in indexes)
+
+
+def test_chunks_replaced_after_last_save_are_reconciled(tmp_path, store):
+    index_all(store, make_indexes(tmp_path))
+    # Сбой после replace_chunks, до save: число фрагментов прежнее, id — новые
+    store.replace_chunks('a', ['заявка на командировку'])
+
+    indexes = make_indexes(tmp_path)
+    assert indexes[0].ids() != store.chunk_ids()
+    DocumentIndexer(store, indexes).ensure_consistent()
+
+    for index in indexes:
+        assert index.ids() == store.chunk_ids()
+    hits = indexes[0].search('командировка', 5)
+    assert [chunk['content'] for chunk in store.get_chunks([chunk_id for chunk_id, _ in hits])] == \
+        ['заявка на командировку']
+    # Исправленный индекс сохранен
+    assert BM25Index(str(tmp_path / 'bm25.idx')).ids() == store.chunk_ids()
+
+
+def test_unchunked_documents_are_returned(tmp_path, store):
+    assert sorted(DocumentIndexer(store, make_indexes(tmp_path)).ensure_consistent()) == ['a', 'b']
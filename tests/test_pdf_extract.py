@@ -0,0 +1,68 @@
+"""Пул разбора PDF и кэш извлеченного текста"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from pypdf import PdfWriter
+
+import pdf_extract
+
+
+class BrokenPool:
+    """Пул, процесс которого упал"""
+    def submit(self, *args):
+        raise BrokenProcessPool('процесс завершился')
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class InlinePool:
+    """Пул без процессов: задача выполняется сразу"""
+    created = 0
+
+    def __init__(self, max_workers):
+        InlinePool.created += 1
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_extract, 'PDF_CACHE_DIR', str(tmp_path / 'pdf_cache'))
+    return tmp_path / 'pdf_cache'
+
+
+def test_broken_pool_is_recreated(tmp_path, cache_dir, monkeypatch):
+    pdf_path = str(tmp_path / 'empty.pdf')
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=100)
+    writer.write(pdf_path)
+    monkeypatch.setattr(pdf_extract, 'PDF_WORKERS', 1)
+    monkeypatch.setattr(pdf_extract, 'ProcessPoolExecutor', InlinePool)
+    monkeypatch.setattr(pdf_extract, '_pool', BrokenPool())
+    InlinePool.created = 0
+
+    assert pdf_extract.extract_pdf_text(pdf_path, 'abc') == ''
+    assert InlinePool.created == 1
+    assert isinstance(pdf_extract._pool, InlinePool)
+    assert (cache_dir / 'abc.txt').exists()
+
+
+def test_prune_cache_removes_stale_versions(cache_dir):
+    cache_dir.mkdir()
+    for name in ('current.txt', 'old.txt', 'writing.txt.tmp'):
+        (cache_dir / name).write_text('текст', encoding='utf-8')
+
+    assert pdf_extract.prune_cache({'current'}) == 1
+    assert sorted(path.name for path in cache_dir.iterdir()) == ['current.txt', 'writing.txt.tmp']
+
+
+def test_prune_cache_without_cache_dir(cache_dir):
+    assert pdf_extract.prune_cache(set()) == 0
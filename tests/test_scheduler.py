@@ -0,0 +1,153 @@
+"""JobScheduler: поколения заданий, повторы с паузой, приоритет цитируемых документов, очередь в SQLite"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import scheduler as scheduler_module
+from scheduler import JOB_INDEX, JOB_SYNC, PRIORITY_INDEX, PRIORITY_SYNC, JobScheduler
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'documents.db')
+
+
+@pytest.fixture
+def scheduler(path):
+    scheduler = JobScheduler(path)
+    yield scheduler
+    scheduler.close()
+
+
+def run_once(scheduler):
+    """Одна пачка наступивших заданий"""
+    jobs = scheduler._due_jobs(time.time())
+    assert jobs
+    asyncio.run(scheduler._execute(jobs))
+
+
+def job(scheduler, kind, key):
+    with scheduler._lock:
+        return scheduler._conn.execute("SELECT * FROM jobs WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+
+
+def test_successful_job_is_removed(scheduler):
+    done = []
+
+    async def handler(keys):
+        done.extend(keys)
+    scheduler.register(JOB_INDEX, handler)
+    scheduler.enqueue(JOB_INDEX, 'a')
+
+    run_once(scheduler)
+
+    assert done == ['a']
+    assert scheduler.pending(JOB_INDEX) == 0
+    assert scheduler.report()[JOB_INDEX]['last_success']
+
+
+def test_job_enqueued_while_running_stays_queued(scheduler):
+    async def handler(keys):
+        # Документ снова изменился, пока шла его индексация
+        scheduler.enqueue(JOB_INDEX, 'a')
+    scheduler.register(JOB_INDEX, handler)
+    scheduler.enqueue(JOB_INDEX, 'a')
+
+    run_once(scheduler)
+
+    assert scheduler.pending(JOB_INDEX) == 1
+    assert job(scheduler, JOB_INDEX, 'a')['generation'] == 1
+
+
+def test_failed_job_is_retried_with_backoff(scheduler):
+    async def handler(keys):
+        return {'a': 'ошибка'}
+    scheduler.register(JOB_INDEX, handler, batch_size=2)
+    scheduler.enqueue(JOB_INDEX, 'a')
+    scheduler.enqueue(JOB_INDEX, 'b')
+
+    started = time.time()
+    run_once(scheduler)
+
+    row = job(scheduler, JOB_INDEX, 'a')
+    assert (row['attempts'], row['last_error']) == (1, 'ошибка')
+    assert row['run_at'] >= started + scheduler_module.SCHEDULER_RETRY_DELAY
+    assert job(scheduler, JOB_INDEX, 'b') is None
+    report = scheduler.report()[JOB_INDEX]
+    assert (report['retrying'], report['last_error'], report['failures']) == (1, 'ошибка', 1)
+
+
+def test_handler_exception_fails_whole_batch(scheduler):
+    async def handler(keys):
+        raise RuntimeError('сбой')
+    scheduler.register(JOB_INDEX, handler, batch_size=2)
+    scheduler.enqueue(JOB_INDEX, 'a')
+    scheduler.enqueue(JOB_INDEX, 'b')
+
+    run_once(scheduler)
+
+    assert [job(scheduler, JOB_INDEX, key)['attempts'] for key in 'ab'] == [1, 1]
+
+
+def test_cited_documents_are_indexed_first(scheduler):
+    scheduler.register(JOB_INDEX, None)
+    for _ in range(3):
+        scheduler.record_citations(['hot'])
+    scheduler.on_document_changed('cold')
+    scheduler.on_document_changed('hot')
+
+    assert PRIORITY_SYNC < scheduler.index_priority('hot') < scheduler.index_priority('cold') == PRIORITY_INDEX
+    assert [row['key'] for row in scheduler._due_jobs(time.time())] == ['hot']
+
+
+def test_citations_never_outrank_sync(scheduler):
+    for _ in range(1000):
+        scheduler.record_citations(['hot'])
+
+    assert scheduler.index_priority('hot') == PRIORITY_SYNC + 1
+
+
+def test_queue_survives_restart(path):
+    first = JobScheduler(path)
+    first.enqueue(JOB_INDEX, 'a')
+    first.close()
+
+    second = JobScheduler(path)
+    done = []
+
+    async def handler(keys):
+        done.extend(keys)
+    second.register(JOB_INDEX, handler)
+    run_once(second)
+    second.close()
+
+    assert done == ['a']
+
+
+def test_run_keeps_sqlite_off_event_loop(scheduler, monkeypatch):
+    threads = set()
+    finish = scheduler._finish
+
+    def record(*args):
+        threads.add(threading.current_thread())
+        return finish(*args)
+    monkeypatch.setattr(scheduler, '_finish', record)
+
+    async def main():
+        done = asyncio.Event()
+
+        async def handler(keys):
+            done.set()
+        scheduler.register(JOB_SYNC, handler, priority=PRIORITY_SYNC, interval=3600)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.wait_for(done.wait(), 5)
+        # Ждем, пока периодическое задание поставится снова (между _finish и enqueue строки нет)
+        while (row := job(scheduler, JOB_SYNC, '')) is None or row['run_at'] < time.time() + 3000:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(main())
+
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,125 @@
+"""UserStore и AuthMiddleware: доступ по кэшу пользователей"""
+import asyncio
+import datetime
+
+import aiosqlite
+import pytest
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+from user_store import AuthMiddleware, UserStore
+
+ADMIN_ID = 1
+STRANGER_ID = 2
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """Ответы бота вместо запросов к Telegram: (текст, show_alert)"""
+    answers = []
+
+    async def message_answer(self, text, **kwargs):
+        answers.append((text, None))
+
+    async def callback_answer(self, text=None, show_alert=None, **kwargs):
+        answers.append((text, show_alert))
+    monkeypatch.setattr(Message, 'answer', message_answer)
+    monkeypatch.setattr(CallbackQuery, 'answer', callback_answer)
+    return answers
+
+
+def run(path, scenario):
+    async def main():
+        users = UserStore(str(path))
+        await users.open()
+        await users.add_user(ADMIN_ID, 'Админ', 'IT', 'admin')
+        try:
+            return await scenario(users)
+        finally:
+            await users.close()
+    return asyncio.run(main())
+
+
+def message(user_id, text):
+    return Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=user_id, type='private'),
+                   from_user=User(id=user_id, is_bot=False, first_name='Тест'), text=text)
+
+
+def callback(user_id):
+    return CallbackQuery(id='1', chat_instance='1', data='docs:1',
+                         from_user=User(id=user_id, is_bot=False, first_name='Тест'))
+
+
+async def dispatch(users, event):
+    """Прогон события через middleware; профиль, с которым вызван обработчик, или None"""
+    calls = []
+
+    async def handler(event, data):
+        calls.append(data.get('user', 'public'))
+    await AuthMiddleware(users)(handler, event, {})
+    return calls[0] if calls else None
+
+
+def test_known_user_reaches_handler(tmp_path, answers):
+    user = run(tmp_path / 'users.db', lambda users: dispatch(users, message(ADMIN_ID, 'вопрос')))
+
+    assert user['role'] == 'admin'
+    assert answers == []
+
+
+def test_unknown_user_is_blocked(tmp_path, answers):
+    assert run(tmp_path / 'users.db', lambda users: dispatch(users, message(STRANGER_ID, '/docs'))) is None
+    assert answers == []
+
+
+def test_unknown_user_may_ask_for_id(tmp_path, answers):
+    assert run(tmp_path / 'users.db', lambda users: dispatch(users, message(STRANGER_ID, '/myid@bot'))) == 'public'
+
+
+def test_unknown_user_gets_denial_on_start(tmp_path, answers):
+    assert run(tmp_path / 'users.db', lambda users: dispatch(users, message(STRANGER_ID, '/start'))) is None
+    assert answers == [("⛔️ Нет доступа. Обратитесь к администратору.", None)]
+
+
+def test_callback_from_unknown_user_is_answered_with_alert(tmp_path, answers):
+    assert run(tmp_path / 'users.db', lambda users: dispatch(users, callback(STRANGER_ID))) is None
+    assert answers == [("⛔️ Нет доступа.", True)]
+
+
+def test_add_and_delete_update_cache_at_once(tmp_path, answers):
+    async def scenario(users):
+        assert await users.add_user(STRANGER_ID, 'Новый', 'HR')
+        added = await dispatch(users, message(STRANGER_ID, 'вопрос'))
+        assert await users.delete_user(STRANGER_ID)
+        return added, await dispatch(users, message(STRANGER_ID, 'вопрос'))
+
+    added, deleted = run(tmp_path / 'users.db', scenario)
+    assert added['department'] == 'HR'
+    assert deleted is None
+
+
+def test_add_without_replace_keeps_existing_user(tmp_path):
+    async def scenario(users):
+        changed = await users.add_user(ADMIN_ID, 'Другое имя', 'HR', replace=False)
+        return changed, users.get(ADMIN_ID)
+
+    changed, user = run(tmp_path / 'users.db', scenario)
+    assert not changed
+    assert user['role'] == 'admin'
+
+
+def test_writes_from_another_connection_are_picked_up(tmp_path):
+    path = tmp_path / 'users.db'
+
+    async def scenario(users):
+        assert not await users.refresh_if_changed()
+        # Другой процесс или ручной SQL
+        async with aiosqlite.connect(str(path)) as db:
+            await db.execute("INSERT INTO users (tg_id, name, department, role) VALUES (?, 'Извне', 'HR', 'user')",
+                             (STRANGER_ID,))
+            await db.commit()
+        assert users.get(STRANGER_ID) is None
+        return await users.refresh_if_changed(), users.get(STRANGER_ID)
+
+    refreshed, user = run(path, scenario)
+    assert refreshed
+    assert user['name'] == 'Извне'
@@ -0,0 +1,33 @@
+"""webhook.py: обновления принимаются только с секретом Telegram"""
+import asyncio
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+import webhook
+from webhook import WebhookServer
+
+
+def post(server, headers):
+    return asyncio.run(server.handle(make_mocked_request('POST', server.path, headers=headers)))
+
+
+def test_server_requires_secret():
+    with pytest.raises(ValueError):
+        WebhookServer(workers=1, secret='')
+
+
+@pytest.mark.parametrize('headers', [{}, {'X-Telegram-Bot-Api-Secret-Token': 'wrong'}])
+def test_update_without_secret_is_forbidden(headers):
+    server = WebhookServer(workers=1, secret='secret')
+
+    assert post(server, headers).status == 403
+    assert server.stats['forbidden'] == 1
+    assert server.depths() == {0: 0}
+
+
+def test_serve_refuses_to_start_without_secret(monkeypatch):
+    monkeypatch.setattr(webhook, 'WEBHOOK_SECRET', None)
+
+    with pytest.raises(SystemExit):
+        asyncio.run(webhook.serve())
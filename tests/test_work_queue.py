@@ -0,0 +1,65 @@
+"""WorkQueue: приоритеты, объединение задач и перенос контекста вызывающего"""
+import asyncio
+import contextvars
+
+from work_queue import PRIORITY_BACKGROUND, WorkQueue
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def test_task_runs_in_caller_context():
+    async def main():
+        queue = WorkQueue(workers=1)
+
+        async def job():
+            return request_id.get()
+
+        request_id.set('req-1')
+        try:
+            return await queue.submit(job)
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(main()) == 'req-1'
+
+
+def test_same_key_is_coalesced():
+    async def main():
+        queue = WorkQueue(workers=2)
+        calls = []
+
+        async def job():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        try:
+            results = await asyncio.gather(*(queue.submit(job, PRIORITY_BACKGROUND, key=('sync',)) for _ in range(3)))
+        finally:
+            await queue.stop()
+        return results, queue.stats['coalesced']
+
+    assert asyncio.run(main()) == ([1, 1, 1], 2)
+
+
+def test_keys_of_different_kinds_are_not_coalesced():
+    async def main():
+        queue = WorkQueue(workers=2)
+
+        async def sync():
+            await asyncio.sleep(0.01)
+            return {'updated': 0, 'deleted': 0, 'errors': 0}
+
+        async def answer():
+            return {'answer': 'ответ', 'sources': []}
+
+        try:
+            # Вопрос «Sync!» нормализуется в «sync» — он не должен получить статистику синхронизации
+            return await asyncio.gather(queue.submit(sync, PRIORITY_BACKGROUND, key=('sync',)),
+                                        queue.submit(answer, key=('search', 'sync')))
+        finally:
+            await queue.stop()
+
+    stats, result = asyncio.run(main())
+    assert 'updated' in stats
+    assert result['sources'] == []
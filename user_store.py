@@ -0,0 +1,140 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiosqlite
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+USERS_DB_PATH = os.getenv('USERS_DB_PATH', 'users.db')
+USERS_REFRESH_INTERVAL = float(os.getenv('USERS_REFRESH_INTERVAL', '30'))  # проверка внешних правок таблицы, сек
+PUBLIC_COMMANDS = ('/myid',)  # доступны без авторизации
+
+
+class UserStore:
+    """Пользователи бота: одно долгоживущее соединение с SQLite (WAL)
+    и кэш профилей в памяти.
+
+    Проверка доступа и роли не обращается к базе. Кэш обновляется сразу при
+    изменениях через этот класс, а правки таблицы извне (другой процесс,
+    ручной SQL) замечаются по PRAGMA data_version в фоновой проверке.
+    """
+
+    def __init__(self, path: str = USERS_DB_PATH):
+        self.path = path
+        self._db: Optional[aiosqlite.Connection] = None
+        self._users: Dict[int, Dict] = {}
+        self._data_version: Optional[int] = None
+        self._write_lock = asyncio.Lock()
+
+    async def open(self):
+        self._db = await aiosqlite.connect(self.path)
+        self._db.row_factory = aiosqlite.Row
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                tg_id INTEGER UNIQUE,
+                name TEXT,
+                department TEXT,
+                role TEXT
+            )
+        """)
+        await self._db.commit()
+        await self.reload()
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def reload(self):
+        """Перечитать таблицу пользователей в кэш"""
+        async with self._db.execute("SELECT tg_id, name, department, role FROM users") as cursor:
+            rows = await cursor.fetchall()
+        self._users = {row['tg_id']: dict(row) for row in rows}
+        self._data_version = await self._get_data_version()
+
+    async def _get_data_version(self) -> int:
+        async with self._db.execute("PRAGMA data_version") as cursor:
+            row = await cursor.fetchone()
+        return row[0]
+
+    async def refresh_if_changed(self) -> bool:
+        """Перечитать кэш, если таблицу меняли в обход этого соединения"""
+        if await self._get_data_version() == self._data_version:
+            return False
+        await self.reload()
+        return True
+
+    async def refresh_loop(self, interval: float = USERS_REFRESH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await self.refresh_if_changed():
+                    print(f"👥 Список пользователей перечитан: {len(self._users)}")
+            except Exception as e:
+                print(f"❌ Ошибка обновления списка пользователей: {e}")
+
+    def get(self, tg_id: int) -> Optional[Dict]:
+        """Профиль пользователя из кэша; None — доступа нет"""
+        return self._users.get(tg_id)
+
+    def list_users(self) -> List[Dict]:
+        return sorted(self._users.values(), key=lambda user: user['tg_id'])
+
+    async def add_user(self, tg_id: int, name: str, department: str, role: str = 'user',
+                       replace: bool = True) -> bool:
+        """Добавление или обновление пользователя.
+
+        replace=False не трогает уже существующую запись. Возвращает True,
+        если таблица изменилась.
+        """
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        async with self._write_lock:
+            cursor = await self._db.execute(
+                f"{verb} INTO users (tg_id, name, department, role) VALUES (?, ?, ?, ?)",
+                (tg_id, name, department, role))
+            await self._db.commit()
+            if cursor.rowcount > 0:
+                self._users[tg_id] = {'tg_id': tg_id, 'name': name, 'department': department, 'role': role}
+            return cursor.rowcount > 0
+
+    async def delete_user(self, tg_id: int) -> bool:
+        async with self._write_lock:
+            cursor = await self._db.execute("DELETE FROM users WHERE tg_id = ?", (tg_id,))
+            await self._db.commit()
+            self._users.pop(tg_id, None)
+            return cursor.rowcount > 0
+
+
+class AuthMiddleware(BaseMiddleware):
+    """Outer-middleware авторизации: профиль берется из кэша UserStore
+    и передается обработчику аргументом user, без обращений к базе.
+
+    Неавторизованным пользователям доступны только PUBLIC_COMMANDS,
+    на /start они получают сообщение об отсутствии доступа. Регистрируется
+    и для сообщений, и для callback-запросов (кнопки под сообщениями).
+    """
+
+    def __init__(self, users: UserStore):
+        self.users = users
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        from_user = getattr(event, 'from_user', None)
+        user = self.users.get(from_user.id) if from_user else None
+        if user is None:
+            if isinstance(event, CallbackQuery):
+                # Без ответа у пользователя крутится индикатор загрузки на кнопке
+                await event.answer("⛔️ Нет доступа.", show_alert=True)
+                return None
+            words = (event.text or '').split(maxsplit=1) if isinstance(event, Message) else []
+            command = words[0].split('@')[0] if words else ''
+            if command in PUBLIC_COMMANDS:
+                return await handler(event, data)
+            if command == '/start':
+                await event.answer("⛔️ Нет доступа. Обратитесь к администратору.")
+            return None
+        data['user'] = user
+        return await handler(event, data)
@@ -0,0 +1,149 @@
+import importlib.util
+import os
+import threading
+from typing import Dict, List, Set, Tuple
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:  # поиск деградирует до простого режима, бот продолжает работать
+    faiss = None
+    np = None
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2')  # пусто — без векторного поиска
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+VECTOR_INDEX_PATH = os.getenv('VECTOR_INDEX_PATH', 'vectors.faiss')
+
+
+class SentenceEmbedder:
+    """Эмбеддинги sentence-transformers; модель загружается при первом обращении"""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return bool(self.model_name) and importlib.util.find_spec('sentence_transformers') is not None
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str]):
+        """Нормированные эмбеддинги float32 — скалярное произведение равно косинусу"""
+        vectors = self.model.encode(texts, batch_size=self.batch_size,
+                                    normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(vectors, dtype='float32')
+
+
+class VectorIndex:
+    """Векторный индекс фрагментов документов на FAISS.
+
+    id векторов совпадают с id фрагментов в DocumentStore, поэтому при изменении
+    документа удаляются и добавляются только его векторы, без перестройки индекса.
+    """
+
+    def __init__(self, path: str = VECTOR_INDEX_PATH, embedder=None):
+        self.path = path
+        self.embedder = embedder or SentenceEmbedder()
+        self._index = None
+        self._dirty = False
+        self._file_stamp = None  # (mtime, размер) файла, перечитанного reload_if_changed
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return faiss is not None and getattr(self.embedder, 'available', True)
+
+    def _get_index(self):
+        if self._index is None:
+            if os.path.exists(self.path):
+                self._index = faiss.read_index(self.path)
+            else:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.embedder.dimension))
+        return self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._get_index().ntotal
+
+    def ids(self) -> Set[int]:
+        with self._lock:
+            return set(faiss.vector_to_array(self._get_index().id_map).tolist())
+
+    def add(self, chunks: List[Dict]):
+        """Добавление фрагментов ({'id', 'text'}); эмбеддинги считаются пачками"""
+        if not chunks:
+            return
+        vectors = self.embedder.encode([chunk['text'] for chunk in chunks])
+        ids = np.array([chunk['id'] for chunk in chunks], dtype='int64')
+        with self._lock:
+            self._get_index().add_with_ids(vectors, ids)
+            self._dirty = True
+
+    def remove(self, chunk_ids: List[int]):
+        if not chunk_ids:
+            return
+        with self._lock:
+            self._get_index().remove_ids(np.array(chunk_ids, dtype='int64'))
+            self._dirty = True
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Топ-k фрагментов по косинусной близости: [(chunk_id, score), ...]"""
+        vector = self.embedder.encode([query])
+        with self._lock:
+            index = self._get_index()
+            if index.ntotal == 0:
+                return []
+            scores, ids = index.search(vector, min(k, index.ntotal))
+        return [(int(chunk_id), float(score)) for chunk_id, score in zip(ids[0], scores[0]) if chunk_id != -1]
+
+    def rebuild(self, store):
+        """Восстановление индекса из фрагментов DocumentStore (если файл индекса потерян)"""
+        with self._lock:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.embedder.dimension))
+        for batch in store.iter_chunks():
+            self.add(batch)
+        with self._lock:
+            self._dirty = True
+
+    def save(self):
+        """Атомарная запись индекса на диск, только если он менялся"""
+        with self._lock:
+            if not self._dirty or self._index is None:
+                return
+            tmp_path = self.path + '.tmp'
+            faiss.write_index(self._index, tmp_path)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать файл, если его заменил другой процесс. True — индекс перечитан.
+
+        Для процессов, которые индекс только читают: файл открывается
+        через mmap в режиме только для чтения, add/remove после этого недоступны.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._file_stamp:
+            return False
+        index = faiss.read_index(self.path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        with self._lock:
+            self._index = index
+            self._file_stamp = stamp
+            self._dirty = False
+        return True
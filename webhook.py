@@ -0,0 +1,266 @@
+import asyncio
+import hmac
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from metrics import METRICS_PORT, CallbackMetric, start_metrics_server
+
+load_dotenv("config.env")
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')  # за обратным прокси; 0.0.0.0 — принимать напрямую
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный https-адрес бота; если задан — webhook регистрируется в Telegram
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # обязателен, сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '2'))  # рабочих процессов
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))  # обновлений в очереди одного процесса
+WEBHOOK_WORKER_CONCURRENCY = int(os.getenv('WEBHOOK_WORKER_CONCURRENCY', '64'))  # обновлений в работе на процесс
+WEBHOOK_START_TIMEOUT = float(os.getenv('WEBHOOK_START_TIMEOUT', '120'))  # запуск рабочих процессов, сек
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))  # дообработка очередей при остановке, сек
+SUPERVISE_INTERVAL = 1.0  # как часто проверять, живы ли рабочие процессы
+
+
+def shard_key(update: Dict) -> int:
+    """Пользователь (или чат), от которого пришло обновление; для прочих — update_id"""
+    for value in update.values():
+        if isinstance(value, dict):
+            for field in ('from', 'user', 'chat'):
+                owner = value.get(field)
+                if isinstance(owner, dict) and isinstance(owner.get('id'), int):
+                    return owner['id']
+    update_id = update.get('update_id')
+    return update_id if isinstance(update_id, int) else 0
+
+
+def run_worker(number: int, updates, workers: int, leader: bool, ready):
+    """Рабочий процесс: обновления из очереди передаются в Dispatcher из main.py"""
+    # Остановкой управляет основной процесс: Ctrl+C и SIGTERM приходят всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_serve_updates(number, updates, workers, leader, ready))
+
+
+async def _serve_updates(number: int, updates, workers: int, leader: bool, ready):
+    import main as app  # у каждого процесса свои соединения, кэши и event loop
+
+    app.rate_limiter.split_global(workers)
+    await app.startup(leader=leader, metrics_port=METRICS_PORT + 1 + number if METRICS_PORT else 0)
+    ready.set()
+    print(f"🤖 Рабочий процесс {number} запущен" + (" (синхронизация документов)" if leader else ""))
+
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(max_workers=1)  # блокирующее чтение очереди — вне event loop
+    slots = asyncio.Semaphore(WEBHOOK_WORKER_CONCURRENCY)
+    tasks = set()
+
+    async def feed(update: Dict):
+        try:
+            await app.dp.feed_raw_update(app.bot, update)
+        except Exception as e:
+            print(f"❌ Ошибка обработки обновления {update.get('update_id')}: {e!r}")
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            # Следующее обновление берем, только когда есть место: остальные ждут в очереди
+            await slots.acquire()
+            update = await loop.run_in_executor(reader, updates.get)
+            if update is None:
+                slots.release()
+                break
+            task = asyncio.create_task(feed(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # Принятые обновления дорабатываются до конца
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        reader.shutdown(wait=False)
+        await app.shutdown()
+    print(f"👋 Рабочий процесс {number} остановлен")
+
+
+class WebhookServer:
+    """Прием обновлений Telegram по HTTP и раздача их рабочим процессам.
+
+    У каждого процесса своя очередь. Обновления одного пользователя всегда
+    попадают в один процесс — сохраняется порядок его сообщений и точно работает
+    его ограничение частоты. Telegram получает ответ сразу после постановки в
+    очередь; если очередь процесса переполнена — 503, и Telegram повторит доставку.
+
+    Процесс 0 синхронизирует документы и пишет индексы, остальные их только
+    читают: documents.db и users.db — общие SQLite в режиме WAL, файлы индексов
+    заменяются атомарно и перечитываются (FAISS — через mmap).
+
+    Запрос без верного секрета отклоняется (403): иначе любой, кто достучится
+    до порта, сможет прислать обновление от имени администратора.
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+        if not secret:
+            raise ValueError("Не задан секрет webhook (WEBHOOK_SECRET)")
+        self.workers = workers
+        self.path = path
+        self.secret = secret
+        # spawn: рабочие процессы не наследуют event loop и потоки основного
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._ready = [self._context.Event() for _ in range(workers)]
+        self._processes: List = [None] * workers
+        self._runner = None
+        self._supervisor = None
+        self._stopping = False
+        self.stats = {'queued': 0, 'rejected': 0, 'forbidden': 0, 'restarts': 0}
+
+    def _start_worker(self, number: int):
+        self._ready[number].clear()
+        process = self._context.Process(
+            target=run_worker, name=f'bot-worker-{number}',
+            args=(number, self._queues[number], self.workers, number == 0, self._ready[number]))
+        process.start()
+        self._processes[number] = process
+
+    def _wait_ready(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        for number, event in enumerate(self._ready):
+            if not event.wait(max(0.0, deadline - time.monotonic())):
+                raise RuntimeError(f"Рабочий процесс {number} не запустился за {timeout:.0f} с")
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                    timeout: float = WEBHOOK_START_TIMEOUT):
+        for number in range(self.workers):
+            self._start_worker(number)
+        # Порт открывается, когда все процессы готовы обрабатывать обновления
+        try:
+            await asyncio.to_thread(self._wait_ready, timeout)
+        except BaseException:
+            for process in self._processes:
+                process.terminate()
+            raise
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.secret):
+            self.stats['forbidden'] += 1
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        try:
+            self._queues[shard_key(update) % self.workers].put_nowait(update)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            return web.Response(status=503)
+        self.stats['queued'] += 1
+        return web.Response()
+
+    def depths(self) -> Dict[int, int]:
+        return {number: updates.qsize() for number, updates in enumerate(self._queues)}
+
+    async def _supervise(self):
+        """Упавший рабочий процесс перезапускается; его очередь остается в основном процессе"""
+        while not self._stopping:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for number, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stopping:
+                    print(f"⚠️ Рабочий процесс {number} завершился (код {process.exitcode}), перезапуск")
+                    self.stats['restarts'] += 1
+                    self._start_worker(number)
+
+    async def stop(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Плавная остановка: новые обновления не принимаются, принятые дообрабатываются"""
+        self._stopping = True
+        if self._supervisor:
+            self._supervisor.cancel()
+        if self._runner:
+            # Закрывает порт и дожидается ответов на уже полученные запросы
+            await self._runner.cleanup()
+        await asyncio.to_thread(self._drain, timeout)
+
+    def _drain(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        for updates in self._queues:
+            try:
+                # None — после него процесс заканчивает принятые обновления и завершается
+                updates.put(None, timeout=max(0.1, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for number, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"⚠️ Рабочий процесс {number} не успел дообработать очередь за {timeout:.0f} с, остановка")
+                process.terminate()
+                process.join()
+
+
+async def register_webhook(url: str, secret: str = WEBHOOK_SECRET):
+    """Сообщить Telegram адрес webhook (setWebhook)"""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    api_url = os.getenv('TELEGRAM_API_URL')
+    bot = Bot(token=os.getenv('TELEGRAM_TOKEN'),
+              session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None)
+    try:
+        await bot.set_webhook(url, secret_token=secret)
+    finally:
+        await bot.session.close()
+
+
+async def serve():
+    if not WEBHOOK_SECRET:
+        raise SystemExit("❌ Задайте WEBHOOK_SECRET: без него обновления от имени любого пользователя "
+                         "сможет прислать кто угодно")
+    server = WebhookServer()
+    CallbackMetric('bot_webhook_updates_total', 'Обновления, полученные через webhook',
+                   lambda: {(outcome,): server.stats[outcome] for outcome in ('queued', 'rejected', 'forbidden')},
+                   kind='counter', labelnames=['outcome'])
+    CallbackMetric('bot_webhook_queue_depth', 'Обновлений в очереди рабочего процесса',
+                   lambda: {(str(number),): depth for number, depth in server.depths().items()},
+                   labelnames=['worker'])
+    CallbackMetric('bot_webhook_worker_restarts_total', 'Перезапуски упавших рабочих процессов',
+                   lambda: server.stats['restarts'], kind='counter')
+
+    print(f"⏳ Запуск {server.workers} рабочих процессов...")
+    await server.start()
+    metrics_runner = await start_metrics_server()
+    if WEBHOOK_URL:
+        await register_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH)
+    print(f"🌐 Webhook: http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, процессов {server.workers}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        print("⏳ Остановка: дообрабатываем принятые обновления...")
+        await server.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        print("👋 Webhook остановлен")
+
+
+if __name__ == '__main__':
+    asyncio.run(serve())
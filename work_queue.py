@@ -0,0 +1,113 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from metrics import Histogram
+
+WORK_QUEUE_WORKERS = int(os.getenv('WORK_QUEUE_WORKERS', '4'))  # одновременных задач LLM/Drive
+PRIORITY_INTERACTIVE = 0  # пользователь ждет ответа
+PRIORITY_BACKGROUND = 10  # синхронизация и прочая фоновая работа
+WAIT_SAMPLES = 1000  # сколько последних ожиданий хранить для перцентилей
+
+QUEUE_WAIT_SECONDS = Histogram('bot_work_queue_wait_seconds', 'Ожидание задачи в очереди LLM/Drive', ['priority'])
+
+
+class WorkQueue:
+    """Очередь с приоритетами для дорогой работы (запросы к LLM и Google Drive).
+
+    Задачи выполняются не более чем workers одновременно, меньший priority —
+    раньше. Задачи с одинаковым key, пока первая не завершилась, не ставятся
+    повторно: все вызывающие получают один и тот же результат. Задачи разного
+    рода должны отличаться ключом — например, кортежем (вид, значение).
+    """
+
+    def __init__(self, workers: int = WORK_QUEUE_WORKERS):
+        self.workers = workers
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._sequence = itertools.count()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.running = 0
+        self.stats = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0}
+
+    def start(self):
+        """Запуск обработчиков в текущем event loop"""
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, func: Callable[[], Awaitable[Any]], priority: int = PRIORITY_INTERACTIVE,
+                     key: Optional[Hashable] = None) -> Any:
+        """Выполнить func() в очереди и дождаться результата.
+
+        Если задача с тем же key уже в очереди или выполняется, новая не
+        создается — ждем результат существующей.
+        """
+        if key is not None and key in self._inflight:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(self._inflight[key])
+
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+        self.stats['submitted'] += 1
+        # Контекст вызывающего (трассировка запроса) переходит в задачу обработчика
+        self._queue.put_nowait((priority, next(self._sequence), time.monotonic(), func, future,
+                                contextvars.copy_context()))
+        # shield: отмена одного ожидающего не отменяет общую задачу для остальных
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    async def _worker(self):
+        while True:
+            priority, _, enqueued, func, future, context = await self._queue.get()
+            wait = time.monotonic() - enqueued
+            self._waits.append(wait)
+            QUEUE_WAIT_SECONDS.observe(wait, priority)
+            if future.done():
+                continue
+            self.running += 1
+            try:
+                # create_task(context=...) есть только с Python 3.11; задача берет текущий контекст
+                result = await context.run(lambda: asyncio.create_task(func()))
+                if not future.done():
+                    future.set_result(result)
+                self.stats['completed'] += 1
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                self.stats['failed'] += 1
+            finally:
+                self.running -= 1
+
+    def report(self) -> Dict:
+        """Глубина очереди и время ожидания (сек) — для планирования под лимиты OpenAI"""
+        waits = sorted(self._waits)
+        stats = dict(self.stats)
+        stats['depth'] = self._queue.qsize() if self._queue else 0
+        stats['running'] = self.running
+        stats['workers'] = self.workers
+        stats['wait_avg'] = sum(waits) / len(waits) if waits else 0.0
+        stats['wait_p95'] = waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else 0.0
+        stats['wait_max'] = waits[-1] if waits else 0.0
+        return stats